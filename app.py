@@ -1,10 +1,20 @@
-from flask import Flask, request, send_from_directory
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 import os
 from dotenv import load_dotenv
 from user_message_handler import MessageHandler
+from event_dispatcher import EventDispatcher
+from session_store import create_session_store
+from batch_settlement import create_pool, read_jsonl, settle_ledger, settle_stream
+from chart_cache import ChartCache, choose_encoding
+from artifact_store import create_artifact_store
+from line_client import create_line_bot_api
+from webhook_dedup import create_webhook_deduplicator
+import metrics
+import json
+import logging
 import threading
 import time
 import requests
@@ -14,6 +24,11 @@ from aws_lambda_wsgi import response
 # 載入環境變數，從 .env 檔案中讀取設定
 load_dotenv()
 
+# 日誌等級；每個請求結束時會以 INFO 輸出一行含各階段耗時的 JSON
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL)
+logging.getLogger().setLevel(LOG_LEVEL)  # Lambda 已預先設定 root handler，basicConfig 不會生效
+
 # 初始化 Flask 應用
 app = Flask(__name__)
 
@@ -21,14 +36,84 @@ app = Flask(__name__)
 STATIC_DIR = os.path.join(os.getcwd(), "static", "charts")
 os.makedirs(STATIC_DIR, exist_ok=True)  # 確保資料夾存在
 
+# 圖表的記憶體快取與瀏覽器快取期限
+CHART_MEMORY_CACHE_BYTES = int(os.getenv("CHART_MEMORY_CACHE_BYTES", str(32 * 1024 * 1024)))
+CHART_MAX_AGE = int(os.getenv("CHART_MAX_AGE", str(365 * 24 * 3600)))
+artifact_store = create_artifact_store(STATIC_DIR)  # 圖表儲存：本機資料夾或 S3 相容物件儲存
+chart_cache = ChartCache(artifact_store, max_bytes=CHART_MEMORY_CACHE_BYTES)
+
 # 初始化 LINE Bot API 和 Webhook Handler
 BASE_URL = os.getenv("BASE_URL", "http://localhost:5000")  # BASE_URL 可動態從環境變數讀取
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))  # LINE Bot API 金鑰
+line_bot_api = create_line_bot_api(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))  # LINE Bot API 金鑰（共用連線池、失敗重試）
 handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))  # LINE Webhook 密鑰
 
 # 初始化 MessageHandler
-user_context = {}  # 用於儲存每個使用者的上下文資料
-response_handler = MessageHandler(line_bot_api, user_context)  # 負責處理訊息邏輯
+user_context = create_session_store()  # 用於儲存每個使用者的上下文資料（可設定後端與過期時間）
+response_handler = MessageHandler(line_bot_api, user_context, artifact_store=artifact_store)  # 負責處理訊息邏輯
+
+# 非同步模式：/callback 只驗證簽名並將事件放入背景佇列，立即回應 LINE
+# 注意：Lambda 在回應後會凍結執行環境，背景執行緒無法繼續工作，因此預設關閉
+ASYNC_WEBHOOK = os.getenv("ASYNC_WEBHOOK", "false").lower() in ("1", "true", "yes")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))        # 背景工作執行緒（分片）數量
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))  # 事件佇列上限
+
+def process_event(event):
+    """
+    處理單一事件（同步模式直接呼叫，非同步模式由背景工作執行緒呼叫）。
+    只處理文字訊息事件。
+    """
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        response_handler.handle_message(event)
+
+def process_event_traced(event):
+    """背景工作執行緒使用：處理單一事件並記錄各階段耗時"""
+    metrics.start_trace("event", event_type=getattr(event, "type", None))
+    status = "error"
+    try:
+        process_event(event)
+        status = "ok"
+    finally:
+        metrics.finish_trace(status=status)
+
+webhook_dedup = create_webhook_deduplicator()  # 已受理的 webhookEventId（記憶體或與 session 共用的 SQLite）
+
+dispatcher = None
+if ASYNC_WEBHOOK:
+    dispatcher = EventDispatcher(process_event_traced, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+    dispatcher.start()
+
+# /metrics 設定：設定 METRICS_API_TOKEN 後需以 Bearer token 讀取
+METRICS_API_TOKEN = os.getenv("METRICS_API_TOKEN")
+
+def _cache_stats(attr):
+    """回傳 {(快取名稱,): 數值} 供 gauge 使用"""
+    caches = {"openai_response": response_handler.response_cache, "chart": chart_cache}
+    return {(name,): cache.stats()[attr] for name, cache in caches.items()}
+
+metrics.register_gauge("linebuddysplit_cache_hits_total", "快取命中次數",
+                       lambda: _cache_stats("hits"), ("cache",), kind="counter")
+metrics.register_gauge("linebuddysplit_cache_misses_total", "快取未命中次數",
+                       lambda: _cache_stats("misses"), ("cache",), kind="counter")
+metrics.register_gauge("linebuddysplit_cache_hit_ratio", "快取命中率",
+                       lambda: _cache_stats("hit_rate"), ("cache",))
+metrics.register_gauge("linebuddysplit_webhook_duplicates_total", "被略過的 LINE 重送事件數",
+                       lambda: webhook_dedup.duplicates, kind="counter")
+metrics.register_gauge("linebuddysplit_line_retries_total", "LINE API 暫時性錯誤的重試次數",
+                       lambda: getattr(line_bot_api.http_client, "retries", 0), kind="counter")
+if dispatcher is not None:
+    metrics.register_gauge("linebuddysplit_queue_depth", "背景佇列中等待處理的事件數", dispatcher.qsize)
+    metrics.register_gauge("linebuddysplit_queue_rejected_total", "因佇列已滿而拒收的事件數",
+                           lambda: dispatcher.rejected, kind="counter")
+
+@app.before_request
+def start_request_trace():
+    metrics.start_trace(request.endpoint or "unknown", method=request.method)
+
+@app.after_request
+def finish_request_trace(resp):
+    # 串流回應（/settle NDJSON）只計到開始傳送為止
+    metrics.finish_trace(status=resp.status_code)
+    return resp
 
 @app.route('/')
 def index():
@@ -43,27 +128,114 @@ def callback():
     """
     signature = request.headers.get("X-Line-Signature", "")  # 獲取請求頭中的簽名
     body = request.get_data(as_text=True)  # 獲取請求的主要內容
+
+    # 驗證簽名並解析事件；LINE 重送的事件（webhookEventId 已受理過）直接略過
     try:
-        handler.handle(body, signature)  # 處理請求內容
+        with metrics.stage("signature"):
+            events = webhook_dedup.parse(handler.parser, body, signature)
     except InvalidSignatureError:
-        return "Invalid signature", 400  # 如果簽名驗證失敗，返回錯誤代碼
+        return "Invalid signature", 400
+    metrics.annotate(events=len(events))
+
+    if dispatcher is not None:
+        # 非同步模式：將事件交給背景工作執行緒，立即回應
+        if not dispatcher.submit(event for _, event in events):
+            # 佇列已滿：整批拒收並釋放事件 ID，回應 503 讓 LINE 稍後重送
+            for event_id, _ in events:
+                webhook_dedup.release(event_id)
+            return "Service busy", 503
+        return "OK", 200
+
+    for i, (event_id, event) in enumerate(events):
+        try:
+            process_event(event)
+        except Exception:
+            # 處理失敗：釋放此筆及尚未處理的事件 ID，讓 LINE 重送時重新處理
+            for pending_id, _ in events[i:]:
+                webhook_dedup.release(pending_id)
+            raise
     return "OK", 200  # 成功處理後返回 200 狀態碼
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_line_message(event):
+# 批次結算 API 設定
+SETTLE_WORKERS = int(os.getenv("SETTLE_WORKERS", "0"))  # 行程池大小，0 表示在請求執行緒中依序處理
+SETTLE_API_TOKEN = os.getenv("SETTLE_API_TOKEN")        # 呼叫 /settle 需帶的 Bearer token；未設定時停用 /settle
+# 所有 /settle 請求共用的行程池（工作行程在第一次使用時才啟動）
+settle_pool = create_pool(SETTLE_WORKERS) if SETTLE_WORKERS > 0 else None
+
+@app.route("/settle", methods=["POST"])
+def settle():
     """
-    處理來自 LINE 的文字訊息事件。
-    使用 MessageHandler 負責具體的業務邏輯。
+    無介面的批次結算 API：
+    - application/json 單一帳本 => 回傳單一 JSON 結果
+    - application/json {"ledgers": [...]} 或 application/x-ndjson（每行一本帳）
+      => 以 NDJSON 串流回傳，完成一筆輸出一筆
+    加上 ?charts=1 會同時生成圖表並附上連結（與 webhook 相同：寫入 artifact_store，
+    物件儲存回傳預簽網址，本機儲存則經由 /chart 路由）。
+    結算耗用大量 CPU 且可寫入圖表，未設定 SETTLE_API_TOKEN 時停用（404）。
     """
-    response_handler.handle_message(event)
+    if not SETTLE_API_TOKEN:
+        abort(404)
+    if request.headers.get("Authorization") != f"Bearer {SETTLE_API_TOKEN}":
+        abort(401)
+    store = artifact_store if request.args.get("charts") == "1" else None
+
+    def with_chart_url(result):
+        if result.get("chart_name"):
+            name = result.pop("chart_name")
+            result["chart_url"] = artifact_store.url(name) or f"{BASE_URL}/chart/{name}"
+        return result
+
+    if request.mimetype == "application/x-ndjson":
+        ledgers = read_jsonl(line.decode("utf-8") for line in request.stream)
+    else:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "請傳入 JSON 物件。"}), 400
+        if "ledgers" not in payload:
+            result = with_chart_url(settle_ledger(payload, artifact_store=store))
+            return jsonify(result), (400 if "error" in result else 200)
+        if not isinstance(payload["ledgers"], list):
+            return jsonify({"error": "ledgers 必須是陣列。"}), 400
+        ledgers = iter(payload["ledgers"])
+
+    def generate():
+        for result in settle_stream(ledgers, SETTLE_WORKERS, artifact_store=store, pool=settle_pool):
+            yield json.dumps(with_chart_url(result), ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.route('/chart/<filename>')
 def serve_chart(filename):
     """
     提供靜態圖表文件的路由。
     用戶可以通過此端點訪問生成的圖表。
+    圖表檔名由內容雜湊決定、產生後不再變動，因此：
+    - 由記憶體快取直接回應，並依 Accept-Encoding 回傳預先壓縮的版本
+    - 附上強 ETag，條件式請求（If-None-Match）命中時回應 304
+    - 設定長效 Cache-Control，同一連結重複開啟時由瀏覽器快取提供
     """
-    return send_from_directory(STATIC_DIR, filename, mimetype='text/html')
+    entry = chart_cache.get(filename) if filename.endswith(".html") else None
+    if entry is None:
+        abort(404)
+    encoding = choose_encoding(entry, request.accept_encodings)
+    etag = entry.etag if encoding == "identity" else f"{entry.etag}-{encoding}"
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={CHART_MAX_AGE}, immutable",
+        "Vary": "Accept-Encoding"
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(entry.bodies[encoding], mimetype="text/html", headers=headers)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """以 Prometheus 文字格式輸出各階段延遲、佇列長度、快取命中率與 OpenAI token 用量"""
+    if METRICS_API_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_API_TOKEN}":
+        abort(401)
+    return Response(metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 # 新增 Lambda 入口點
 def lambda_handler(event, context):
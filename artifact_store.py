@@ -0,0 +1,245 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from chart_cache import ENCODING_SUFFIXES
+
+CHART_PREFIX = "charts_"
+
+# 本機圖表資料夾的容量與保存期限（超過即由 collect_garbage 清除）
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+CHART_CACHE_MAX_AGE = int(os.getenv("CHART_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+# 依副檔名決定物件的 Content-Type / Content-Encoding
+CONTENT_ENCODINGS = {suffix: encoding for encoding, suffix in ENCODING_SUFFIXES.items()}
+CONTENT_TYPES = {".html": "text/html; charset=utf-8", ".json": "application/json"}
+
+
+def content_headers(name):
+    """由檔名推得 (Content-Type, Content-Encoding)；未壓縮時 Content-Encoding 為 None"""
+    base, ext = os.path.splitext(name)
+    encoding = CONTENT_ENCODINGS.get(ext)
+    if encoding is not None:
+        ext = os.path.splitext(base)[1]
+    return CONTENT_TYPES.get(ext, "application/octet-stream"), encoding
+
+
+def collect_garbage(output_dir, max_bytes=CHART_CACHE_MAX_BYTES, max_age=CHART_CACHE_MAX_AGE, keep=()):
+    """
+    清理圖表資料夾：
+    1. 刪除超過 max_age 秒未使用的圖表
+    2. 總容量仍超過 max_bytes 時，從最久未使用的開始刪除
+    圖表與其預先壓縮檔（.gz / .br）視為一組，一起保留或刪除。
+    keep 中的檔名不會被刪除。回傳刪除的檔案數。
+    """
+    now = time.time()
+    groups = {}  # 圖表檔名 -> [最後使用時間, 總大小, [路徑...]]（含預先壓縮檔）
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if not entry.is_file() or not entry.name.startswith(CHART_PREFIX):
+                continue
+            name = entry.name
+            for suffix in CONTENT_ENCODINGS:
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            if name in keep:
+                continue
+            st = entry.stat()
+            group = groups.setdefault(name, [0.0, 0, []])
+            group[0] = max(group[0], st.st_mtime)
+            group[1] += st.st_size
+            group[2].append(entry.path)
+
+    removed = 0
+    total = sum(size for _, size, _ in groups.values())
+    for mtime, size, paths in sorted(groups.values()):
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        total -= size
+    return removed
+
+
+class ArtifactStore:
+    """
+    生成檔案（圖表）的儲存介面：
+    ChartGenerator 透過 write_many() 寫入，serve_chart 透過 read() 讀取。
+    url() 回傳可直接下載的網址；回傳 None 表示需經由 /chart/<檔名> 提供。
+    """
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def read(self, name):
+        """讀取檔案內容；不存在則回傳 None"""
+        raise NotImplementedError
+
+    def write_many(self, artifacts):
+        """一次寫入多個檔案：artifacts 為 [(檔名, 位元組)]，依序寫入"""
+        raise NotImplementedError
+
+    def touch(self, name):
+        """標記檔案被重複使用（本機後端據此延後清理）"""
+
+    def url(self, name):
+        return None
+
+
+class LocalArtifactStore(ArtifactStore):
+    """
+    本機資料夾儲存（預設）。
+    寫入後依容量與保存期限清理舊圖表；僅同一台機器（容器）可讀到寫入的檔案。
+    """
+
+    def __init__(self, directory, max_bytes=CHART_CACHE_MAX_BYTES, max_age=CHART_CACHE_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def read(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def write_many(self, artifacts):
+        os.makedirs(self.directory, exist_ok=True)
+        names = []
+        for name, data in artifacts:
+            # 先寫入暫存檔再改名，避免同時請求讀到寫到一半的檔案
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp_")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(name))
+            names.append(name)
+        collect_garbage(self.directory, self.max_bytes, self.max_age, keep=tuple(names))
+
+    def touch(self, name):
+        try:
+            os.utime(self._path(name))  # 更新使用時間，避免被清理
+        except FileNotFoundError:
+            pass
+
+
+class S3ArtifactStore(ArtifactStore):
+    """
+    S3 相容物件儲存（AWS S3、MinIO 等），多個 Lambda 容器共用同一份圖表。
+    - write_many() 以執行緒池平行上傳，並依副檔名設定 Content-Type / Content-Encoding
+    - url() 回傳有時效的預簽網址（指向 gzip 版本），瀏覽器直接向物件儲存下載，不經過 Flask
+    過期圖表的清理交由 bucket 的生命週期規則處理。
+    """
+
+    NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+
+    def __init__(self, bucket, prefix="charts/", client=None, endpoint_url=None,
+                 url_ttl=7 * 24 * 3600, upload_workers=4):
+        self.endpoint_url = endpoint_url
+        self._own_client = client is None  # 自行建立的 client 可在其他行程中重建
+        self.client = client if client is not None else self._create_client()
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_ttl = url_ttl
+        self.upload_workers = upload_workers
+
+    def _create_client(self):
+        import boto3  # 延遲載入：只有使用 S3 後端時才需要
+        return boto3.client("s3", endpoint_url=self.endpoint_url)
+
+    def __getstate__(self):
+        # 傳入工作行程（例如 /settle 的行程池）時不複製 boto3 client，於對方行程重建
+        state = dict(self.__dict__)
+        if self._own_client:
+            state["client"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.client is None:
+            self.client = self._create_client()
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+    def _is_not_found(self, error):
+        response = getattr(error, "response", None) or {}
+        return str(response.get("Error", {}).get("Code")) in self.NOT_FOUND_CODES
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+            return True
+        except Exception as e:
+            if self._is_not_found(e):
+                return False
+            raise
+
+    def read(self, name):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return obj["Body"].read()
+
+    def _put(self, name, data):
+        content_type, encoding = content_headers(name)
+        params = dict(
+            Bucket=self.bucket,
+            Key=self._key(name),
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable"
+        )
+        if encoding is not None:
+            params["ContentEncoding"] = encoding
+        self.client.put_object(**params)
+
+    def write_many(self, artifacts):
+        artifacts = list(artifacts)
+        # 主檔案最後上傳：主檔案存在即代表其他版本都已上傳完成
+        *variants, main = artifacts
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as pool:
+            list(pool.map(lambda a: self._put(*a), variants))
+        self._put(*main)
+
+    def url(self, name):
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(name + ENCODING_SUFFIXES["gzip"])},
+            ExpiresIn=self.url_ttl
+        )
+
+
+def create_artifact_store(directory):
+    """
+    依環境變數建立圖表儲存：
+    ARTIFACT_BACKEND=local（預設，存於 directory）或 s3
+    ARTIFACT_BUCKET / ARTIFACT_PREFIX：s3 後端的 bucket 與物件前綴
+    ARTIFACT_ENDPOINT_URL：S3 相容服務的網址（例如本機 MinIO），未設定則使用 AWS S3
+    ARTIFACT_URL_TTL：預簽網址有效時間（秒，S3 上限為 7 天）
+    """
+    backend = os.getenv("ARTIFACT_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3ArtifactStore(
+            os.environ["ARTIFACT_BUCKET"],
+            prefix=os.getenv("ARTIFACT_PREFIX", "charts/"),
+            endpoint_url=os.getenv("ARTIFACT_ENDPOINT_URL") or None,
+            url_ttl=int(os.getenv("ARTIFACT_URL_TTL", str(7 * 24 * 3600)))
+        )
+    if backend == "local":
+        return LocalArtifactStore(directory)
+    raise ValueError(f"未知的 ARTIFACT_BACKEND：{backend}")
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, wait
+from lazy_import import lazy_import
+from ledger_parser import SECTION_TITLES, parse_canonical_input, parse_ledger
+from message_processor import ExpenseManager
+from process_pool import create_process_pool
+
+
+def build_manager(ledger, engine="python", transfer_mode="greedy"):
+    """
+    依 JSON 帳本建立 ExpenseManager 並載入資料，支援兩種格式：
+    1. 結構化：{"members": [...], "payments": [{"payer", "amount", "item"}], "exclusions": {項目: [成員...]}}
+    2. 文字：{"text": "成員有...\\nX付了Y元Z\\n項目沒..."}（標準格式或三段式）
+    """
+    manager = ExpenseManager(engine=engine, transfer_mode=transfer_mode)
+    if "text" in ledger:
+        sections = parse_canonical_input(ledger["text"])
+        if sections is not None:
+            manager.process_members(sections[0])
+            manager.process_payments(sections[1])
+            manager.process_splits(sections[2])
+        elif any(title in ledger["text"] for title in SECTION_TITLES):
+            # 三段式（與 MessageHandler 相同：單次掃描解析後載入）
+            manager.load_ledger(parse_ledger(ledger["text"]))
+        else:
+            raise ValueError("無法解析帳本文字，請使用標準格式或三段式。")
+    else:
+        manager.process_members("、".join(ledger.get("members", [])))
+        for p in ledger.get("payments", []):
+            manager.add_payment(p["payer"], p["amount"], p["item"])
+        for item, names in ledger.get("exclusions", {}).items():
+            manager.exclude(item, names)
+    return manager
+
+
+def settle_ledger(ledger, charts_dir=None, engine="python", transfer_mode="greedy", artifact_store=None):
+    """
+    結算單一帳本並回傳可序列化為 JSON 的結果（在工作行程中執行）。
+    artifact_store 有值時同時生成圖表並寫入該儲存（結果附上 chart_name），
+    否則 charts_dir 有值時輸出至本機資料夾（結果附上 chart_path）；錯誤不拋出，而是記錄於結果的 error 欄位。
+    """
+    if not isinstance(ledger, dict):
+        return {"id": None, "error": "帳本必須是 JSON 物件。"}
+    result = {"id": ledger.get("id")}
+    if "invalid" in ledger:
+        result["error"] = ledger["invalid"]
+        return result
+    try:
+        manager = build_manager(ledger, engine=engine, transfer_mode=transfer_mode)
+        result["output"] = manager.calculate_and_format()
+        summary = manager.get_summary()
+        result["balances"] = summary["balances"]
+        result["transfers"] = summary["transfers"]
+        if artifact_store is not None or charts_dir:
+            ChartGenerator = lazy_import("expense_chart_generator").ChartGenerator
+            if artifact_store is not None:
+                result["chart_name"] = ChartGenerator(summary).publish(artifact_store)
+            else:
+                result["chart_path"] = ChartGenerator(summary).generate_charts(output_dir=charts_dir)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def create_pool(workers=None):
+    """
+    建立結算用的行程池（forkserver / spawn，見 process_pool）。
+    伺服器應於啟動時建立一次並重複使用，不必每個請求重新啟動工作行程。
+    """
+    return create_process_pool(workers)
+
+
+def settle_stream(ledgers, workers=None, charts_dir=None, engine="python", transfer_mode="greedy",
+                  artifact_store=None, pool=None):
+    """
+    以行程池平行結算一連串帳本，完成一筆就產出一筆（順序不保證與輸入相同）。
+    同時送出的工作數限制為 workers 的兩倍，不論輸入多大，記憶體用量都維持固定。
+    workers=0 時在目前行程依序處理（適合小量資料或除錯）；artifact_store 會傳入工作行程，需可 pickle。
+    pool：共用的行程池（見 create_pool），未指定時建立一個並於結束時關閉。
+    """
+    if workers == 0:
+        for ledger in ledgers:
+            yield settle_ledger(ledger, charts_dir, engine, transfer_mode, artifact_store)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if pool is None:
+        with create_pool(workers) as own_pool:
+            yield from settle_stream(ledgers, workers, charts_dir, engine, transfer_mode, artifact_store, own_pool)
+        return
+
+    pending = set()
+    try:
+        for ledger in ledgers:
+            pending.add(pool.submit(settle_ledger, ledger, charts_dir, engine, transfer_mode, artifact_store))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # 呼叫端提前結束（例如 HTTP 用戶端中斷串流）時，取消尚未開始的工作，共用的行程池不被佔用
+        for future in pending:
+            future.cancel()
+
+
+def read_jsonl(stream):
+    """逐行讀取 JSONL，略過空行；格式錯誤的行以帶有 invalid 欄位的項目表示"""
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"id": f"line-{line_no}", "invalid": str(e)}
+
+
+def main(argv=None):
+    """命令列入口：python batch_settlement.py ledgers.jsonl -o results.jsonl --workers 4"""
+    parser = argparse.ArgumentParser(description="批次結算 JSONL 帳本")
+    parser.add_argument("input", nargs="?", default="-", help="輸入 JSONL 檔案（預設為標準輸入）")
+    parser.add_argument("-o", "--output", default="-", help="輸出 JSONL 檔案（預設為標準輸出）")
+    parser.add_argument("--workers", type=int, default=None, help="工作行程數（0 表示不使用行程池）")
+    parser.add_argument("--charts-dir", default=None, help="同時生成圖表並輸出至此資料夾")
+    parser.add_argument("--engine", default="python", choices=("python", "numpy"), help="分帳計算引擎")
+    parser.add_argument("--transfer-mode", default="greedy", choices=("greedy", "optimal"), help="轉帳方案")
+    args = parser.parse_args(argv)
+
+    src = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    failed = 0
+    try:
+        ledgers = read_jsonl(src)
+        for result in settle_stream(ledgers, args.workers, args.charts_dir, args.engine, args.transfer_mode):
+            failed += "error" in result
+            dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+            dst.flush()
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
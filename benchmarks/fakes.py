@@ -0,0 +1,89 @@
+"""
+基準測試與壓力測試用的假 LINE / OpenAI client：不連網路，可設定固定延遲。
+介面與 MessageHandler 實際使用的 LineBotApi、OpenAIClient 相同，可直接替換。
+"""
+import asyncio
+import itertools
+import threading
+import time
+from linebot.models import MessageEvent
+
+_message_ids = itertools.count(1)
+
+
+class FakeLineBotApi:
+    """記錄 reply / push 次數的 LineBotApi；latency 模擬每次 API 呼叫的網路延遲（秒）"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.replies = 0
+        self.pushes = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def _call(self, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        count = len(messages) if isinstance(messages, (list, tuple)) else 1
+        with self._lock:
+            self.messages += count
+
+    def reply_message(self, reply_token, messages, notification_disabled=False, timeout=None):
+        self._call(messages)
+        with self._lock:
+            self.replies += 1
+
+    def push_message(self, to, messages, retry_key=None, notification_disabled=False, timeout=None):
+        self._call(messages)
+        with self._lock:
+            self.pushes += 1
+
+
+class FakeOpenAIClient:
+    """
+    回傳固定內容的 OpenAIClient。
+    reply 為字串，或接收使用者訊息、回傳字串的函式（例如依輸入產生三段式解析結果）。
+    """
+
+    def __init__(self, reply, latency=0.0):
+        self.reply = reply
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _content(self, messages):
+        with self._lock:
+            self.calls += 1
+        user_message = messages[-1]["content"]
+        return self.reply(user_message) if callable(self.reply) else self.reply
+
+    def chat(self, messages, timeout=None, **params):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._content(messages)
+
+    async def achat(self, messages, timeout=None, **params):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._content(messages)
+
+
+def text_event_dict(user_id, text, reply_token=None, event_id=None, timestamp=0):
+    """LINE webhook 文字訊息事件的 JSON 內容"""
+    message_id = next(_message_ids)
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": timestamp,
+        "replyToken": reply_token or f"reply-{message_id}",
+        "source": {"type": "user", "userId": user_id},
+        "message": {"type": "text", "id": str(message_id), "text": text},
+    }
+    if event_id is not None:
+        event["webhookEventId"] = event_id
+    return event
+
+
+def text_event(user_id, text, reply_token=None):
+    """建立可直接交給 MessageHandler.handle_message 的 MessageEvent"""
+    return MessageEvent.new_from_json_dict(text_event_dict(user_id, text, reply_token))
@@ -0,0 +1,68 @@
+"""
+基準測試用的合成帳本：依成員數與付款筆數產生可重現（固定亂數種子）的資料。
+同一份帳本可轉成 /settle 的結構化 JSON、ExpenseManager 的三段式資料，或聊天室的標準格式文字。
+"""
+import random
+from collections import OrderedDict
+
+# 帳本規模：名稱 -> (成員數, 付款筆數)
+SIZES = OrderedDict([
+    ("tiny", (3, 10)),
+    ("small", (20, 200)),
+    ("medium", (200, 2000)),
+    ("large", (1000, 10000)),
+    ("huge", (10000, 50000)),
+])
+DEFAULT_SIZES = ("tiny", "small", "medium")
+
+
+def make_ledger(members, payments, exclusion_ratio=0.3, max_excluded=5, seed=0):
+    """
+    產生合成帳本（/settle 的結構化格式）：
+    - 成員名稱為 M00001 形式（不含「付了」、「沒」、頓號等保留字）
+    - 每筆付款的項目名稱不重複，金額約 1 成帶有小數
+    - exclusion_ratio 比例的付款排除 1 至 max_excluded 位非付款人的成員
+    """
+    rng = random.Random(seed)
+    names = [f"M{i:05d}" for i in range(1, members + 1)]
+    ledger = {"members": names, "payments": [], "exclusions": {}}
+    for j in range(1, payments + 1):
+        payer = rng.choice(names)
+        amount = rng.randint(1, 5000)
+        if rng.random() < 0.1:
+            amount += rng.randint(1, 99) / 100
+        item = f"項目{j}"
+        ledger["payments"].append({"payer": payer, "amount": amount, "item": item})
+        if members > 1 and rng.random() < exclusion_ratio:
+            k = rng.randint(1, min(max_excluded, members - 1))
+            ledger["exclusions"][item] = _sample_excluding(rng, names, payer, k)
+    return ledger
+
+
+def _sample_excluding(rng, names, payer, k):
+    # 不複製整份名單（大型帳本），直接抽樣並略過付款人與已抽中的成員
+    picked = []
+    seen = {payer}
+    while len(picked) < k:
+        name = rng.choice(names)
+        if name not in seen:
+            seen.add(name)
+            picked.append(name)
+    return picked
+
+
+def ledger_sections(ledger):
+    """轉為 [成員段, 付款段, 分攤段]，可直接交給 ExpenseManager.process_*"""
+    return [
+        "、".join(ledger["members"]),
+        "\n".join(f'{p["payer"]}付了{p["amount"]}元{p["item"]}' for p in ledger["payments"]),
+        "\n".join(f"{item}沒{'、'.join(names)}" for item, names in ledger["exclusions"].items()) or "所有均分"
+    ]
+
+
+def ledger_text(ledger):
+    """轉為使用者在聊天室輸入的標準格式（可由 ledger_parser 本地解析）"""
+    lines = ["成員有" + "、".join(ledger["members"])]
+    lines += [f'{p["payer"]}付了{p["amount"]}元{p["item"]}' for p in ledger["payments"]]
+    lines += [f"{item}沒{'、'.join(names)}" for item, names in ledger["exclusions"].items()]
+    return "\n".join(lines)
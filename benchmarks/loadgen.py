@@ -0,0 +1,394 @@
+"""
+/callback 壓力測試：不需真實的 LINE 與 OpenAI 流量
+- 啟動本機的假 LINE Messaging API 與假 OpenAI API（可設定延遲），應用程式的呼叫皆導向此處
+- 以 channel secret 簽名 webhook 內容，依設定的速率重播多位使用者的對話腳本
+  （輸入帳本 => 確認「是」=> 追加付款；同一位使用者的訊息依序送出，不同使用者交錯進行）
+- 回報延遲 p50 / p95 / p99、吞吐量與錯誤率，用於評估工作執行緒數量與並行相關的修改
+
+目標：
+    wsgi    在同一行程中以 Flask test client 呼叫 app（預設）
+    lambda  在同一行程中呼叫 app.lambda_handler（API Gateway 事件格式）
+    http(s)://.../callback  已啟動的伺服器；需先以 LINE_API_ENDPOINT / OPENAI_API_BASE 指向
+            --line-port / --openai-port 指定的假伺服器，並以 --secret 提供相同的 channel secret
+
+用法：
+    python benchmarks/loadgen.py --users 20 --rate 10
+    python benchmarks/loadgen.py --target lambda --line-latency 0.05 --openai-latency 0.8 --json
+    python benchmarks/loadgen.py --async-webhook --workers 8 --users 50 --rate 50
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import text_event_dict  # noqa: E402
+from benchmarks.ledgers import ledger_text, make_ledger  # noqa: E402
+from ledger_parser import format_sections, parse_canonical_input  # noqa: E402
+
+
+# -----------------------------------------------------------------------------
+# 假 API 伺服器
+# -----------------------------------------------------------------------------
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支援 keep-alive，與真實 API 相同
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        route = fake.routes.get(self.path)
+        if route is None:
+            self._send(404, {"message": "Not found"})
+            return
+        if fake.latency:
+            time.sleep(fake.latency)
+        fake.record(self.path)
+        self._send(200, route(json.loads(raw or b"{}")))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # 不輸出每個請求的存取日誌
+
+
+class FakeAPIServer:
+    """
+    在背景執行緒執行的假 API 伺服器。
+    routes：{路徑: 函式(請求 JSON) -> 回應 JSON}；每個請求先等待 latency 秒再回應。
+    """
+
+    def __init__(self, routes, latency=0.0, host="127.0.0.1", port=0):
+        self.routes = routes
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _FakeHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, path):
+        with self._lock:
+            self.requests[path] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def fake_line_server(latency=0.0, port=0):
+    """假 LINE Messaging API：reply / push 皆回應成功"""
+    return FakeAPIServer({
+        "/v2/bot/message/reply": lambda body: {},
+        "/v2/bot/message/push": lambda body: {},
+    }, latency=latency, port=port)
+
+
+def sections_reply(user_message):
+    """假 OpenAI 的解析結果：將訊息中的標準格式帳本轉為三段式（略過開頭的說明文字）"""
+    lines = user_message.splitlines()
+    for start in range(min(len(lines), 3)):
+        sections = parse_canonical_input("\n".join(lines[start:]))
+        if sections is not None:
+            return format_sections(sections)
+    return "無法解析輸入內容。"
+
+
+def fake_openai_server(latency=0.0, port=0, reply=sections_reply):
+    """假 OpenAI API：/v1/chat/completions 依最後一則使用者訊息回傳 reply() 的結果"""
+    def chat_completion(body):
+        content = reply(body["messages"][-1]["content"])
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(body["messages"][-1]["content"]), "completion_tokens": len(content),
+                      "total_tokens": len(body["messages"][-1]["content"]) + len(content)},
+        }
+    return FakeAPIServer({"/v1/chat/completions": chat_completion}, latency=latency, port=port)
+
+
+# -----------------------------------------------------------------------------
+# 對話腳本與 webhook 簽名
+# -----------------------------------------------------------------------------
+def conversation_scripts(users, members=5, payments=20, openai_share=0.5):
+    """
+    每位使用者一段對話：輸入帳本 => 「是」=> 追加一筆付款。
+    openai_share 比例的使用者以非標準格式輸入（由 OpenAI 解析），其餘由本地文法解析。
+    回傳 [(user_id, [訊息...])]
+    """
+    scripts = []
+    for i in range(users):
+        ledger = make_ledger(members, payments, seed=i)
+        text = ledger_text(ledger)
+        if math.floor((i + 1) * openai_share) > math.floor(i * openai_share):
+            text = "幫我分帳：\n" + text
+        payer = ledger["members"][0]
+        scripts.append((f"U-load-{i:04d}", [text, "是", f"{payer}付了50元追加項目"]))
+    return scripts
+
+
+def sign(secret, body):
+    """LINE webhook 簽名：以 channel secret 計算 body 的 HMAC-SHA256，再以 base64 編碼"""
+    return base64.b64encode(hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()).decode()
+
+
+def webhook_body(user_id, text):
+    event = text_event_dict(user_id, text, event_id=uuid.uuid4().hex, timestamp=int(time.time() * 1000))
+    return json.dumps({"destination": "loadgen", "events": [event]}, ensure_ascii=False)
+
+
+# -----------------------------------------------------------------------------
+# 目標：回傳 send(body, signature) -> HTTP 狀態碼
+# -----------------------------------------------------------------------------
+def load_app(line_url, openai_url, secret, async_webhook=False, workers=None, workdir=None):
+    """
+    在目前行程載入 app，LINE / OpenAI 呼叫導向假伺服器。
+    必須在 app（與 openai）第一次載入前呼叫；圖表寫入 workdir。
+    """
+    if "app" in sys.modules:
+        raise RuntimeError("app 已被載入，無法改用假伺服器；請在新的行程中執行。")
+    os.environ.update({
+        "LINE_CHANNEL_SECRET": secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": "loadgen-token",
+        "LINE_API_ENDPOINT": line_url,
+        "OPENAI_API_BASE": f"{openai_url}/v1",
+        "OPENAI_API_KEY": "loadgen-key",
+        "ASYNC_WEBHOOK": "true" if async_webhook else "false",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+    if "openai" in sys.modules:
+        sys.modules["openai"].api_base = os.environ["OPENAI_API_BASE"]  # 已載入時不會再讀取環境變數
+    if workers:
+        os.environ["WEBHOOK_WORKERS"] = str(workers)
+    if workdir:
+        os.chdir(workdir)  # app 將圖表存於目前目錄下的 static/charts
+    import app
+    return app
+
+
+def wsgi_target(app_module):
+    def send(body, signature):
+        client = app_module.app.test_client()
+        return client.post("/callback", data=body, content_type="application/json",
+                           headers={"X-Line-Signature": signature}).status_code
+    return send
+
+
+def lambda_target(app_module):
+    def send(body, signature):
+        event = {
+            "httpMethod": "POST",
+            "path": "/callback",
+            "queryStringParameters": None,
+            "headers": {"Host": "localhost", "X-Forwarded-Port": "443", "X-Forwarded-Proto": "https",
+                        "Content-Type": "application/json", "X-Line-Signature": signature},
+            "body": body,
+        }
+        return app_module.lambda_handler(event, None)["statusCode"]
+    return send
+
+
+def http_target(url):
+    import requests
+    local = threading.local()
+
+    def send(body, signature):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        return session.post(url, data=body.encode("utf-8"), timeout=60, headers={
+            "Content-Type": "application/json", "X-Line-Signature": signature
+        }).status_code
+    return send
+
+
+# -----------------------------------------------------------------------------
+# 負載產生與統計
+# -----------------------------------------------------------------------------
+def percentile(values, p):
+    """最近排名法的百分位數（values 需已排序）"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def run_load(send, secret, scripts, rate=10.0, concurrency=16):
+    """
+    以固定速率送出所有對話訊息（開放式負載：依排程時間送出，不等待前一個請求完成）。
+    同一位使用者的下一則訊息會等上一則回應後才送出，與真實使用者相同。
+    回傳 {"latencies": [...], "statuses": Counter, "errors": [...], "duration": 秒}
+    """
+    schedule = []  # 依步驟交錯：所有使用者的第 1 則、第 2 則…
+    previous = {}
+    for step in range(max((len(m) for _, m in scripts), default=0)):
+        for user_id, messages in scripts:
+            if step < len(messages):
+                done = threading.Event()
+                schedule.append((user_id, messages[step], previous.get(user_id), done))
+                previous[user_id] = done
+
+    latencies, statuses, errors = [], Counter(), []
+    lock = threading.Lock()
+
+    def fire(user_id, text, wait_for, done):
+        try:
+            if wait_for is not None:
+                wait_for.wait()
+            body = webhook_body(user_id, text)
+            start = time.perf_counter()
+            status = send(body, sign(secret, body))
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+        finally:
+            done.set()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, item in enumerate(schedule):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, *item)
+    return {"latencies": latencies, "statuses": statuses, "errors": errors,
+            "duration": time.perf_counter() - start}
+
+
+def summarize(run):
+    """整理為報告：延遲百分位數（毫秒）、吞吐量與錯誤率（非 200 回應與例外皆計為錯誤）"""
+    latencies = sorted(run["latencies"])
+    total = len(latencies) + len(run["errors"])
+    failed = len(run["errors"]) + sum(n for status, n in run["statuses"].items() if status != 200)
+    return {
+        "requests": total,
+        "duration_seconds": round(run["duration"], 3),
+        "throughput_rps": round(total / run["duration"], 2) if run["duration"] else 0.0,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "statuses": {str(k): v for k, v in sorted(run["statuses"].items())},
+        "exceptions": run["errors"][:5],
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以假 LINE / OpenAI 伺服器對 /callback 進行壓力測試")
+    parser.add_argument("--target", default="wsgi", help="wsgi、lambda，或已啟動伺服器的 /callback 網址")
+    parser.add_argument("--users", type=int, default=10, help="同時進行對話的使用者數")
+    parser.add_argument("--rate", type=float, default=10.0, help="每秒送出的 webhook 數")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時進行中的請求數上限")
+    parser.add_argument("--members", type=int, default=5, help="每本帳的成員數")
+    parser.add_argument("--payments", type=int, default=20, help="每本帳的付款筆數")
+    parser.add_argument("--openai-share", type=float, default=0.5, help="需經 OpenAI 解析的使用者比例")
+    parser.add_argument("--line-latency", type=float, default=0.05, help="假 LINE API 的回應延遲（秒）")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="假 OpenAI API 的回應延遲（秒）")
+    parser.add_argument("--line-port", type=int, default=0, help="假 LINE API 的埠號（0 表示自動選擇）")
+    parser.add_argument("--openai-port", type=int, default=0, help="假 OpenAI API 的埠號（0 表示自動選擇）")
+    parser.add_argument("--secret", default=os.getenv("LINE_CHANNEL_SECRET", "loadgen-secret"),
+                        help="簽名用的 channel secret（http 目標需與伺服器相同）")
+    parser.add_argument("--async-webhook", action="store_true", help="以非同步模式載入 app（wsgi / lambda 目標）")
+    parser.add_argument("--workers", type=int, default=None, help="非同步模式的背景工作執行緒數")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    args = parser.parse_args(argv)
+
+    scripts = conversation_scripts(args.users, args.members, args.payments, args.openai_share)
+    with fake_line_server(args.line_latency, args.line_port) as line_server, \
+            fake_openai_server(args.openai_latency, args.openai_port) as openai_server, \
+            tempfile.TemporaryDirectory() as workdir:
+        app_module = None
+        if args.target in ("wsgi", "lambda"):
+            app_module = load_app(line_server.url, openai_server.url, args.secret,
+                                  args.async_webhook, args.workers, workdir)
+            send = wsgi_target(app_module) if args.target == "wsgi" else lambda_target(app_module)
+        else:
+            print(f"假 LINE API：{line_server.url}  假 OpenAI API：{openai_server.url}/v1", file=sys.stderr)
+            send = http_target(args.target)
+
+        report = summarize(run_load(send, args.secret, scripts, args.rate, args.concurrency))
+        if app_module is not None and app_module.dispatcher is not None:
+            # 非同步模式：等待背景佇列處理完畢，回報處理完所有事件所需的額外時間
+            start = time.perf_counter()
+            app_module.dispatcher.join()
+            report["drain_seconds"] = round(time.perf_counter() - start, 3)
+        if app_module is not None:
+            # 對話走完全程（帳本已結算並可追加）的使用者數，確認負載期間流程沒有出錯
+            contexts = (app_module.user_context.get(user_id) for user_id, _ in scripts)
+            report["completed_conversations"] = sum(1 for c in contexts if c is not None and c["step"] == 3)
+        report["target"] = args.target
+        report["line_requests"] = sum(line_server.requests.values())
+        report["openai_requests"] = sum(openai_server.requests.values())
+        os.chdir(ROOT)  # 離開暫存資料夾後才能刪除
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        lat = report["latency_ms"]
+        print(f"target          {report['target']}")
+        print(f"requests        {report['requests']} in {report['duration_seconds']} s "
+              f"({report['throughput_rps']} req/s)")
+        print(f"latency (ms)    p50 {lat['p50']}   p95 {lat['p95']}   p99 {lat['p99']}   max {lat['max']}")
+        print(f"error rate      {report['error_rate']:.2%}   statuses {report['statuses']}")
+        if "completed_conversations" in report:
+            print(f"conversations   {report['completed_conversations']}/{len(scripts)} completed")
+        if "drain_seconds" in report:
+            print(f"queue drain     {report['drain_seconds']} s")
+        print(f"fake upstreams  LINE {report['line_requests']} requests, OpenAI {report['openai_requests']} requests")
+        for error in report["exceptions"]:
+            print(f"exception       {error}")
+    completed = report.get("completed_conversations", len(scripts))
+    return 0 if report["error_rate"] == 0 and completed == len(scripts) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+冷啟動基準測試：模擬 Lambda 新的執行環境，量測
+1. import app 的時間（載入所有模組、建立 Flask 與 LINE 物件）
+2. 第一次呼叫 lambda_handler 的回應時間（以簽名正確、不含事件的 webhook 請求）
+3. 冷啟動後已被載入的重量級套件（應為空，代表已延遲到實際使用時才載入）
+
+每次量測都在全新的 Python 行程中執行，避免模組快取影響結果。
+用法：python benchmarks/startup.py --runs 10 [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 冷啟動時不應載入的套件（只有呼叫 OpenAI、繪製圖表或使用 numpy 引擎時才需要）
+HEAVY_MODULES = ("openai", "plotly.graph_objects", "plotly.offline", "expense_chart_generator", "numpy")
+
+CHILD = r"""
+import base64, hashlib, hmac, json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+body = json.dumps({"destination": "benchmark", "events": []})
+secret = app.os.getenv("LINE_CHANNEL_SECRET")
+signature = base64.b64encode(hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()).decode()
+event = {
+    "httpMethod": "POST",
+    "path": "/callback",
+    "queryStringParameters": None,
+    "headers": {"Host": "localhost", "X-Forwarded-Port": "443", "X-Forwarded-Proto": "https",
+                "Content-Type": "application/json", "X-Line-Signature": signature},
+    "body": body,
+}
+result = app.lambda_handler(event, None)
+responded = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_response": responded - imported,
+    "status": result["statusCode"],
+    "heavy_loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+}))
+"""
+
+
+def run_once(workdir):
+    """在全新行程中量測一次，回傳結果與整個行程的執行時間（含直譯器啟動）"""
+    env = dict(os.environ, PYTHONPATH=ROOT, LINE_CHANNEL_SECRET="benchmark-secret",
+               LINE_CHANNEL_ACCESS_TOKEN="benchmark-token", ASYNC_WEBHOOK="false")
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n{CHILD}"
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    wall = time.perf_counter() - start
+    result = json.loads(out.strip().splitlines()[-1])
+    result["process"] = wall
+    return result
+
+
+def summarize(samples, key):
+    values = [s[key] for s in samples]
+    return {"min": min(values), "median": statistics.median(values), "max": max(values)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="量測冷啟動 import 時間與第一次回應時間")
+    parser.add_argument("--runs", type=int, default=5, help="量測次數（每次皆為新行程）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        samples = [run_once(workdir) for _ in range(args.runs)]
+
+    report = {key: summarize(samples, key) for key in ("import", "first_response", "process")}
+    report["status"] = samples[0]["status"]
+    report["heavy_loaded"] = samples[0]["heavy_loaded"]
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key in ("import", "first_response", "process"):
+            s = report[key]
+            print(f"{key:<15} min {s['min'] * 1000:8.1f} ms   median {s['median'] * 1000:8.1f} ms   max {s['max'] * 1000:8.1f} ms")
+        print(f"status          {report['status']}")
+        print(f"heavy modules   {', '.join(report['heavy_loaded']) or '(none)'}")
+    return 0 if report["status"] == 200 and not report["heavy_loaded"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
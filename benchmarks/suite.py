@@ -0,0 +1,290 @@
+"""
+分帳、出圖與訊息處理的效能基準測試：
+以合成帳本（3 至 10,000 位成員、10 至 50,000 筆付款）量測
+ExpenseManager.process_*、calculate_transfers、format_output、output_messages、ChartGenerator.generate_charts，
+以及使用假 LINE / OpenAI client 的完整對話流程（MessageHandler.handle_message）。
+process_*、calculate_transfers 在所有規模（含 huge）都量測；輸出明細、出圖與完整對話的成本隨
+成員數 × 付款筆數成長，超過 MAX_CELLS 的規模標示為 skipped。
+
+結果可存為 JSON 基準線；之後的量測與基準線比較，任一項目變慢超過門檻即以結束碼 1 結束。
+用法：
+    python benchmarks/suite.py                                   # 預設規模：tiny、small、medium
+    python benchmarks/suite.py --sizes all --save baseline.json  # 全部規模並存為基準線
+    python benchmarks/suite.py --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import FakeLineBotApi, FakeOpenAIClient, text_event  # noqa: E402
+from benchmarks.ledgers import DEFAULT_SIZES, SIZES, ledger_sections, ledger_text, make_ledger  # noqa: E402
+from ledger_parser import format_sections  # noqa: E402
+from message_processor import ExpenseManager  # noqa: E402
+
+# 本身或 setup 需逐筆展開參與者、成本隨「成員數 × 付款筆數」成長的項目（格式化明細、出圖、完整對話），
+# 超過此上限的規模略過（避免單次量測耗時數分鐘、耗盡記憶體）；其餘線性項目在所有規模都量測
+MAX_CELLS = 2 * 10 ** 7
+
+
+# -----------------------------------------------------------------------------
+# 量測項目：setup 於計時外執行，回傳要計時的函式
+# -----------------------------------------------------------------------------
+def _loaded_manager(sections, splits=True, calculated=False):
+    manager = ExpenseManager()
+    manager.process_members(sections[0])
+    manager.process_payments(sections[1])
+    if splits:
+        manager.process_splits(sections[2])
+    if calculated:
+        manager.calculate_and_format()
+    return manager
+
+
+def bench_process_members(ledger, sections, workdir):
+    return lambda: ExpenseManager().process_members(sections[0])
+
+
+def bench_process_payments(ledger, sections, workdir):
+    manager = ExpenseManager()
+    manager.process_members(sections[0])
+    return lambda: manager.process_payments(sections[1])
+
+
+def bench_process_splits(ledger, sections, workdir):
+    manager = _loaded_manager(sections, splits=False)
+    return lambda: manager.process_splits(sections[2])
+
+
+def bench_calculate_and_format(ledger, sections, workdir):
+    manager = _loaded_manager(sections)
+    return manager.calculate_and_format
+
+
+def _ledger_balances(ledger):
+    """
+    直接由帳本計算每人餘額：每人應付 = 所有項目的每人金額總和 - 自己不參與的項目。
+    只需走訪付款與分攤例外（線性），不必先完成整本帳的結算；結果與 ExpenseManager 相同（至多差 1 分的進位誤差）。
+    """
+    members = ledger["members"]
+    paid = dict.fromkeys(members, 0.0)
+    skipped = dict.fromkeys(members, 0.0)
+    shared = 0.0
+    for p in ledger["payments"]:
+        excluded = ledger["exclusions"].get(p["item"], ())
+        per_person = round(p["amount"] / (len(members) - len(excluded)), 2)
+        paid[p["payer"]] += p["amount"]
+        shared += per_person
+        for m in excluded:
+            skipped[m] += per_person
+    return {m: round(paid[m] - (shared - skipped[m]), 2) for m in members}
+
+
+def bench_calculate_transfers(ledger, sections, workdir):
+    balances = _ledger_balances(ledger)
+    return lambda: ExpenseManager().calculate_transfers(balances)
+
+
+def bench_format_output(ledger, sections, workdir):
+    m = _loaded_manager(sections, calculated=True)
+    return lambda: m.format_output(m.detailed_split, m.balances, m.transfers, m.total_paid, m.total_owed)
+
+
+def bench_output_messages(ledger, sections, workdir):
+    # 與 MessageHandler 相同：依 LINE 字數上限分則，超過則數上限時改為摘要
+    from user_message_handler import MAX_TEXT_LENGTH, RESULT_MAX_MESSAGES
+    m = _loaded_manager(sections, calculated=True)
+    return lambda: m.output_messages(MAX_TEXT_LENGTH, RESULT_MAX_MESSAGES, header="計算結果如下：\n")
+
+
+def bench_generate_charts(ledger, sections, workdir):
+    from expense_chart_generator import ChartGenerator
+    summary = _loaded_manager(sections, calculated=True).get_summary()
+    output_dir = tempfile.mkdtemp(dir=workdir)  # 每次量測使用新資料夾，避免沿用已生成的圖表
+    return lambda: ChartGenerator(summary).generate_charts(output_dir=output_dir)
+
+
+def _conversation(ledger, sections, workdir, first_message):
+    """完整對話：輸入帳本 =>（解析）=> 確認「是」=> 結算出圖 => 追加一筆付款"""
+    from artifact_store import LocalArtifactStore
+    from user_message_handler import MessageHandler
+    line_bot_api = FakeLineBotApi()
+    handler = MessageHandler(line_bot_api, {}, artifact_store=LocalArtifactStore(tempfile.mkdtemp(dir=workdir)))
+    handler.openai_client = FakeOpenAIClient(format_sections(sections))
+    payer = ledger["members"][0]
+    events = [text_event("U-benchmark", text) for text in (first_message, "是", f"{payer}付了50元追加項目")]
+
+    def run():
+        for event in events:
+            handler.handle_message(event)
+        if handler.user_context["U-benchmark"]["step"] != 3:
+            raise RuntimeError("對話流程未完成：" + repr(handler.user_context["U-benchmark"]))
+    return run
+
+
+def bench_handle_message(ledger, sections, workdir):
+    # 標準格式：由 ledger_parser 本地解析，不呼叫 OpenAI
+    return _conversation(ledger, sections, workdir, ledger_text(ledger))
+
+
+def bench_handle_message_openai(ledger, sections, workdir):
+    # 非標準格式：交由（假的）OpenAI 解析
+    return _conversation(ledger, sections, workdir, "幫我分帳：\n" + ledger_text(ledger))
+
+
+# 名稱 -> (setup, 成員 × 付款 上限；None 表示不限)
+CASES = OrderedDict([
+    ("process_members", (bench_process_members, None)),
+    ("process_payments", (bench_process_payments, None)),
+    ("process_splits", (bench_process_splits, None)),
+    ("calculate_transfers", (bench_calculate_transfers, None)),
+    ("format_output", (bench_format_output, MAX_CELLS)),
+    ("output_messages", (bench_output_messages, MAX_CELLS)),
+    ("calculate_and_format", (bench_calculate_and_format, MAX_CELLS)),
+    ("generate_charts", (bench_generate_charts, MAX_CELLS)),
+    ("handle_message", (bench_handle_message, MAX_CELLS)),
+    ("handle_message_openai", (bench_handle_message_openai, MAX_CELLS)),
+])
+
+
+# -----------------------------------------------------------------------------
+# 執行與比較
+# -----------------------------------------------------------------------------
+def run_case(setup, repeat=5, budget=5.0):
+    """
+    執行 repeat 次（每次重新 setup），回傳最短、中位數時間與實際次數。
+    累計時間超過 budget 秒即提前停止（至少執行一次）。計時期間停用 GC，與 timeit 相同。
+    """
+    times = []
+    while len(times) < repeat and sum(times) <= budget:
+        func = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return {"min": min(times), "median": statistics.median(times), "runs": len(times)}
+
+
+def run_suite(sizes=DEFAULT_SIZES, cases=None, repeat=5, budget=5.0, progress=None):
+    """依規模與項目執行所有量測，回傳可存為 JSON 的結果（鍵為「項目/規模」）"""
+    unknown = [s for s in sizes if s not in SIZES] + [c for c in (cases or ()) if c not in CASES]
+    if unknown:
+        raise ValueError(f"未知的規模或項目：{unknown}")
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            members, payments = SIZES[size]
+            ledger = make_ledger(members, payments)
+            sections = ledger_sections(ledger)
+            for name, (setup, max_cells) in CASES.items():
+                if cases and name not in cases:
+                    continue
+                key = f"{name}/{size}"
+                if max_cells is not None and members * payments > max_cells:
+                    results[key] = {"skipped": True}
+                else:
+                    results[key] = run_case(lambda: setup(ledger, sections, workdir), repeat, budget)
+                if progress is not None:
+                    progress(key, results[key])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=0.25, min_delta=0.001):
+    """
+    以最短時間比較目前結果與基準線，回傳 {鍵: {"baseline", "current", "ratio", "regressed"}}。
+    變慢超過 threshold 比例且差距超過 min_delta 秒才視為退步（避免極短項目的雜訊）。
+    兩邊都有量測的項目才比較。
+    """
+    report = OrderedDict()
+    for key, result in current["results"].items():
+        base = baseline["results"].get(key)
+        if "min" not in result or not base or "min" not in base:
+            continue
+        ratio = result["min"] / base["min"] if base["min"] else float("inf")
+        report[key] = {
+            "baseline": base["min"],
+            "current": result["min"],
+            "ratio": ratio,
+            "regressed": ratio > 1 + threshold and result["min"] - base["min"] > min_delta,
+        }
+    return report
+
+
+def _format_row(key, result, diff=None):
+    if result.get("skipped"):
+        return f"{key:<36} {'skipped':>12}"
+    row = f"{key:<36} {result['min'] * 1000:10.2f} ms {result['median'] * 1000:10.2f} ms {result['runs']:>4}"
+    if diff is not None:
+        row += f"   x{diff['ratio']:.2f}" + ("  REGRESSION" if diff["regressed"] else "")
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分帳、出圖與訊息處理的效能基準測試")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES),
+                        help=f"以逗號分隔的規模（{', '.join(SIZES)}），或 all")
+    parser.add_argument("--cases", default="", help=f"以逗號分隔的項目（預設全部：{', '.join(CASES)}）")
+    parser.add_argument("--repeat", type=int, default=5, help="每個項目的量測次數")
+    parser.add_argument("--budget", type=float, default=5.0, help="每個項目的累計時間上限（秒）")
+    parser.add_argument("--save", help="將結果存為 JSON 基準線")
+    parser.add_argument("--baseline", help="與此 JSON 基準線比較")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允許變慢的比例（0.25 = 25%%）")
+    parser.add_argument("--min-delta", type=float, default=0.001, help="視為退步的最小差距（秒）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    args = parser.parse_args(argv)
+
+    sizes = tuple(SIZES) if args.sizes == "all" else tuple(s for s in args.sizes.split(",") if s)
+    cases = tuple(c for c in args.cases.split(",") if c)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    def progress(key, result):
+        if not args.json:
+            print(_format_row(key, result), flush=True)
+
+    if not args.json:
+        print(f"{'case/size':<36} {'min':>13} {'median':>13} {'runs':>4}")
+    current = run_suite(sizes, cases, args.repeat, args.budget, progress)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+
+    report = compare(current, baseline, args.threshold, args.min_delta) if baseline else {}
+    regressions = [key for key, diff in report.items() if diff["regressed"]]
+    if args.json:
+        print(json.dumps({"results": current["results"], "comparison": report}, indent=2, ensure_ascii=False))
+    elif baseline:
+        print(f"\n與基準線比較（門檻 +{args.threshold:.0%}）：")
+        for key, diff in report.items():
+            print(_format_row(key, current["results"][key], diff))
+        print(f"退步項目：{', '.join(regressions) or '無'}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
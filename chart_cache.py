@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    import brotli  # 選用套件：未安裝時只提供 gzip
+except ImportError:
+    brotli = None
+
+# 預先壓縮的檔案副檔名（依偏好順序；brotli 壓縮率較佳）
+ENCODING_SUFFIXES = OrderedDict([("br", ".br"), ("gzip", ".gz")])
+
+# 只允許一般檔名，避免路徑穿越
+SAFE_NAME_PTN = re.compile(r"^[\w-]+(?:\.[\w-]+)*$")
+
+ChartEntry = namedtuple("ChartEntry", ["bodies", "etag", "size"])
+
+
+def compress_variants(data):
+    """
+    將內容壓縮為各種編碼，回傳 {編碼: 位元組}。
+    gzip 固定 mtime=0，相同內容每次產生相同結果。
+    """
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data)
+    return variants
+
+
+def variant_names(name):
+    """檔名及其所有預先壓縮檔的檔名"""
+    return (name,) + tuple(name + suffix for suffix in ENCODING_SUFFIXES.values())
+
+
+class ChartCache:
+    """
+    圖表檔案的記憶體快取（依總位元組數做 LRU 淘汰，執行緒安全）：
+    - 每個檔案保留原始內容與預先壓縮的版本，直接回應而不再讀取儲存後端
+    - ETag 為原始內容的 SHA-256，內容不變即不變（強驗證器）
+    """
+
+    def __init__(self, store, max_bytes=32 * 1024 * 1024):
+        self.store = store  # artifact_store.ArtifactStore
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # 檔名 -> ChartEntry
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """取得檔案內容；檔名不合法或檔案不存在則回傳 None"""
+        if not SAFE_NAME_PTN.match(name):
+            return None
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._load(name)
+        if entry is None:
+            return None
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = entry
+                self._bytes += entry.size
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.size
+        return entry
+
+    def _load(self, name):
+        """讀取檔案與預先壓縮檔；缺少的壓縮版本在此補上（只做一次）"""
+        data = self.store.read(name)
+        if data is None:
+            return None
+        bodies = {"identity": data}
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            body = self.store.read(name + suffix)
+            if body is not None:
+                bodies[encoding] = body
+        if "gzip" not in bodies or (brotli is not None and "br" not in bodies):
+            for encoding, body in compress_variants(data).items():
+                bodies.setdefault(encoding, body)
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        return ChartEntry(bodies, etag, sum(len(b) for b in bodies.values()))
+
+    def stats(self):
+        """回傳快取統計資料"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+def choose_encoding(entry, accept_encodings):
+    """
+    依用戶端的 Accept-Encoding 選擇回應的編碼。
+    accept_encodings 為 werkzeug 的 Accept 物件（request.accept_encodings）。
+    """
+    for encoding in ENCODING_SUFFIXES:
+        if encoding in entry.bodies and accept_encodings[encoding] > 0:
+            return encoding
+    return "identity"
@@ -0,0 +1,124 @@
+import itertools
+import logging
+import queue
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def event_shard_key(event):
+    """
+    事件的分片鍵：同一個使用者（或群組、聊天室）的事件必須依序處理。
+    無法辨識來源的事件回傳 None（可由任一分片處理）。
+    """
+    source = getattr(event, "source", None)
+    for attr in ("user_id", "group_id", "room_id"):
+        key = getattr(source, attr, None)
+        if key:
+            return key
+    return None
+
+
+class EventDispatcher:
+    """
+    背景事件分派器：
+    以有界佇列暫存 Webhook 事件，交由固定數量的工作執行緒處理，
+    讓 /callback 驗證簽名後即可立即回應 LINE。
+    每個工作執行緒負責一個分片：事件依來源使用者雜湊至固定分片，
+    同一使用者的事件嚴格依序處理（避免同時修改上下文），不同使用者則平行處理。
+    佇列容量不足時整批拒收（load shedding），由呼叫端決定如何回應。
+    """
+
+    def __init__(self, process_event, workers=4, queue_size=100, shard_key=event_shard_key):
+        """
+        process_event：處理單一事件的函式
+        workers：工作執行緒（分片）數量
+        queue_size：所有分片合計最多可暫存的事件數
+        shard_key：取得事件分片鍵的函式，相同鍵的事件依序處理
+        """
+        if workers < 1:
+            raise ValueError("workers 至少需為 1。")
+        if queue_size < 1:
+            raise ValueError("queue_size 至少需為 1。")
+        self.process_event = process_event
+        self.workers = workers
+        self.queue_size = queue_size
+        self.shard_key = shard_key
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._pending = 0  # 所有分片中等待處理的事件數
+        self._pending_lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._threads = []
+        self.rejected = 0  # 因佇列已滿而被拒收的事件數
+
+    def start(self):
+        """啟動工作執行緒（重複呼叫不會重複啟動）"""
+        if self._threads:
+            return
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"event-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def shard_of(self, event):
+        """事件所屬的分片編號（以 CRC32 雜湊，跨行程結果一致）"""
+        key = self.shard_key(event)
+        if key is None:
+            return next(self._round_robin) % self.workers
+        return zlib.crc32(str(key).encode("utf-8")) % self.workers
+
+    def submit(self, events):
+        """
+        將一批事件依分片放入佇列（保持批次內的先後順序）。
+        剩餘容量足夠 => 全部放入並回傳 True
+        容量不足 => 一筆都不放入並回傳 False（避免同一批事件只處理一半）
+        """
+        events = list(events)
+        with self._pending_lock:
+            if self._pending + len(events) > self.queue_size:
+                self.rejected += len(events)
+                logger.warning("事件佇列已滿，拒收 %d 筆事件", len(events))
+                return False
+            self._pending += len(events)
+            # 持鎖放入：不同批次中同一使用者的事件也維持送達順序
+            for event in events:
+                self._queues[self.shard_of(event)].put_nowait(event)
+        return True
+
+    def qsize(self):
+        """目前所有分片中等待處理的事件數"""
+        with self._pending_lock:
+            return self._pending
+
+    def shard_sizes(self):
+        """各分片等待處理的事件數（用於觀察分片是否平均）"""
+        return [q.qsize() for q in self._queues]
+
+    def join(self):
+        """等待佇列中的事件全部處理完畢"""
+        for q in self._queues:
+            q.join()
+
+    def stop(self, timeout=None):
+        """通知所有工作執行緒結束，並等待其退出"""
+        for q in self._queues[:len(self._threads)]:
+            q.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _worker(self, q):
+        """工作執行緒主迴圈：依序取出所屬分片的事件並處理，單筆失敗不影響後續事件"""
+        while True:
+            event = q.get()
+            try:
+                if event is None:
+                    return
+                with self._pending_lock:
+                    self._pending -= 1
+                self.process_event(event)
+            except Exception:
+                logger.exception("背景處理事件時發生錯誤")
+            finally:
+                q.task_done()
@@ -1,33 +1,141 @@
+import hashlib
+import json
+import logging
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+# plotly 繪圖時才匯入 numpy：在本模組載入時（經由 lazy_import 持鎖）先載入，繪圖執行緒不會同時第一次匯入
+import numpy  # noqa: F401
 import plotly.graph_objects as go
-from message_processor import ExpenseManager
+import plotly.io as pio
+from artifact_store import CHART_PREFIX, LocalArtifactStore
+from chart_cache import ENCODING_SUFFIXES, compress_variants
+from lazy_import import lazy_import
+from process_pool import create_process_pool
+
+logger = logging.getLogger(__name__)
+
+# 圖表版本：修改圖表樣式或頁面範本時遞增，使既有的快取檔案失效
+CHART_VERSION = "1"
+
+# 圖表繪製方式：serial（依序）、thread（執行緒池）、process（行程池，不受 GIL 限制）
+CHART_RENDER_MODES = ("serial", "thread", "process")
+CHART_RENDER_MODE = os.getenv("CHART_RENDER_MODE", "thread")
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "5"))
+
+# 圖表輸出格式：html 或 compact（見 ChartGenerator.__init__）
+CHART_OUTPUT_MODE = os.getenv("CHART_OUTPUT_MODE", "html")
+
+
+PAGE_STYLE = (
+    "body{margin:0;padding:0;display:flex;flex-direction:column;align-items:center}"
+    ".chart-container{width:100%;max-width:1200px;margin:20px 0}"
+)
+
+_process_pool = None
+_template_json = None
+
+
+def plotly_js_url():
+    """
+    固定版本的 plotly.js 網址，與 Python 端 plotly 套件產生的圖表格式一致。
+    plotly.offline 載入較慢（會連帶載入 IPython 等），因此在需要時才匯入。
+    """
+    get_plotlyjs_version = lazy_import("plotly.offline").get_plotlyjs_version
+    return f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+
+def _default_template_json():
+    """預設 plotly template 的 JSON（compact 模式於頁面中只嵌入一次）"""
+    global _template_json
+    if _template_json is None:
+        _template_json = pio.json.to_json_plotly(pio.templates[pio.templates.default])
+    return _template_json
+
+
+def _get_process_pool():
+    """延遲建立共用的行程池（各請求共用，避免重複啟動行程；不以 fork 啟動，見 process_pool）"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = create_process_pool(CHART_RENDER_WORKERS)
+    return _process_pool
+
+
+def _render_one(generator, name):
+    """繪製單張圖表並依輸出格式序列化，回傳 (HTML 或 JSON, 耗時秒數)；可在執行緒或子行程中執行"""
+    start = time.perf_counter()
+    fig = getattr(generator, name)()
+    if generator.output_mode == "compact":
+        out = generator._to_json(fig)
+    else:
+        out = generator._to_html(fig)
+    return out, time.perf_counter() - start
+
+
+def _plain(value):
+    # 帳本紀錄（Payment / Split）以精簡的純資料表示，其他型別轉為字串
+    to_dict = getattr(value, "to_dict", None)
+    return to_dict() if callable(to_dict) else str(value)
+
+
+def summary_digest(summary_data):
+    """以摘要資料的標準化 JSON 計算雜湊，相同帳本得到相同的圖表檔名"""
+    canonical = json.dumps(summary_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_plain)
+    return hashlib.sha256(f"{CHART_VERSION}:{canonical}".encode("utf-8")).hexdigest()[:32]
+
 
 class ChartGenerator:
-    def __init__(self, summary_data):
+    # 依頁面顯示順序排列的圖表方法
+    CHART_METHODS = (
+        "_figure_pay_vs_owed",
+        "_figure_balances",
+        "_figure_transfers",
+        "_figure_item_distribution",
+        "_figure_per_person_items"
+    )
+
+    def __init__(self, summary_data, output_mode=None):
         """
         初始化，接收由 ExpenseManager 計算後的摘要資料，
         並預先計算常用資料供各圖表使用。
+        output_mode：html（預設）或 compact（單一頁面範本 + 圖表資料 JSON，檔案較小）
         """
+        self.output_mode = output_mode or CHART_OUTPUT_MODE
+        if self.output_mode not in ("html", "compact"):
+            raise ValueError(f"未知的圖表輸出格式：{self.output_mode}")
+        self.digest = summary_digest({"output_mode": self.output_mode, **summary_data})
         self.members = summary_data["members"]
         self.payments = summary_data["payments"]
         self.detailed_split = summary_data["detailed_split"]
         self.balances = summary_data["balances"]
         self.transfers = summary_data["transfers"]
 
-        # 預先計算用於多個圖表的共用資料
-        self.total_paid = {m: sum(p["amount"] for p in self.payments if p["payer"] == m) for m in self.members}
-        self.total_owed = {m: sum(p["per_person"] for p in self.detailed_split if m in p["participants"]) for m in self.members}
+        # 預先計算用於多個圖表的共用資料（各圖表共用，只計算一次）
+        self.total_paid = {m: 0 for m in self.members}
+        for p in self.payments:
+            self.total_paid[p["payer"]] += p["amount"]
+        # owed_by_item[i][j]：第 i 個項目中第 j 位成員的應付金額
+        self.owed_by_item = []
+        for d in self.detailed_split:
+            part = set(d["participants"])
+            self.owed_by_item.append([d["per_person"] if m in part else 0 for m in self.members])
+        self.total_owed = {m: 0 for m in self.members}
+        for owed in self.owed_by_item:
+            for m, v in zip(self.members, owed):
+                self.total_owed[m] += v
+        self.timings = {}  # 每張圖表的繪製耗時（秒）
         self.reversed_members = self.members[::-1]
         self.items = [d["item"] for d in self.detailed_split]
         self.amounts = [d["amount"] for d in self.detailed_split]
         self.creditors = [m for m,b in self.balances.items() if b>0]
         self.debtors = [m for m,b in self.balances.items() if b<0]
 
-        # 統一 fig.to_html 的參數
-        self.to_html_params = dict(full_html=False, include_plotlyjs='cdn', config={"responsive": True})
+        # 統一 fig.to_html 的參數（plotly.js 由頁面 <head> 載入一次，片段中不再重複載入）
+        self.to_html_params = dict(full_html=False, include_plotlyjs=False, config={"responsive": True})
 
-    def _chart_pay_vs_owed(self):
+    def _figure_pay_vs_owed(self):
         """圖表1：每人支付 vs 該付金額 (柱狀圖)"""
         fig = go.Figure()
         fig.add_trace(go.Bar(
@@ -47,9 +155,9 @@ class ChartGenerator:
             legend=dict(orientation="h", y=-0.2, x=0.5, xanchor="center"),
             autosize=True, height=500, margin=dict(l=50, r=50, t=70, b=50)
         )
-        return fig.to_html(**self.to_html_params)
+        return fig
 
-    def _chart_balances(self):
+    def _figure_balances(self):
         """圖表2：結算餘額圖 (多付/少付)"""
         bal = self.balances
         fig = go.Figure()
@@ -77,9 +185,9 @@ class ChartGenerator:
             legend=dict(orientation="h", y=-0.2, x=0.5, xanchor="center"),
             autosize=True, height=500, margin=dict(l=50, r=50, t=70, b=50)
         )
-        return fig.to_html(**self.to_html_params)
+        return fig
 
-    def _chart_transfers(self):
+    def _figure_transfers(self):
         """圖表3：轉帳方案 (節點 + 箭頭)"""
         bal = self.balances
         creditors, debtors = self.creditors, self.debtors
@@ -101,6 +209,7 @@ class ChartGenerator:
         ))
 
         used_positions = set()
+        annotations = []  # 收集後一次設定，避免逐筆 add_annotation 反覆複製版面設定
         # 為每筆轉帳畫箭頭與金額標示
         for tr in self.transfers:
             match = re.match(r"(\S+) → (\S+) ([0-9.]+) 元", tr)
@@ -112,13 +221,13 @@ class ChartGenerator:
             x1, y1 = positions[creditor]
 
             # 畫箭頭（保持原本設定）
-            fig.add_annotation(
+            annotations.append(dict(
                 x=x1, y=y1-0.4,
                 ax=x0, ay=y0+0.4,
                 xref="x", yref="y",
                 axref="x", ayref="y",
                 showarrow=True, arrowhead=2, arrowsize=1.5, arrowwidth=1.5, arrowcolor="gray"
-            )
+            ))
 
             # 放置金額標示，嘗試多次位移避免重疊
             mid_x, mid_y, offset_y = (x0+x1)/2, (y0+y1)/2, 0.2
@@ -130,21 +239,22 @@ class ChartGenerator:
                     break
                 offset_y *= -1.1
 
-            fig.add_annotation(
+            annotations.append(dict(
                 x=mid_x, y=mid_y, text=f"{amt}元", showarrow=False,
                 font=dict(size=10, color="black"),
                 bgcolor="rgba(255,255,255,0.8)", bordercolor="gray", borderwidth=1, borderpad=2
-            )
+            ))
 
         fig.update_layout(
+            annotations=annotations,
             title="轉帳方案",
             xaxis=dict(visible=False), yaxis=dict(visible=False),
             plot_bgcolor="rgba(240, 240, 240, 0.6)",
             showlegend=False, autosize=True, margin=dict(l=50,r=50,t=70,b=50)
         )
-        return fig.to_html(**self.to_html_params)
+        return fig
 
-    def _chart_item_distribution(self):
+    def _figure_item_distribution(self):
         """圖表4：各項支付分布 (圓餅圖)"""
         fig = go.Figure(data=[go.Pie(labels=self.items, values=self.amounts, hole=0.3)])
         fig.update_layout(
@@ -153,23 +263,21 @@ class ChartGenerator:
             legend=dict(orientation="h", y=-0.4, x=0.5, xanchor="center"),
             margin=dict(l=20,r=20,t=50,b=100)
         )
-        return fig.to_html(**self.to_html_params)
+        return fig
 
-    def _chart_per_person_items(self):
+    def _figure_per_person_items(self):
         """圖表5：每人該付項目金額 (橫條堆疊圖)"""
-        fig = go.Figure()
-        for item in self.detailed_split:
-            owed_per_member = [
-                item["per_person"] if m in item["participants"] else 0
-                for m in self.members
-            ]
+        # 項目數可能上千：直接組成 JSON 結構（回傳 dict）並略過 plotly 逐筆驗證，輸出與 go.Bar 相同
+        traces = []
+        for item, owed_per_member in zip(self.detailed_split, self.owed_by_item):
             owed_reversed = owed_per_member[::-1]
-            fig.add_trace(go.Bar(
+            traces.append(dict(
+                type="bar",
                 y=self.reversed_members, x=owed_reversed, name=item["item"], orientation='h',
                 text=[f"{int(v)}" if v>0 else "" for v in owed_reversed],
                 textposition='inside'
             ))
-        fig.update_layout(
+        layout = go.Layout(
             title="每人該付項目金額",
             xaxis=dict(title="金額 (元)", gridcolor="lightgrey", rangemode="tozero"),
             yaxis=dict(title="成員", categoryorder="array", categoryarray=self.reversed_members),
@@ -177,30 +285,81 @@ class ChartGenerator:
             legend=dict(orientation="h", y=-0.3, x=0.5, xanchor="center"),
             height=50*len(self.members)+200,
             margin=dict(l=100, r=50, t=70, b=50),
-            autosize=True
+            autosize=True,
+            template=pio.templates[pio.templates.default]
         )
+        return {"data": traces, "layout": layout.to_plotly_json()}
+
+    # -------------------------------------------------------------------------
+    # 輸出格式：html（每張圖表各自的 HTML 片段）或 compact（僅圖表資料 JSON）
+    # -------------------------------------------------------------------------
+    def _to_html(self, fig):
+        """將圖表轉為 HTML 片段（不含 plotly.js，由頁面統一載入）"""
+        if isinstance(fig, dict):
+            return pio.to_html(fig, validate=False, **self.to_html_params)
         return fig.to_html(**self.to_html_params)
 
-    def generate_charts(self, output_dir="static/charts"):
+    @staticmethod
+    def _to_json(fig):
+        """將圖表轉為精簡 JSON：移除各圖表重複的 template，改由頁面統一套用"""
+        data = fig if isinstance(fig, dict) else fig.to_plotly_json()
+        layout = dict(data.get("layout", {}))
+        layout.pop("template", None)
+        return pio.json.to_json_plotly({"data": data["data"], "layout": layout})
+
+    def _chart_pay_vs_owed(self):
+        return self._to_html(self._figure_pay_vs_owed())
+
+    def _chart_balances(self):
+        return self._to_html(self._figure_balances())
+
+    def _chart_transfers(self):
+        return self._to_html(self._figure_transfers())
+
+    def _chart_item_distribution(self):
+        return self._to_html(self._figure_item_distribution())
+
+    def _chart_per_person_items(self):
+        return self._to_html(self._figure_per_person_items())
+
+    def render_charts(self, mode=None):
         """
-        組合所有圖表為單一 HTML 檔案並輸出。
+        繪製所有圖表，回傳 HTML 片段清單（順序與 CHART_METHODS 相同）。
+        各圖表互不相依，依 mode 以執行緒池或行程池同時繪製；
+        行程池無法使用時（例如 Lambda 缺少 /dev/shm）自動改用執行緒池。
+        每張圖表的耗時記錄於 self.timings；未知的 mode => ValueError
         """
-        charts_html = [
-            self._chart_pay_vs_owed(),
-            self._chart_balances(),
-            self._chart_transfers(),
-            self._chart_item_distribution(),
-            self._chart_per_person_items()
-        ]
-
-        full_html = f"""
+        mode = mode or CHART_RENDER_MODE
+        if mode not in CHART_RENDER_MODES:
+            raise ValueError(f"未知的圖表繪製方式：{mode}")
+        names = self.CHART_METHODS
+        results = None
+        if mode == "process":
+            try:
+                results = list(_get_process_pool().map(_render_one, [self] * len(names), names))
+            except (OSError, NotImplementedError, BrokenProcessPool) as e:
+                logger.warning("行程池無法使用，改用執行緒池繪製圖表：%s", e)
+                mode = "thread"
+        if results is None and mode == "thread":
+            with ThreadPoolExecutor(max_workers=min(CHART_RENDER_WORKERS, len(names))) as pool:
+                results = list(pool.map(_render_one, [self] * len(names), names))
+        if results is None:
+            results = [_render_one(self, name) for name in names]
+
+        self.timings = {name: round(elapsed, 4) for name, (_, elapsed) in zip(names, results)}
+        logger.info("圖表繪製耗時（秒）：%s", self.timings)
+        return [html for html, _ in results]
+
+    def _html_page(self, charts_html):
+        """html 模式：各圖表的 HTML 片段組成單一頁面"""
+        return f"""
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="UTF-8">
             <meta name="viewport" content="width=device-width, initial-scale=1.0">
             <title>分帳結果圖表</title>
-            <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+            <script src="{plotly_js_url()}"></script>
             <style>
                 body {{ margin:0; padding:0; display:flex; flex-direction:column; align-items:center; }}
                 .chart-container {{ width:100%; max-width:1200px; margin:20px 0; }}
@@ -212,12 +371,46 @@ class ChartGenerator:
         </html>
         """
 
-        # 確保輸出目錄存在
-        os.makedirs(output_dir, exist_ok=True)
+    def _compact_page(self, charts_json):
+        """compact 模式：單一頁面範本，圖表資料以 JSON 嵌入並於瀏覽器端繪製"""
+        divs = "".join(f'<div class="chart-container" id="c{i}"></div>' for i in range(len(charts_json)))
+        # 避免資料中的 "</" 提前結束 <script>
+        figures = f"[{','.join(charts_json)}]".replace("</", "<\\/")
+        return (
+            '<!DOCTYPE html><html><head><meta charset="UTF-8">'
+            '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
+            f'<title>分帳結果圖表</title><script src="{plotly_js_url()}"></script>'
+            f'<style>{PAGE_STYLE}</style></head><body>{divs}<script>'
+            f'var T={_default_template_json()},F={figures};'
+            'F.forEach(function(f,i){f.layout.template=T;'
+            'Plotly.newPlot("c"+i,f.data,f.layout,{responsive:true});});'
+            '</script></body></html>'
+        )
+
+    def publish(self, store):
+        """
+        組合所有圖表為單一 HTML 檔案，連同預先壓縮的版本一次寫入 store，回傳檔名。
+        檔名由摘要資料的雜湊決定：相同帳本直接沿用既有檔案，不重新繪製。
+        """
+        chart_name = f"{CHART_PREFIX}{self.digest}.html"
+        if store.exists(chart_name):
+            store.touch(chart_name)
+            return chart_name
+
+        charts = self.render_charts()
+        if self.output_mode == "compact":
+            full_html = self._compact_page(charts)
+        else:
+            full_html = self._html_page(charts)
 
-        # 儲存到指定路徑
-        chart_path = os.path.join(output_dir, "separate_charts.html")
-        with open(chart_path, "w", encoding="utf-8") as f:
-            f.write(full_html)
+        # 預先壓縮（gzip / brotli）；主檔案最後寫入，存在即代表各版本皆已完成
+        data = full_html.encode("utf-8")
+        artifacts = [(chart_name + ENCODING_SUFFIXES[encoding], body)
+                     for encoding, body in compress_variants(data).items()]
+        artifacts.append((chart_name, data))
+        store.write_many(artifacts)
+        return chart_name
 
-        return chart_path
\ No newline at end of file
+    def generate_charts(self, output_dir="static/charts"):
+        """輸出至本機資料夾，回傳圖表檔案路徑"""
+        return os.path.join(output_dir, self.publish(LocalArtifactStore(output_dir)))
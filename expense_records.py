@@ -0,0 +1,134 @@
+"""
+帳本紀錄：以 __slots__ 實作的付款（Payment）與分攤（Split）。
+參與者不逐筆複製成員名單，而是以「共用的成員名單 tuple - 不參與者 frozenset」表示：
+大多數項目由所有人分攤時，每筆紀錄只佔固定大小，記憶體不再隨 成員數 × 付款筆數 成長。
+
+相容檢視：紀錄可像原本的 dict 一樣以 record["participants"] 等方式讀取（參與者為 list），
+get_summary()、ChartGenerator 等以 dict 存取的程式不需修改。
+"""
+
+EMPTY = frozenset()
+
+
+class Payment:
+    """一筆付款；members 為建立時的成員名單（所有紀錄共用同一個 tuple），excluded 為不參與者"""
+
+    __slots__ = ("payer", "amount", "item", "members", "excluded")
+
+    # 相容檢視的欄位（與原本 dict 的鍵相同）
+    FIELDS = ("payer", "amount", "item", "participants")
+
+    def __init__(self, payer, amount, item, members, excluded=EMPTY):
+        self.payer = payer
+        self.amount = amount
+        self.item = item
+        self.members = members
+        self.excluded = excluded
+
+    @property
+    def participants(self):
+        """參與者（依成員名單順序）；沒有不參與者時直接回傳共用的成員名單"""
+        if not self.excluded:
+            return self.members
+        return tuple(m for m in self.members if m not in self.excluded)
+
+    @property
+    def participant_count(self):
+        return len(self.members) - len(self.excluded)
+
+    def excluding(self, names):
+        """回傳加入不參與者後的新紀錄；不在成員名單中的名稱略過"""
+        return self._replace(excluded=self.excluded | (set(names) & set(self.members)))
+
+    def including(self, names):
+        """回傳取消不參與者後的新紀錄"""
+        return self._replace(excluded=self.excluded - set(names))
+
+    def _replace(self, **changes):
+        # 依實際類別複製所有 slots（含子類別的欄位），回傳同類別的新紀錄
+        fields = {name: getattr(self, name)
+                  for cls in reversed(type(self).__mro__) for name in getattr(cls, "__slots__", ())}
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def to_dict(self):
+        # 精簡的純資料表示（不含成員名單，由 ExpenseManager 一併保存）；不參與者依成員名單順序排列
+        return {"payer": self.payer, "amount": self.amount, "item": self.item,
+                "excluded": [m for m in self.members if m in self.excluded] if self.excluded else []}
+
+    @classmethod
+    def from_dict(cls, data, members):
+        # 由 to_dict() 的結果還原；亦接受舊格式（逐筆保存 participants）
+        if "excluded" in data:
+            excluded = frozenset(data["excluded"])
+        else:
+            participants = set(data.get("participants", members))
+            excluded = frozenset(m for m in members if m not in participants)
+        return cls(data["payer"], data["amount"], data["item"], members, excluded or EMPTY)
+
+    # -------------------------------------------------------------------------
+    # 相容檢視：唯讀的 dict 介面
+    # -------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        return list(value) if key == "participants" else value
+
+    def get(self, key, default=None):
+        return self[key] if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def __eq__(self, other):
+        if isinstance(other, Payment):
+            return type(self) is type(other) and dict(self.items()) == dict(other.items())
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    __hash__ = None  # 與 dict 相同，不可雜湊
+
+    def items(self):
+        return [(key, self[key]) for key in self.FIELDS]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.FIELDS)})"
+
+
+class Split(Payment):
+    """一筆付款的分攤結果：每人應付金額以參與人數計算（四捨五入至 2 位小數）"""
+
+    __slots__ = ("per_person",)
+
+    FIELDS = ("item", "amount", "participants", "per_person", "payer")
+
+    def __init__(self, payer, amount, item, members, excluded=EMPTY, per_person=None):
+        super().__init__(payer, amount, item, members, excluded)
+        if per_person is None:
+            count = self.participant_count
+            per_person = round(amount / count, 2) if count else 0
+        self.per_person = per_person
+
+    @classmethod
+    def of(cls, payment):
+        """由付款紀錄建立分攤資料（與付款共用成員名單與不參與者）"""
+        return cls(payment.payer, payment.amount, payment.item, payment.members, payment.excluded)
+
+    def _replace(self, **changes):
+        # 參與者可能改變：未指定 per_person 時依新的參與人數重新計算
+        changes.setdefault("per_person", None)
+        return super()._replace(**changes)
+
+    def to_dict(self):
+        return dict(super().to_dict(), per_person=self.per_person)
@@ -0,0 +1,20 @@
+"""
+延遲載入較重的套件（openai、plotly、numpy），縮短冷啟動時間。
+所有延遲匯入共用同一把鎖：即使由不同模組、不同執行緒同時觸發第一次匯入，
+一次也只有一個匯入在進行，不會讀到其他執行緒尚未初始化完成的模組（例如 openai 與 plotly 都會載入的 numpy）。
+"""
+import importlib
+import sys
+import threading
+
+_lock = threading.RLock()  # 可重入：匯入的模組本身也可能再延遲匯入其他模組
+
+
+def lazy_import(name):
+    """匯入並回傳模組，例如 lazy_import("numpy")；已載入完成的模組直接回傳，不取得鎖"""
+    module = sys.modules.get(name)
+    spec = getattr(module, "__spec__", None)
+    if module is not None and not getattr(spec, "_initializing", False):
+        return module
+    with _lock:
+        return importlib.import_module(name)
@@ -0,0 +1,239 @@
+import re
+import unicodedata
+from collections import namedtuple
+from operator import itemgetter
+
+# 三段式資料的標題（與 OpenAI 解析結果、手動輸入格式一致）
+SECTION_TITLES = ("【一、成員名單】", "【二、付款記錄】", "【三、分攤情況】")
+
+# 標準格式文法（即歡迎訊息中的範例格式）
+MEMBERS_PTN = re.compile(r"^成員(?:有|名單)?\s*[：:]?\s*(.+)$")
+PAYMENT_PTN = re.compile(r"^(\S+?)\s*付了\s*([0-9０-９][0-9０-９,，.．]*)\s*元\s*(\S.*)$")
+EXCLUSION_PTN = re.compile(r"^(.+?)沒(.+)$")
+NAME_SEP_PTN = re.compile(r"\s*[、,，]\s*")
+
+# 金額：可含千分位逗號（1,234.5）；全形數字與標點先以 NFKC 轉為半形
+AMOUNT_PTN = re.compile(r"[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?")
+
+# 三段式資料的逐行文法（re.M：整段一次比對，於 C 層完成掃描）
+# 各欄位切在第一個「付了」/「元」/「沒」，且不使用非貪婪比對：每行只掃描一次，格式錯誤的行不會造成回溯
+# 標題前可有同一行的前綴（例如 OpenAI 輸出的「### 」、「1. 」），前綴不屬於任何段落；非貪婪比對限於同一行，每行只掃描一次
+TITLE_LINE_PTN = re.compile(r"^[^\n]*?(" + "|".join(map(re.escape, SECTION_TITLES)) + ")", re.M)
+PAYMENT_LINE_PTN = re.compile(r"^([^\n付]*(?:付(?!了)[^\n付]*)*)付了([^\n元]*)元([^\n]*)$", re.M)
+EXCLUSION_LINE_PTN = re.compile(r"^([^\n沒]*)沒([^\n]*)$", re.M)
+PLAIN_AMOUNTS_PTN = re.compile(r"(?:\d+(?:\.\d+)?\n)*\d+(?:\.\d+)?")  # 以換行串接、皆為一般半形數字的金額
+INNER_SPACE_PTN = re.compile(r"[^\S\n]")
+
+# parse_ledger 的結果：members 為成員名單，payments 為 [(付款人, 金額, 項目)]，exclusions 為 [(項目, [成員...])]
+ParsedLedger = namedtuple("ParsedLedger", ["members", "payments", "exclusions"])
+
+
+def split_names(text):
+    """以頓號或逗號分隔名單，移除空白項目"""
+    return [n for n in NAME_SEP_PTN.split(text.strip()) if n]
+
+
+# -----------------------------------------------------------------------------
+# 三段式資料：線性時間的解析器
+# -----------------------------------------------------------------------------
+def parse_amount(text):
+    """解析金額，支援千分位逗號與全形數字（例如「１,２００」）；格式不符 => ValueError"""
+    normalized = unicodedata.normalize("NFKC", text).strip()
+    if not AMOUNT_PTN.fullmatch(normalized):
+        raise ValueError(f"金額格式錯誤：{text.strip()}")
+    return float(normalized.replace(",", ""))
+
+
+def _amounts(texts):
+    # 全部為一般半形數字時以一次比對驗證後直接轉換，否則逐筆交給 parse_amount（千分位、全形、含空白）
+    if PLAIN_AMOUNTS_PTN.fullmatch("\n".join(texts)):
+        return list(map(float, texts))
+    return [parse_amount(t) for t in texts]
+
+
+def parse_member_names(text):
+    """解析以頓號分隔的成員名單；以集合檢查重複，成員名單為空或重複 => ValueError"""
+    members = [m.strip() for m in text.split("、") if m.strip()]
+    if not members:
+        raise ValueError("成員名單不得為空。")
+    if len(set(members)) != len(members):
+        seen, dup = set(), []
+        for m in members:
+            if m in seen and m not in dup:
+                dup.append(m)
+            seen.add(m)
+        raise ValueError(f"重複成員：{dup}")
+    return members
+
+
+def parse_payment_line(line):
+    """
+    解析一行付款紀錄「X付了Y元Z」，回傳 (付款人, 金額, 項目)。
+    以第一個「付了」及其後第一個「元」切分；格式不符 => ValueError
+    """
+    match = PAYMENT_LINE_PTN.fullmatch(line.strip())
+    payer, amount, item = (g.strip() for g in match.groups()) if match else ("", "", "")
+    if not payer or not item:
+        raise ValueError(f"格式錯誤：{line}")
+    return payer, parse_amount(amount), item
+
+
+def parse_payment_lines(text):
+    """
+    解析整段付款紀錄（每行一筆），回傳 [(付款人, 金額, 項目)]，結果與逐行呼叫 parse_payment_line 相同。
+    整段以 PAYMENT_LINE_PTN 一次比對；有空白行或格式錯誤時才逐行檢查，以回報第一個錯誤的行。
+    沒有任何付款 => ValueError
+    """
+    if not text.strip():
+        raise ValueError("付款記錄不得為空。")
+    rows = PAYMENT_LINE_PTN.findall(text)
+    if INNER_SPACE_PTN.search(text):
+        rows = [(payer.strip(), amount, item.strip()) for payer, amount, item in rows]
+    payers = [row[0] for row in rows]
+    items = [row[2] for row in rows]
+    if len(rows) != text.count("\n") + 1 or "" in payers or "" in items:
+        rows = [parse_payment_line(line) for line in text.split("\n") if line.strip()]
+        return rows
+    return list(zip(payers, _amounts([row[1] for row in rows]), items))
+
+
+def parse_exclusion_lines(text):
+    """解析整段分攤例外「項目沒A、B」，回傳 [(項目, [成員...])]；不含「沒」的行（例如「所有均分」）略過"""
+    return [(item.strip(), [n.strip() for n in names.split("、") if n.strip()])
+            for item, names in EXCLUSION_LINE_PTN.findall(text)]
+
+
+def split_sections(text):
+    """
+    將三段式資料分為 [成員段, 付款段, 分攤段]（移除標題）。
+    標題可位於行中（例如「### 【一、成員名單】」），依標題本身決定段落（不依出現順序）；
+    第一個標題前的文字與標題所在行的前綴略過。
+    段落缺失或重複 => ValueError
+    """
+    bodies = [None, None, None]
+    matches = list(TITLE_LINE_PTN.finditer(text))
+    for k, match in enumerate(matches):
+        index = SECTION_TITLES.index(match.group(1))
+        if bodies[index] is not None:
+            raise ValueError(f"段落重複：{match.group(1)}")
+        end = matches[k + 1].start() if k + 1 < len(matches) else len(text)
+        bodies[index] = text[match.end():end].strip()
+    missing = [title for title, body in zip(SECTION_TITLES, bodies) if body is None]
+    if missing:
+        raise ValueError(f"缺少段落：{'、'.join(missing)}")
+    return bodies
+
+
+def parse_ledger(text):
+    """
+    解析三段式資料（OpenAI 解析結果或手動輸入），回傳 ParsedLedger。
+    每段各掃描一次；成員可分多行輸入；付款人、分攤項目以集合檢查。整體為線性時間。
+    任何錯誤 => ValueError（訊息與 ExpenseManager.process_* 相同）
+    """
+    member_text, payment_text, exclusion_text = split_sections(text)
+    members = parse_member_names(member_text.replace("\n", "、"))
+    payments = parse_payment_lines(payment_text)
+    exclusions = parse_exclusion_lines(exclusion_text)
+
+    member_set = set(members)
+    if not member_set.issuperset(map(itemgetter(0), payments)):
+        payer = next(p for p, _, _ in payments if p not in member_set)
+        raise ValueError(f"付款人 '{payer}' 不在成員名單中。")
+    items = set(map(itemgetter(2), payments))
+    if not items.issuperset(map(itemgetter(0), exclusions)):
+        item = next(i for i, _ in exclusions if i not in items)
+        raise ValueError(f"無此項目：{item}")
+    return ParsedLedger(members, payments, exclusions)
+
+
+def parse_canonical_input(text):
+    """
+    以本地文法解析標準格式輸入，例如：
+        成員有Alice、Bob、Charlie
+        Alice付了100元晚餐
+        晚餐沒Charlie
+    成功 => 回傳 [成員段, 付款段, 分攤段]，可直接交給 ExpenseManager
+    任一行不符文法或資料不一致 => 回傳 None（由呼叫端改用 OpenAI 解析）
+    """
+    members = None
+    payments = []
+    exclusions = []
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        match = MEMBERS_PTN.match(line)
+        if match:
+            if members is not None:
+                return None  # 成員名單只能出現一次
+            members = split_names(match.group(1))
+            continue
+        match = PAYMENT_PTN.match(line)
+        if match:
+            payments.append(match.groups())
+            continue
+        match = EXCLUSION_PTN.match(line)
+        if match:
+            exclusions.append((match.group(1).strip(), split_names(match.group(2))))
+            continue
+        return None
+
+    if not members or not payments or len(members) != len(set(members)):
+        return None
+    member_set = set(members)
+    items = set()
+    for payer, amount, item in payments:
+        if payer not in member_set:
+            return None
+        try:
+            parse_amount(amount)
+        except ValueError:
+            return None
+        items.add(item.strip())
+    for item, excluded in exclusions:
+        if item not in items or not excluded or not member_set.issuperset(excluded):
+            return None
+
+    return [
+        "、".join(members),
+        "\n".join(f"{payer}付了{amount}元{item.strip()}" for payer, amount, item in payments),
+        "\n".join(f"{item}沒{'、'.join(excluded)}" for item, excluded in exclusions) or "所有均分"
+    ]
+
+
+def format_sections(sections):
+    """將三段資料加上標題，組成與 OpenAI 解析結果相同的文字格式"""
+    return "\n".join(f"{title}\n{body}" for title, body in zip(SECTION_TITLES, sections))
+
+
+def parse_followup(text):
+    """
+    解析帳本完成後的追加訊息，每行為一筆付款或分攤例外，例如：
+        Bob付了50元飲料
+        飲料沒Alice
+    回傳 [("payment", 付款人, 金額, 項目) 或 ("exclusion", 項目, [成員...])]
+    任一行不符文法 => 回傳 None
+    """
+    updates = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        match = PAYMENT_PTN.match(line)
+        if match:
+            payer, amount, item = match.groups()
+            try:
+                updates.append(("payment", payer, parse_amount(amount), item.strip()))
+            except ValueError:
+                return None
+            continue
+        match = EXCLUSION_PTN.match(line)
+        if match and not MEMBERS_PTN.match(line):
+            names = split_names(match.group(2))
+            if not names:
+                return None
+            updates.append(("exclusion", match.group(1).strip(), names))
+            continue
+        return None
+    return updates or None
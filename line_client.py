@@ -0,0 +1,151 @@
+import functools
+import json
+import logging
+import os
+import random
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from linebot import LineBotApi
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
+
+logger = logging.getLogger(__name__)
+
+# LINE API 連線與重試設定
+LINE_POOL_SIZE = int(os.getenv("LINE_POOL_SIZE", "10"))          # keep-alive 連線池大小
+LINE_MAX_RETRIES = int(os.getenv("LINE_MAX_RETRIES", "3"))       # 暫時性錯誤的最多重試次數
+LINE_BACKOFF_BASE = float(os.getenv("LINE_BACKOFF_BASE", "0.2"))  # 第一次重試的等待上限（秒）
+LINE_BACKOFF_MAX = float(os.getenv("LINE_BACKOFF_MAX", "2.0"))     # 單次退避等待的上限（秒）
+LINE_REQUEST_DEADLINE = float(os.getenv("LINE_REQUEST_DEADLINE", "10"))  # 單次 API 呼叫含重試的期限（秒）
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", LineBotApi.DEFAULT_API_ENDPOINT)  # 壓力測試時可指向本機假伺服器
+
+
+class PooledHttpClient(RequestsHttpClient):
+    """
+    LineBotApi 使用的 HTTP client：
+    - 共用同一個 requests.Session，連線保持 keep-alive，不必每次重新握手
+    - 429 與尚未送出的連線失敗一律重試；502/503/504 與送出後中斷的連線只在冪等請求
+      （GET / PUT / DELETE，或帶 X-Line-Retry-Key 的 push 等 POST）重試
+    - 以指數退避 + 隨機抖動等待；伺服器給 Retry-After 時依其等待，所有等待都不超過請求期限
+    reply 等非冪等的 POST 遇到 5xx 或讀取逾時不重試：請求可能已被 LINE 處理，重送會造成重複訊息。
+    """
+
+    RETRY_STATUSES = (429, 502, 503, 504)
+    NOT_PROCESSED_STATUSES = (429,)  # LINE 未處理請求的狀態碼，非冪等請求也可重試
+    RETRY_KEY_PATHS = ("/v2/bot/message/push", "/v2/bot/message/multicast",
+                       "/v2/bot/message/narrowcast", "/v2/bot/message/broadcast")
+
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT, session=None, max_retries=LINE_MAX_RETRIES,
+                 backoff_base=LINE_BACKOFF_BASE, backoff_max=LINE_BACKOFF_MAX, deadline=LINE_REQUEST_DEADLINE,
+                 sleep=time.sleep, clock=time.monotonic):
+        super().__init__(timeout)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=LINE_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._sleep = sleep
+        self._clock = clock
+        self.retries = 0
+
+    def backoff(self, attempt, retry_after=None):
+        """第 attempt 次重試前的等待秒數：有 Retry-After 時以其為準，否則 full jitter（不超過 backoff_max）"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @classmethod
+    def is_idempotent(cls, method, url, headers):
+        """
+        重送不會造成重複效果的請求：非 POST，或支援 retry key 的端點帶 retry key 的 POST（LINE 對重複請求回應 409）。
+        未經 PooledLineBotApi 送出時，LineBotApi 會把 retry key 留在共用的 headers 中，之後的 reply 也會帶著，因此仍同時檢查端點。
+        """
+        if method != "POST":
+            return True
+        path = urlsplit(url).path
+        return path in cls.RETRY_KEY_PATHS and bool(headers and headers.get("X-Line-Retry-Key"))
+
+    @staticmethod
+    def not_sent(error):
+        """連線階段即失敗，請求尚未送到 LINE"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _request(self, method, url, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        idempotent = self.is_idempotent(method, url, kwargs.get("headers"))
+        statuses = self.RETRY_STATUSES if idempotent else self.NOT_PROCESSED_STATUSES
+        deadline = self._clock() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == self.max_retries or not (idempotent or self.not_sent(e)):
+                    raise
+                error = e
+                logger.warning("LINE API 連線失敗，重試中（%d/%d）：%s", attempt + 1, self.max_retries, e)
+            else:
+                if response.status_code not in statuses or attempt == self.max_retries:
+                    return RequestsHttpResponse(response)
+                header = response.headers.get("Retry-After")
+                retry_after = float(header) if header and header.isdigit() else None
+                error = None
+                logger.warning("LINE API 回應 %d，重試中（%d/%d）", response.status_code, attempt + 1, self.max_retries)
+            wait = self.backoff(attempt, retry_after)
+            if self._clock() + wait > deadline:
+                # 等待會超過請求期限：放棄重試，回傳最後一次的結果
+                logger.warning("LINE API 重試等待 %.1f 秒超過請求期限，停止重試", wait)
+                if error is not None:
+                    raise error
+                return RequestsHttpResponse(response)
+            self.retries += 1
+            self._sleep(wait)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request("GET", url, headers=headers, params=params, stream=stream, timeout=timeout)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request("POST", url, headers=headers, data=data, timeout=timeout)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request("DELETE", url, headers=headers, data=data, timeout=timeout)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request("PUT", url, headers=headers, data=data, timeout=timeout)
+
+
+class PooledLineBotApi(LineBotApi):
+    """
+    LineBotApi 的 push_message 會把 retry key 寫入所有執行緒共用的 self.headers：
+    兩個工作執行緒同時 push 時可能帶著同一個 retry key 送出（第二則被 LINE 以 409 拒絕而遺失），
+    之後的 reply 也會帶著殘留的 retry key。此處改為只放在該次請求的 headers 中，不修改共用狀態。
+    """
+
+    def push_message(self, to, messages, retry_key=None, notification_disabled=False, timeout=None):
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        headers = {"Content-Type": "application/json"}
+        if retry_key:
+            headers["X-Line-Retry-Key"] = retry_key
+        data = {
+            "to": to,
+            "messages": [message.as_json_dict() for message in messages],
+            "notificationDisabled": notification_disabled,
+        }
+        self._post("/v2/bot/message/push", data=json.dumps(data), headers=headers, timeout=timeout)
+
+
+def create_line_bot_api(channel_access_token, endpoint=LINE_API_ENDPOINT, **kwargs):
+    """建立使用連線池與重試機制的 LineBotApi；kwargs 傳給 PooledHttpClient"""
+    return PooledLineBotApi(channel_access_token, endpoint=endpoint,
+                            http_client=functools.partial(PooledHttpClient, **kwargs))
@@ -1,135 +1,491 @@
-import re
+import heapq
 import os
+import time
+from itertools import chain, islice
+from expense_records import EMPTY, Payment, Split
+from lazy_import import lazy_import
+from ledger_parser import parse_exclusion_lines, parse_member_names, parse_payment_lines
+
+ENGINES = ("python", "numpy")
+TRANSFER_MODES = ("greedy", "optimal")
+
+# optimal 模式的子集合 DP 需要 2^n 大小的表格（n=20 約 100 萬筆），超過此上限時間與記憶體都不可控
+EXACT_MAX_MEMBERS_LIMIT = 20
+
+
+def validate_exact_max_members(value):
+    """檢查 optimal 模式的人數上限（0 到 EXACT_MAX_MEMBERS_LIMIT），超出範圍 => ValueError"""
+    if not 0 <= value <= EXACT_MAX_MEMBERS_LIMIT:
+        raise ValueError(f"exact_max_members 必須介於 0 到 {EXACT_MAX_MEMBERS_LIMIT}：{value}")
+    return value
+
+def _fit(pieces, limit):
+    # 超過上限的片段先依行切開，單行仍超過上限時再依字數切開
+    for piece in pieces:
+        if len(piece) <= limit:
+            yield piece
+            continue
+        for line in piece.splitlines(keepends=True):
+            for i in range(0, len(line), limit):
+                yield line[i:i + limit]
+
+
+def chunk_text(pieces, limit):
+    """
+    將依序產生的文字片段合併為每則不超過 limit 字的訊息（於片段邊界切分，必要時切在行尾）。
+    片段逐一讀取，不需先組出完整字串；每則訊息去除開頭與結尾的空行，空白訊息略過。
+    """
+    buf, size = [], 0
+    for piece in _fit(pieces, limit):
+        if size + len(piece) > limit:
+            chunk = "".join(buf).strip("\n")
+            if chunk:
+                yield chunk
+            buf, size = [], 0
+        buf.append(piece)
+        size += len(piece)
+    chunk = "".join(buf).strip("\n")
+    if chunk:
+        yield chunk
+
 
 class ExpenseManager:
-    def __init__(self, members=None, payments=None):
+    def __init__(self, members=None, payments=None, engine="python", transfer_mode="greedy",
+                 exact_time_budget=0.2, exact_max_members=14):
         # 初始化屬性
+        if engine not in ENGINES:
+            raise ValueError(f"未知的計算引擎：{engine}")
+        if transfer_mode not in TRANSFER_MODES:
+            raise ValueError(f"未知的轉帳模式：{transfer_mode}")
+        validate_exact_max_members(exact_max_members)
         self.members = members if members else []     # 成員名單
-        self.payments = payments if payments else []  # 付款記錄
-        self.detailed_split = []                      # 詳細分攤資料
+        self.payments = []                            # 付款記錄（Payment）
+        self.detailed_split = []                      # 詳細分攤資料（Split）
         self.balances = {}                            # 每人餘額
         self.transfers = []                           # 轉帳方案
+        self.engine = engine                          # 計算引擎："python" 或 "numpy"（大型帳本）
+        self._matrix = None                           # numpy 引擎的參與矩陣
+        self.transfer_mode = transfer_mode            # 轉帳方案："greedy" 或 "optimal"（最少轉帳次數）
+        self.exact_time_budget = exact_time_budget    # optimal 模式的時間上限（秒）
+        self.exact_max_members = exact_max_members    # optimal 模式最多處理的非零餘額人數
+        self.total_paid = None                        # 每人已付金額（增量更新用）
+        self.total_owed = None                        # 每人應付金額（增量更新用）
+        self._roster_cache = None                     # 所有紀錄共用的成員名單 tuple
+        if payments:
+            roster = self._roster()
+            self.payments = [p if isinstance(p, Payment) else Payment.from_dict(p, roster) for p in payments]
 
     def process_members(self, input_members):
         # 處理成員輸入（不得重複、不得為空）
-        self.members = [m.strip() for m in input_members.strip().split("、") if m.strip()]
-        if not self.members:
-            raise ValueError("成員名單不得為空。")
-        if len(self.members) != len(set(self.members)):
-            dup = [m for m in self.members if self.members.count(m) > 1]
-            raise ValueError(f"重複成員：{dup}")
+        self.members = parse_member_names(input_members)
         return self.members
 
     def process_payments(self, input_payments):
         # 處理付款紀錄：格式 "X付了Y元Z"
-        ptn = r"(.+)付了(.+)元(.+)"
-        self.payments = []
-        for line in input_payments.strip().split('\n'):
-            match = re.match(ptn, line)
-            if not match:
-                raise ValueError(f"格式錯誤：{line}")
-            payer, amt_str, item = match.group(1).strip(), match.group(2).strip(), match.group(3).strip()
-            try:
-                amount = float(amt_str)
-            except ValueError:
-                raise ValueError(f"金額格式錯誤：{amt_str}")
-            if payer not in self.members:
-                raise ValueError(f"付款人 '{payer}' 不在成員名單中。")
-            self.payments.append({
-                "payer": payer,
-                "amount": amount,
-                "item": item,
-                "participants": self.members[:]
-            })
-        return self.payments
+        return self._set_payments(parse_payment_lines(input_payments))
 
     def process_splits(self, input_splits):
         # 處理"沒"字句，排除不參與者，例如："晚餐沒Alice、Bob"
-        pay_map = {p["item"]: p for p in self.payments}
-        for line in input_splits.strip().split('\n'):
-            if "沒" in line:
-                item, excluded_str = line.split("沒", 1)
-                item = item.strip()
-                excluded = excluded_str.strip().split("、") if excluded_str.strip() else []
-                if item not in pay_map:
-                    raise ValueError(f"無此項目：{item}")
-                pay_map[item]["participants"] = [m for m in pay_map[item]["participants"] if m not in excluded]
+        return self._apply_exclusions(parse_exclusion_lines(input_splits))
+
+    def load_ledger(self, ledger):
+        # 一次載入 ledger_parser.parse_ledger() 的結果（已驗證），等同依序呼叫 process_members / payments / splits
+        self.members = list(ledger.members)
+        self._set_payments(ledger.payments)
+        return self._apply_exclusions(ledger.exclusions)
+
+    def _roster(self):
+        # 所有紀錄共用的成員名單 tuple（不逐筆複製）；以內容比對，成員名單被替換或就地修改（append 等）時重建
+        roster = tuple(self.members)
+        if roster != self._roster_cache:
+            self._roster_cache = roster
+        return self._roster_cache
+
+    def _set_payments(self, rows):
+        # rows：[(付款人, 金額, 項目)]；付款人以集合檢查，參與者預設為所有成員
+        self._matrix = None
+        self.total_paid = self.total_owed = None
+        roster = self._roster()
+        member_set = set(roster)
+        for payer, _, _ in rows:
+            if payer not in member_set:
+                raise ValueError(f"付款人 '{payer}' 不在成員名單中。")
+        self.payments = [Payment(payer, amount, item, roster) for payer, amount, item in rows]
+        return self.payments
+
+    def _apply_exclusions(self, exclusions):
+        # exclusions：[(項目, [不參與者...])]；同名項目以最後一筆為準，不在成員名單中的名稱略過
+        self.total_paid = self.total_owed = None
+        self._matrix = None
+        row_of = {p.item: r for r, p in enumerate(self.payments)}
+        member_set = set(self._roster())
+        excluded_by_row = {}
+        for item, excluded in exclusions:
+            if item not in row_of:
+                raise ValueError(f"無此項目：{item}")
+            r = row_of[item]
+            excluded_by_row[r] = excluded_by_row.get(r, self.payments[r].excluded).union(member_set.intersection(excluded))
+        for r, excluded in excluded_by_row.items():
+            self.payments[r].excluded = frozenset(excluded) or EMPTY
 
         # 計算分攤結果
-        self.detailed_split = []
-        for p in self.payments:
-            part = p["participants"]
-            per_person = round(p["amount"] / len(part), 2) if part else 0
-            self.detailed_split.append({
-                "item": p["item"],
-                "amount": p["amount"],
-                "participants": part,
-                "per_person": per_person,
-                "payer": p["payer"]
-            })
+        self.detailed_split = [Split.of(p) for p in self.payments]
         return self.detailed_split
 
     def calculate_and_format(self):
-        # 計算每人多/少付狀況
-        total_paid = {m: 0 for m in self.members}
-        total_owed = {m: 0 for m in self.members}
+        # 計算並格式化完整結果
+        self.calculate()
+        return self.format_output(self.detailed_split, self.balances, self.transfers, self.total_paid, self.total_owed)
 
-        for d in self.detailed_split:
-            total_paid[d["payer"]] += d["amount"]
-            for pt in d["participants"]:
-                total_owed[pt] += d["per_person"]
+    def settle_and_format(self):
+        # 依目前餘額重新計算轉帳方案並格式化（不重新累加總額，供增量更新後使用）
+        self.settle()
+        return self.format_output(self.detailed_split, self.balances, self.transfers, self.total_paid, self.total_owed)
+
+    def calculate(self):
+        # 計算每人多/少付狀況與轉帳方案（不格式化，結果可再以 iter_output() / output_messages() 輸出）
+        if self.engine == "numpy":
+            total_paid, total_owed = self._calculate_totals_numpy()
+        else:
+            total_paid = {m: 0 for m in self.members}
+            total_owed = {m: 0 for m in self.members}
 
+            for d in self.detailed_split:
+                total_paid[d.payer] += d.amount
+                per_person = d.per_person
+                for pt in d.participants:
+                    total_owed[pt] += per_person
+
+        self.total_paid, self.total_owed = total_paid, total_owed
         self.balances = {m: round(total_paid[m] - total_owed[m], 2) for m in self.members}
-        self.transfers = self.calculate_transfers(self.balances)
-        return self.format_output(self.detailed_split, self.balances, self.transfers, total_paid, total_owed)
+        self.settle()
+
+    def settle(self):
+        # 依目前餘額重新計算轉帳方案（不重新累加總額，供增量更新後使用）
+        self._ensure_totals()
+        if self.transfer_mode == "optimal":
+            self.transfers = self.calculate_optimal_transfers(self.balances)
+        else:
+            self.transfers = self.calculate_transfers(self.balances)
+
+    # -------------------------------------------------------------------------
+    # 增量更新：只調整受影響成員的總額與餘額，轉帳方案於 settle_and_format() 時重算
+    # -------------------------------------------------------------------------
+    def _ensure_totals(self):
+        # 尚未累加過（例如由 session 還原）=> 依 detailed_split 完整計算一次
+        if self.total_paid is not None:
+            return
+        self.total_paid = {m: 0 for m in self.members}
+        self.total_owed = {m: 0 for m in self.members}
+        for d in self.detailed_split:
+            self._apply_split(d, 1, update_balances=False)
+        self.balances = {m: round(self.total_paid[m] - self.total_owed[m], 2) for m in self.members}
+
+    def _apply_split(self, split, sign, update_balances=True):
+        # 將單筆分攤加入（sign=1）或移出（sign=-1）總額，並更新受影響成員的餘額
+        self.total_paid[split.payer] += sign * split.amount
+        participants = split.participants
+        for pt in participants:
+            self.total_owed[pt] += sign * split.per_person
+        if update_balances:
+            for m in {split.payer, *participants}:
+                self.balances[m] = round(self.total_paid[m] - self.total_owed[m], 2)
+
+    def _find_item(self, item):
+        # 同名項目以最後一筆為準（與 process_splits 相同）
+        for i in range(len(self.payments) - 1, -1, -1):
+            if self.payments[i].item == item:
+                return i
+        raise ValueError(f"無此項目：{item}")
+
+    def _validate_payment(self, payer, amount, item):
+        if payer not in self.members:
+            raise ValueError(f"付款人 '{payer}' 不在成員名單中。")
+        if not item:
+            raise ValueError("項目名稱不得為空。")
+        return float(amount)
+
+    def add_payment(self, payer, amount, item, excluded=None):
+        # 新增一筆付款（可同時指定不參與者）
+        amount = self._validate_payment(payer, amount, item)
+        self._ensure_totals()
+        payment = Payment(payer, amount, item, self._roster())
+        if excluded:
+            payment = payment.excluding(excluded)
+        split = Split.of(payment)
+        self.payments.append(payment)
+        self.detailed_split.append(split)
+        self._apply_split(split, 1)
+        self._matrix = None
+        return payment
+
+    def remove_payment(self, index):
+        # 刪除第 index 筆付款
+        self._ensure_totals()
+        self._apply_split(self.detailed_split[index], -1)
+        del self.detailed_split[index]
+        self._matrix = None
+        return self.payments.pop(index)
+
+    def edit_payment(self, index, payer=None, amount=None, item=None):
+        # 修改第 index 筆付款的付款人、金額或項目（參與者不變）
+        old = self.payments[index]
+        payer = old.payer if payer is None else payer
+        item = old.item if item is None else item
+        amount = self._validate_payment(payer, old.amount if amount is None else amount, item)
+        self._ensure_totals()
+        self._apply_split(self.detailed_split[index], -1)
+        payment = old._replace(payer=payer, amount=amount, item=item)
+        split = Split.of(payment)
+        self.payments[index] = payment
+        self.detailed_split[index] = split
+        self._apply_split(split, 1)
+        self._matrix = None
+        return payment
+
+    def exclude(self, item, names):
+        # 新增不參與者，例如 exclude("晚餐", ["Alice"]) 等同 "晚餐沒Alice"
+        index = self._find_item(item)
+        return self._set_payment(index, self.payments[index].excluding(names))
+
+    def include(self, item, names):
+        # 取消不參與者（恢復分攤），順序依成員名單
+        index = self._find_item(item)
+        return self._set_payment(index, self.payments[index].including(names))
+
+    def _set_payment(self, index, payment):
+        self._ensure_totals()
+        self._apply_split(self.detailed_split[index], -1)
+        self.payments[index] = payment
+        split = Split.of(payment)
+        self.detailed_split[index] = split
+        self._apply_split(split, 1)
+        self._matrix = None
+        return split
+
+    # -------------------------------------------------------------------------
+    # NumPy 向量化引擎：結果與 python 引擎完全相同
+    # -------------------------------------------------------------------------
+    def _participation_matrix(self, np, splits):
+        # 建立 付款 × 成員 的參與矩陣（True 表示該成員分攤該筆付款）：先全部設為參與，再清除不參與者
+        index = {m: i for i, m in enumerate(self.members)}
+        roster = self._roster()
+        matrix = np.ones((len(splits), len(self.members)), dtype=bool)
+        for r, d in enumerate(splits):
+            if d.members != roster:
+                # 成員名單更換前建立的紀錄：依參與者逐一設定
+                matrix[r] = False
+                matrix[r, [index[m] for m in d.participants]] = True
+            elif d.excluded:
+                matrix[r, [index[m] for m in d.excluded]] = False
+        return matrix
+
+    def _calculate_totals_numpy(self):
+        np = lazy_import("numpy")
+
+        index = {m: i for i, m in enumerate(self.members)}
+        matrix = self._matrix
+        if matrix is None or matrix.shape != (len(self.detailed_split), len(self.members)):
+            matrix = self._participation_matrix(np, self.detailed_split)
+            self._matrix = matrix
+
+        amounts = np.array([d.amount for d in self.detailed_split], dtype=float)
+        per_person = np.array([d.per_person for d in self.detailed_split], dtype=float)
+        payers = np.array([index[d.payer] for d in self.detailed_split], dtype=np.intp)
+
+        # bincount 與逐列累加皆依付款順序相加，浮點結果與 python 引擎一致；
+        # 逐列加入總額向量，不建立 付款 × 成員 的浮點矩陣（1000 × 10000 筆即 80 MB）
+        paid = np.bincount(payers, weights=amounts, minlength=len(self.members))
+        owed = np.zeros(len(self.members))
+        for row, share in zip(matrix, per_person.tolist()):
+            owed[row] += share
+
+        total_paid = dict(zip(self.members, paid.tolist()))
+        total_owed = dict(zip(self.members, owed.tolist()))
+        return total_paid, total_owed
 
     def calculate_transfers(self, balances):
-        # 根據餘額計算轉帳方案
+        # 根據餘額計算轉帳方案：每次配對多付最多與少付最多的人（rule/split_rule.txt）
+        # 以堆積取最大值，O(n log n)；金額相同時以成員順序較前者優先，與逐次取 max() 的結果相同
         transfers = []
-        creditors = {m: b for m, b in balances.items() if b > 0}
-        debtors = {m: -b for m, b in balances.items() if b < 0}
+        creditors = [(-b, i, m) for i, (m, b) in enumerate(balances.items()) if b > 0]
+        debtors = [(b, i, m) for i, (m, b) in enumerate(balances.items()) if b < 0]
+        heapq.heapify(creditors)
+        heapq.heapify(debtors)
 
         while creditors and debtors:
-            cred = max(creditors.items(), key=lambda x: x[1])
-            debt = max(debtors.items(), key=lambda x: x[1])
-            amt = min(cred[1], debt[1])
-            transfers.append(f"{debt[0]} → {cred[0]} {self.format_number(amt)} 元")
-            creditors[cred[0]] -= amt
-            debtors[debt[0]] -= amt
-            if creditors[cred[0]] <= 0.001:
-                del creditors[cred[0]]
-            if debtors[debt[0]] <= 0.001:
-                del debtors[debt[0]]
+            cred_neg, cred_idx, cred = heapq.heappop(creditors)
+            debt_neg, debt_idx, debt = heapq.heappop(debtors)
+            cred_amt, debt_amt = -cred_neg, -debt_neg
+            amt = min(cred_amt, debt_amt)
+            transfers.append(f"{debt} → {cred} {self.format_number(amt)} 元")
+            cred_amt -= amt
+            debt_amt -= amt
+            if cred_amt > 0.001:
+                heapq.heappush(creditors, (-cred_amt, cred_idx, cred))
+            if debt_amt > 0.001:
+                heapq.heappush(debtors, (-debt_amt, debt_idx, debt))
 
         return transfers
 
+    def calculate_optimal_transfers(self, balances):
+        # 最少轉帳次數：將餘額分成最多組「總和為 0」的子群組，每組 k 人只需 k-1 筆轉帳
+        # 以 bitmask DP 求解；超出人數或時間上限時退回 greedy 結果
+        greedy = self.calculate_transfers(balances)
+        names = [m for m, b in balances.items() if round(b * 100) != 0]
+
+        # 金額恰好相反的兩人必可自成一組，先配對以縮小問題規模
+        groups, waiting = [], {}
+        for m in names:
+            cents = round(balances[m] * 100)
+            partners = waiting.get(-cents)
+            if partners:
+                groups.append([partners.pop(), m])
+            else:
+                waiting.setdefault(cents, []).append(m)
+        remaining = [m for ms in waiting.values() for m in ms]
+
+        if len(remaining) > self.exact_max_members:
+            return greedy
+        deadline = time.monotonic() + self.exact_time_budget
+        partition = self._zero_sum_partition([round(balances[m] * 100) for m in remaining], deadline)
+        if partition is None:
+            return greedy
+        groups += [[remaining[i] for i in g] for g in partition]
+
+        transfers = []
+        for g in groups:
+            transfers += self.calculate_transfers({m: balances[m] for m in g})
+        return transfers if len(transfers) < len(greedy) else greedy
+
+    @staticmethod
+    def _zero_sum_partition(cents, deadline):
+        # dp[mask]：將 mask 內成員排成序列時，總和為 0 的前綴最多有幾個
+        # 總額因四捨五入不為 0 時，剩下的成員自成最後一組
+        n = len(cents)
+        if n == 0:
+            return []
+        full = (1 << n) - 1
+        sums = [0] * (full + 1)
+        dp = [0] * (full + 1)
+        for mask in range(1, full + 1):
+            if mask & 1023 == 0 and time.monotonic() > deadline:
+                return None
+            low = mask & -mask
+            sums[mask] = sums[mask ^ low] + cents[low.bit_length() - 1]
+            best, bits = 0, mask
+            while bits:
+                bit = bits & -bits
+                if dp[mask ^ bit] > best:
+                    best = dp[mask ^ bit]
+                bits ^= bit
+            dp[mask] = best + (1 if sums[mask] == 0 else 0)
+
+        # 回溯：逆序移除成員，每遇到總和為 0 的前綴即切出一組
+        groups, current, mask = [], [], full
+        while mask:
+            bonus = 1 if sums[mask] == 0 else 0
+            bits = mask
+            while bits:
+                bit = bits & -bits
+                if dp[mask ^ bit] + bonus == dp[mask]:
+                    break
+                bits ^= bit
+            current.append(bit.bit_length() - 1)
+            mask ^= bit
+            if mask == 0 or sums[mask] == 0:
+                groups.append(current)
+                current = []
+        return groups
+
     def format_output(self, detailed_split, balances, transfers, total_paid, total_owed):
-        # 確保 fmt() 回傳字串
-        def fmt(n):
-            val = self.format_number(n)
-            return str(val)  # 強制轉字串，避免 join 時發生型態錯誤
+        # 完整結果的單一字串（逐段產生後一次串接）
+        return "".join(self._iter_sections(detailed_split, balances, transfers, total_paid))
+
+    def iter_output(self, summary_only=False):
+        """
+        逐段產生目前的結算結果（需先 calculate() 或 settle()），串接後與 format_output() 相同。
+        summary_only=True 時只輸出總覽、有餘額的成員與轉帳方案，適合大型帳本。
+        """
+        if summary_only:
+            return self._iter_summary(self.detailed_split, self.balances, self.transfers)
+        return self._iter_sections(self.detailed_split, self.balances, self.transfers, self.total_paid)
 
-        out = "【一、成員名單】\n" + "、".join(self.members) + "\n\n"
-        out += "【二、付款記錄】\n"
+    def output_messages(self, limit, max_messages=None, header=""):
+        """
+        將結算結果切成每則不超過 limit 字的訊息，header 加在第一則開頭。
+        完整結果超過 max_messages 則時改用摘要；摘要仍超過時保留前面的訊息，最後一則註明省略的則數。
+        完整結果只產生到第 max_messages + 1 則為止，大型帳本不會先組出整份明細。
+        """
+        chunks = list(islice(chunk_text(chain([header], self.iter_output()), limit),
+                             None if max_messages is None else max_messages + 1))
+        if max_messages is None or len(chunks) <= max_messages:
+            return chunks
+        chunks = list(chunk_text(chain([header], self.iter_output(summary_only=True)), limit))
+        if len(chunks) > max_messages:
+            omitted = len(chunks) - max_messages + 1
+            chunks = chunks[:max_messages - 1] + [f"（結果過長，其餘 {omitted} 則訊息已省略，完整資料請見圖表。）"]
+        return chunks
+
+    def _iter_sections(self, detailed_split, balances, transfers, total_paid):
+        # 每項付款、每位成員各為一段；金額字串與每人的應付項目位置先算好，避免逐成員掃描所有分攤資料
+        fmt = self._fmt
+        yield "【一、成員名單】\n" + "、".join(self.members) + "\n\n"
+        yield "【二、付款記錄】\n"
         for p in self.payments:
-            out += f'{p["payer"]}付了${fmt(p["amount"])}({p["item"]})\n'
-        out += "\n【三、分攤情況】\n"
-        for d in detailed_split:
-            out += (f'{d["item"]}${fmt(d["amount"])}\n'
-                    f'- 參與者：{"、".join(d["participants"])}\n'
-                    f'- 每人應付：{fmt(d["per_person"])} 元\n')
-        out += "\n【四、每人結算金額】\n"
+            yield f'{p.payer}付了${fmt(p.amount)}({p.item})\n'
+        yield "\n【三、分攤情況】\n"
+        per_person = []
+        owed_index = {m: [] for m in self.members}  # 成員 -> 有參與的分攤項目位置
+        for j, d in enumerate(detailed_split):
+            share = fmt(d.per_person)
+            per_person.append(share)
+            participants = d.participants
+            for pt in participants:
+                owed_index[pt].append(j)
+            yield (f'{d.item}${fmt(d.amount)}\n'
+                   f'- 參與者：{"、".join(participants)}\n'
+                   f'- 每人應付：{share} 元\n')
+        yield "\n【四、每人結算金額】\n"
         for m in self.members:
             bal = balances[m]
             status = "多付" if bal > 0 else "少付"
-            # 將 owed_items 全轉成字串
-            owed_items = [fmt(d["per_person"]) if m in d["participants"] else "0" for d in detailed_split]
-            out += (f'{m}：{status} {fmt(abs(bal))} 元\n'
-                    f'  詳細計算：({fmt(total_paid[m])} - {" - ".join(owed_items)})\n')
+            owed_items = ["0"] * len(per_person)
+            for j in owed_index[m]:
+                owed_items[j] = per_person[j]
+            yield (f'{m}：{status} {fmt(abs(bal))} 元\n'
+                   f'  詳細計算：({fmt(total_paid[m])} - {" - ".join(owed_items)})\n')
+        yield from self._iter_transfers(transfers)
+
+    def _iter_summary(self, detailed_split, balances, transfers):
+        # 摘要：省略成員名單、付款與分攤明細，以及已平衡的成員
+        fmt = self._fmt
+        total = sum(d.amount for d in detailed_split)
+        yield (f"【結算摘要】\n成員 {len(self.members)} 位、付款 {len(detailed_split)} 筆，"
+               f"總金額 {fmt(total)} 元\n（帳本較大，僅列出摘要）\n")
+        yield "\n【每人結算金額】\n"
+        settled = 0
+        for m in self.members:
+            bal = balances[m]
+            if bal == 0:
+                settled += 1
+                continue
+            yield f'{m}：{"多付" if bal > 0 else "少付"} {fmt(abs(bal))} 元\n'
+        if settled:
+            yield f"其餘 {settled} 位已平衡\n"
+        yield from self._iter_transfers(transfers)
+
+    @staticmethod
+    def _iter_transfers(transfers):
+        yield "\n【五、轉帳方案】\n"
+        if not transfers:
+            yield "無需轉帳，一切平衡！\n"
+        for t in transfers:
+            yield t + "\n"
 
-        out += "\n【五、轉帳方案】\n"
-        out += "\n".join(transfers) + "\n" if transfers else "無需轉帳，一切平衡！\n"
-        return out
+    def _fmt(self, n):
+        # format_number 的結果轉為字串，避免 join 時發生型態錯誤
+        return str(self.format_number(n))
 
     def get_summary(self):
         # 傳回摘要資料
@@ -141,6 +497,38 @@ class ExpenseManager:
             "transfers": self.transfers
         }
 
+    def to_dict(self):
+        # 序列化為純資料（供 session store 保存）：付款只保存不參與者，分攤資料只保存每人應付金額
+        return {
+            "members": self.members,
+            "payments": [p.to_dict() for p in self.payments],
+            "detailed_split": [d.per_person for d in self.detailed_split],
+            "balances": self.balances,
+            "transfers": self.transfers,
+            "engine": self.engine,
+            "transfer_mode": self.transfer_mode,
+            "exact_time_budget": self.exact_time_budget,
+            "exact_max_members": self.exact_max_members
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # 由 to_dict() 的結果還原（成員、餘額與轉帳皆複製，不與來源共用）
+        manager = cls(members=list(data.get("members") or []), payments=data.get("payments"),
+                      engine=data.get("engine", "python"),
+                      transfer_mode=data.get("transfer_mode", "greedy"),
+                      exact_time_budget=data.get("exact_time_budget", 0.2),
+                      exact_max_members=data.get("exact_max_members", 14))
+        manager.detailed_split = [
+            # 舊格式逐筆保存完整的分攤資料（dict）
+            Split(p.payer, p.amount, p.item, p.members, p.excluded,
+                  d["per_person"] if isinstance(d, dict) else d)
+            for p, d in zip(manager.payments, data.get("detailed_split", []))
+        ]
+        manager.balances = dict(data.get("balances", {}))
+        manager.transfers = list(data.get("transfers", []))
+        return manager
+
     @staticmethod
     def format_number(num):
         # 若為整數則轉為 int 否則四捨五入至2位小數
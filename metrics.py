@@ -0,0 +1,239 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 延遲直方圖的預設區間（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    量測當下數值，於輸出時呼叫 func 取得：
+    func 回傳數值，或 {標籤值 tuple: 數值}（有標籤時）
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, func, labelnames=(), kind="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+        self.kind = kind  # 由元件自行累計的計數（例如快取命中數）以 counter 型別輸出
+
+    def _samples(self):
+        try:
+            values = self.func()
+        except Exception:
+            logger.exception("讀取指標 %s 失敗", self.name)
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """累積區間直方圖（與 Prometheus histogram 相同格式）"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # 標籤 -> [各區間計數..., 總和, 次數]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[-1] if state else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, state):
+                cumulative += n
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """指標登錄表：同名指標只建立一次，render() 輸出 Prometheus 文字格式"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# 各階段延遲與 OpenAI 用量（stage：signature、openai、parse、settlement、chart、line_reply、line_push）
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "linebuddysplit_stage_seconds", "各處理階段耗時（秒）", ("stage",)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "linebuddysplit_stage_errors_total", "各處理階段發生例外的次數", ("stage",)
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "linebuddysplit_request_seconds", "HTTP 請求 / 背景事件的總耗時（秒）", ("route",)
+))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "linebuddysplit_openai_tokens_total", "OpenAI 使用的 token 數", ("kind",)
+))
+
+
+def register_gauge(name, documentation, func, labelnames=(), kind="gauge"):
+    """以回呼函式登錄 gauge（佇列長度、快取命中率等由各元件提供）；同名時覆蓋"""
+    REGISTRY.unregister(name)
+    return REGISTRY.register(Gauge(name, documentation, func, labelnames, kind))
+
+
+# -----------------------------------------------------------------------------
+# 單一請求的階段耗時：寫入直方圖，並於請求結束時輸出一行結構化日誌
+# -----------------------------------------------------------------------------
+_current_trace = contextvars.ContextVar("linebuddysplit_trace", default=None)
+
+
+def start_trace(route, **fields):
+    """開始記錄一個請求（或背景事件）的階段耗時"""
+    trace = {"route": route, "start": time.perf_counter(), "stages": {}, **fields}
+    _current_trace.set(trace)
+    return trace
+
+
+def annotate(**fields):
+    """替目前的請求加上欄位（例如使用者、事件數）"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+
+def finish_trace(**fields):
+    """結束目前的請求：記錄總耗時並輸出 JSON 日誌，回傳日誌內容"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    elapsed = time.perf_counter() - trace.pop("start")
+    REQUEST_SECONDS.observe(elapsed, route=trace["route"])
+    trace.update(fields)
+    trace["total_ms"] = round(elapsed * 1000, 2)
+    trace["stages"] = {k: round(v * 1000, 2) for k, v in trace["stages"].items()}
+    logger.info(json.dumps(trace, ensure_ascii=False, default=str))
+    return trace
+
+
+@contextmanager
+def stage(name):
+    """量測一個處理階段：寫入 STAGE_SECONDS，並累加至目前請求的日誌"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["stages"][name] = trace["stages"].get(name, 0.0) + elapsed
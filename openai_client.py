@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+import time
+from lazy_import import lazy_import
+from metrics import OPENAI_TOKENS, stage
+from rate_limiter import TokenBucket
+
+# OpenAI 呼叫的逾時、並行數與速率限制
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "20"))                   # 單次呼叫的期限（秒，含排隊等待）
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))      # 同時進行中的呼叫數上限
+OPENAI_RATE_PER_MINUTE = float(os.getenv("OPENAI_RATE_PER_MINUTE", "500"))  # 每分鐘呼叫次數上限（0 表示不限）
+OPENAI_RATE_BURST = float(os.getenv("OPENAI_RATE_BURST", "20"))             # 允許的突發呼叫數
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "10"))                 # keep-alive 連線池大小
+
+
+class OpenAIBusyError(RuntimeError):
+    """期限內無法取得速率或並行額度（呼叫未送出）"""
+
+
+class OpenAIClient:
+    """
+    MessageHandler 使用的 OpenAI 呼叫層：
+    - 共用的 keep-alive 連線池（同步：requests.Session；非同步：aiohttp.ClientSession）
+    - 每次呼叫都有期限：排隊等待與 API 回應的總時間不超過 timeout
+    - 令牌桶限制呼叫速率，semaphore 限制同時進行中的呼叫數
+    openai 套件在第一次呼叫時才載入，不影響冷啟動時間。
+    """
+
+    def __init__(self, model="gpt-3.5-turbo", timeout=OPENAI_TIMEOUT, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 rate_per_minute=OPENAI_RATE_PER_MINUTE, burst=OPENAI_RATE_BURST, pool_size=OPENAI_POOL_SIZE,
+                 clock=time.monotonic):
+        self.model = model
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_minute / 60.0, capacity=burst, clock=clock)
+        self._clock = clock
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphore = None  # 於事件迴圈中第一次使用時建立
+        self._aiosession = None
+        self._pool_lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # 連線池
+    # -------------------------------------------------------------------------
+    def _openai(self):
+        """載入 openai 並設定共用的 requests.Session（只設定一次）"""
+        openai = lazy_import("openai")
+        if openai.requestssession is None:
+            with self._pool_lock:
+                if openai.requestssession is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    session.mount("https://", HTTPAdapter(pool_maxsize=self.pool_size, max_retries=2))
+                    openai.requestssession = session
+        return openai
+
+    async def _aiohttp_session(self):
+        if self._aiosession is None or self._aiosession.closed:
+            import aiohttp
+            self._aiosession = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self._aiosession
+
+    async def aclose(self):
+        """關閉非同步連線池"""
+        if self._aiosession is not None:
+            await self._aiosession.close()
+            self._aiosession = None
+
+    # -------------------------------------------------------------------------
+    # 呼叫
+    # -------------------------------------------------------------------------
+    def _remaining(self, deadline):
+        return max(0.0, deadline - self._clock())
+
+    def _check_deadline(self, deadline):
+        """回傳呼叫 API 可用的剩餘秒數；等待額度時已用完期限 => OpenAIBusyError（呼叫未送出）"""
+        remaining = self._remaining(deadline)
+        if remaining <= 0:
+            raise OpenAIBusyError("OpenAI 呼叫已超過期限，請稍後再試。")
+        return remaining
+
+    def _params(self, messages, params):
+        return dict(model=self.model, messages=messages, **params)
+
+    @staticmethod
+    def _content(response):
+        """取出回應文字，並記錄 token 用量"""
+        usage = response.get("usage") if isinstance(response, dict) else None
+        if usage:
+            OPENAI_TOKENS.inc(usage.get("prompt_tokens", 0), kind="prompt")
+            OPENAI_TOKENS.inc(usage.get("completion_tokens", 0), kind="completion")
+        return response.choices[0]["message"]["content"]
+
+    def chat(self, messages, timeout=None, **params):
+        """
+        同步呼叫 ChatCompletion，回傳回應文字。
+        期限內無法取得額度或取得額度時期限已過 => OpenAIBusyError；API 逾時由 openai 拋出 Timeout。
+        """
+        deadline = self._clock() + (timeout or self.timeout)
+        if not self.bucket.acquire(timeout=self._remaining(deadline)):
+            raise OpenAIBusyError("OpenAI 呼叫速率已達上限，請稍後再試。")
+        if not self._semaphore.acquire(timeout=self._remaining(deadline)):
+            raise OpenAIBusyError("OpenAI 同時呼叫數已達上限，請稍後再試。")
+        try:
+            remaining = self._check_deadline(deadline)
+            openai = self._openai()
+            with stage("openai"):
+                response = openai.ChatCompletion.create(
+                    request_timeout=remaining, **self._params(messages, params)
+                )
+        finally:
+            self._semaphore.release()
+        return self._content(response)
+
+    async def achat(self, messages, timeout=None, **params):
+        """
+        非同步呼叫 ChatCompletion（openai.ChatCompletion.acreate），回傳回應文字。
+        等待額度時不佔用執行緒；同一個 client 的非同步呼叫需在同一個事件迴圈中進行。
+        """
+        deadline = self._clock() + (timeout or self.timeout)
+        wait = self.bucket.reserve(max_wait=self._remaining(deadline))
+        if wait is None:
+            raise OpenAIBusyError("OpenAI 呼叫速率已達上限，請稍後再試。")
+        if wait:
+            await asyncio.sleep(wait)
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._async_semaphore.acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            raise OpenAIBusyError("OpenAI 同時呼叫數已達上限，請稍後再試。")
+        try:
+            remaining = self._check_deadline(deadline)
+            openai = lazy_import("openai")
+            openai.aiosession.set(await self._aiohttp_session())
+            with stage("openai"):
+                response = await asyncio.wait_for(
+                    openai.ChatCompletion.acreate(
+                        request_timeout=remaining, **self._params(messages, params)
+                    ),
+                    remaining
+                )
+        finally:
+            self._async_semaphore.release()
+        return self._content(response)
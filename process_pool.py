@@ -0,0 +1,15 @@
+"""
+建立不以 fork 啟動工作行程的行程池。
+伺服器是多執行緒行程（Flask、背景工作執行緒），直接 fork 的子行程可能繼承其他執行緒
+持有中的鎖（匯入鎖、logging）而卡住；因此一律使用 forkserver（不支援時為 spawn）。
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def create_process_pool(workers=None):
+    """建立行程池，workers 未指定時為 CPU 數；工作行程在第一次送出工作時才啟動"""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context(method))
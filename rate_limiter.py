@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    執行緒安全的令牌桶限流器：
+    - 每秒補充 rate 個令牌，最多累積 capacity 個（允許短時間突發）
+    - reserve() 預約令牌並回傳需要等待的秒數，同步與 asyncio 呼叫端共用同一套計算
+    rate <= 0 表示不限流。
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1, max_wait=None):
+        """
+        預約 tokens 個令牌，回傳取得前需等待的秒數（0 表示立即可用）。
+        需等待超過 max_wait 秒時不預約，回傳 None。
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (tokens - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= tokens  # 可暫時為負，代表已被預約的未來令牌
+            return wait
+
+    def acquire(self, tokens=1, timeout=None):
+        """阻塞直到取得令牌；timeout 秒內無法取得則回傳 False"""
+        wait = self.reserve(tokens, max_wait=timeout)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
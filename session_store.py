@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from message_processor import ExpenseManager
+from ttl_cache import TTLCache
+
+_MISSING = object()
+
+DEFAULT_SESSION_DB_PATH = os.path.join(tempfile.gettempdir(), "linebuddysplit_sessions.db")
+
+
+def dump_session(context):
+    """
+    將使用者上下文序列化為精簡的位元組：
+    ExpenseManager 轉為純資料後以 JSON 表示，再以 zlib 壓縮。
+    """
+    data = dict(context)
+    processor = data.get("processor")
+    data["processor"] = processor.to_dict() if processor is not None else None
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(raw.encode("utf-8"))
+
+
+def load_session(blob):
+    """由 dump_session() 的結果還原使用者上下文"""
+    data = json.loads(zlib.decompress(blob).decode("utf-8"))
+    if data.get("processor") is not None:
+        data["processor"] = ExpenseManager.from_dict(data["processor"])
+    return data
+
+
+class SessionStore:
+    """
+    使用者上下文儲存介面。
+    提供與 dict 相同的存取方式（get / [] / in / del），
+    讓 MessageHandler 不需關心實際的儲存後端。
+    """
+
+    def get(self, user_id, default=None):
+        raise NotImplementedError
+
+    def set(self, user_id, context):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def add(self, user_id, context):
+        """只在不存在（或已過期）時寫入，回傳是否寫入（檢查與寫入為原子操作）"""
+        raise NotImplementedError
+
+    def __getitem__(self, user_id):
+        context = self.get(user_id, _MISSING)
+        if context is _MISSING:
+            raise KeyError(user_id)
+        return context
+
+    def __setitem__(self, user_id, context):
+        self.set(user_id, context)
+
+    def __delitem__(self, user_id):
+        self.delete(user_id)
+
+    def __contains__(self, user_id):
+        return self.get(user_id, _MISSING) is not _MISSING
+
+
+class MemorySessionStore(SessionStore):
+    """
+    行程內的 LRU + TTL 儲存：
+    閒置超過 ttl 秒或超出 max_users 的使用者會被自動淘汰。
+    """
+
+    def __init__(self, max_users=10000, ttl=86400):
+        self._cache = TTLCache(maxsize=max_users, ttl=ttl)
+
+    def get(self, user_id, default=None):
+        return self._cache.get(user_id, default)
+
+    def set(self, user_id, context):
+        self._cache.set(user_id, context)
+
+    def delete(self, user_id):
+        self._cache.pop(user_id)
+
+    def add(self, user_id, context):
+        return self._cache.add(user_id, context)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    本機 SQLite 儲存，可由同一台機器上的多個工作行程共用。
+    上下文以 dump_session() 壓縮後寫入，讀取時過期的資料視為不存在，
+    並定期於寫入時清除過期資料。
+    """
+
+    PURGE_EVERY = 100  # 每寫入幾次清除一次過期資料
+
+    def __init__(self, path, ttl=86400, table="sessions", clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "user_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        """每個執行緒各自持有一條連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")  # 允許多行程同時讀寫
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id, default=None):
+        row = self._connect().execute(
+            f"SELECT data FROM {self.table} WHERE user_id = ? AND expires_at > ?",
+            (user_id, self._clock())
+        ).fetchone()
+        return load_session(row[0]) if row else default
+
+    def set(self, user_id, context):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (user_id, data, expires_at) VALUES (?, ?, ?)",
+                (user_id, dump_session(context), self._clock() + self.ttl)
+            )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, user_id):
+        conn = self._connect()
+        with conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE user_id = ?", (user_id,))
+
+    def add(self, user_id, context):
+        conn = self._connect()
+        now = self._clock()
+        with conn:
+            # 同一筆交易內：先移除已過期的舊資料，再以 INSERT OR IGNORE 寫入（多行程也只有一方成功）
+            conn.execute(f"DELETE FROM {self.table} WHERE user_id = ? AND expires_at <= ?", (user_id, now))
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO {self.table} (user_id, data, expires_at) VALUES (?, ?, ?)",
+                (user_id, dump_session(context), now + self.ttl)
+            )
+        if cur.rowcount != 1:
+            return False
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+        return True
+
+    def purge_expired(self):
+        """刪除所有過期資料，回傳刪除筆數"""
+        conn = self._connect()
+        with conn:
+            cur = conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (self._clock(),))
+        return cur.rowcount
+
+    def __len__(self):
+        row = self._connect().execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE expires_at > ?", (self._clock(),)
+        ).fetchone()
+        return row[0]
+
+
+def create_session_store():
+    """
+    依環境變數建立 session store：
+    SESSION_BACKEND=memory（預設）或 sqlite
+    SESSION_TTL：閒置多久後淘汰（秒）
+    SESSION_MAX_USERS：memory 後端最多保留的使用者數
+    SESSION_DB_PATH：sqlite 後端的資料庫路徑
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    ttl = int(os.getenv("SESSION_TTL", "86400"))
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", DEFAULT_SESSION_DB_PATH)
+        return SQLiteSessionStore(path, ttl=ttl)
+    if backend == "memory":
+        return MemorySessionStore(max_users=int(os.getenv("SESSION_MAX_USERS", "10000")), ttl=ttl)
+    raise ValueError(f"未知的 SESSION_BACKEND：{backend}")
@@ -0,0 +1,211 @@
+import base64
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-secret")
+
+import app as app_module
+from artifact_store import LocalArtifactStore
+from chart_cache import ChartCache
+
+class TestServeChart(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = b"<html>" + b"chart " * 500 + b"</html>"
+        with open(os.path.join(self.tmpdir.name, "charts_a.html"), "wb") as f:
+            f.write(self.data)
+        patcher = patch.object(app_module, "chart_cache", ChartCache(LocalArtifactStore(self.tmpdir.name)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.client = app_module.app.test_client()
+
+    def test_serves_compressed_with_cache_headers(self):
+        # 測試回傳 gzip 版本、強 ETag 與長效 Cache-Control
+        res = self.client.get("/chart/charts_a.html", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(res.data), self.data)
+        self.assertIn("immutable", res.headers["Cache-Control"])
+        self.assertFalse(res.headers["ETag"].startswith("W/"))
+
+    def test_identity_and_conditional_get(self):
+        # 測試不支援壓縮時回傳原始內容，帶 If-None-Match 時回應 304
+        res = self.client.get("/chart/charts_a.html", headers={"Accept-Encoding": "identity"})
+        self.assertEqual(res.data, self.data)
+        self.assertNotIn("Content-Encoding", res.headers)
+        res = self.client.get("/chart/charts_a.html", headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+
+    def test_missing_chart(self):
+        self.assertEqual(self.client.get("/chart/charts_missing.html").status_code, 404)
+        self.assertEqual(self.client.get("/chart/charts_a.html.gz").status_code, 404)
+
+class TestCallback(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app_module.app.test_client()
+        patcher = patch.object(app_module, "process_event")
+        self.process_event = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, event_id):
+        body = json.dumps({"destination": "bot", "events": [{
+            "type": "message", "webhookEventId": event_id, "mode": "active", "timestamp": 0,
+            "replyToken": "token", "source": {"type": "user", "userId": "U1"},
+            "message": {"type": "text", "id": "1", "text": "hi"}
+        }]})
+        secret = os.environ["LINE_CHANNEL_SECRET"].encode()
+        signature = base64.b64encode(hmac.new(secret, body.encode(), hashlib.sha256).digest()).decode()
+        return self.client.post("/callback", data=body, headers={"X-Line-Signature": signature})
+
+    def test_redelivery_acknowledged_without_work(self):
+        # 測試重送的事件回應 200 但不重複處理
+        self.assertEqual(self.post("dup-1").status_code, 200)
+        self.assertEqual(self.post("dup-1").status_code, 200)
+        self.assertEqual(self.process_event.call_count, 1)
+
+    def test_failed_event_can_be_redelivered(self):
+        # 測試處理失敗時釋放事件 ID，LINE 重送時重新處理
+        self.process_event.side_effect = [RuntimeError("boom"), None]
+        app_module.app.config["PROPAGATE_EXCEPTIONS"] = False
+        self.addCleanup(app_module.app.config.pop, "PROPAGATE_EXCEPTIONS")
+        self.assertEqual(self.post("retry-1").status_code, 500)
+        self.assertEqual(self.post("retry-1").status_code, 200)
+        self.assertEqual(self.process_event.call_count, 2)
+
+    def test_invalid_signature(self):
+        res = self.client.post("/callback", data="{}", headers={"X-Line-Signature": "bad"})
+        self.assertEqual(res.status_code, 400)
+
+class TestSettle(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(app_module, "SETTLE_API_TOKEN", "secret")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+        self.client.environ_base["HTTP_AUTHORIZATION"] = "Bearer secret"
+        self.ledger = {"id": "a", "members": ["Alice", "Bob"],
+                       "payments": [{"payer": "Alice", "amount": 100, "item": "晚餐"}]}
+
+    def test_single_ledger(self):
+        # 測試單一帳本回傳 JSON 結果；錯誤回應 400
+        res = self.client.post("/settle", json=self.ledger)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()["transfers"], ["Bob → Alice 50 元"])
+        res = self.client.post("/settle", json={"id": "b", "members": ["Alice"], "payments": [
+            {"payer": "Dave", "amount": 1, "item": "茶"}]})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("不在成員名單中", res.get_json()["error"])
+        self.assertEqual(self.client.post("/settle", json=[1, 2]).status_code, 400)
+
+    def test_stream_with_invalid_entries(self):
+        # 測試 ledgers 陣列與 NDJSON 中非物件的項目回傳個別錯誤，其餘帳本照常結算
+        res = self.client.post("/settle", json={"ledgers": [self.ledger, 5]})
+        self.assertEqual(res.status_code, 200)
+        results = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+        self.assertEqual(results[0]["id"], "a")
+        self.assertEqual(results[1], {"id": None, "error": "帳本必須是 JSON 物件。"})
+
+        body = json.dumps(self.ledger) + "\n[1,2]\nnot json\n"
+        res = self.client.post("/settle", data=body, content_type="application/x-ndjson")
+        results = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+        self.assertEqual([r.get("id") for r in results], ["a", None, "line-3"])
+        self.assertEqual(["error" in r for r in results], [False, True, True])
+
+    def test_charts_published_to_artifact_store(self):
+        # 測試 ?charts=1 的圖表寫入 artifact_store，連結與 webhook 相同（物件儲存為預簽網址）
+        class FakeStore:
+            def __init__(self):
+                self.objects = {}
+
+            def exists(self, name):
+                return name in self.objects
+
+            def touch(self, name):
+                pass
+
+            def write_many(self, artifacts):
+                self.objects.update(artifacts)
+
+            def url(self, name):
+                return f"https://bucket.local/{name}?signed"
+
+        store = FakeStore()
+        with patch.object(app_module, "artifact_store", store):
+            res = self.client.post("/settle?charts=1", json=self.ledger)
+            streamed = self.client.post("/settle?charts=1", json={"ledgers": [self.ledger]})
+            lines = streamed.get_data(as_text=True).splitlines()
+        url = res.get_json()["chart_url"]
+        name = url[len("https://bucket.local/"):-len("?signed")]
+        self.assertIn(name, store.objects)
+        self.assertEqual(json.loads(lines[0])["chart_url"], url)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            local = LocalArtifactStore(tmp)
+            with patch.object(app_module, "artifact_store", local):
+                url = self.client.post("/settle?charts=1", json=self.ledger).get_json()["chart_url"]
+            self.assertEqual(url, f"{app_module.BASE_URL}/chart/{name}")
+            self.assertTrue(local.exists(name))
+
+    def test_ledgers_must_be_list(self):
+        # 測試 ledgers 不是陣列時回應 400
+        for ledgers in ({"a": 1}, "abc", 5, None):
+            res = self.client.post("/settle", json={"ledgers": ledgers})
+            self.assertEqual(res.status_code, 400)
+
+    def test_shared_process_pool(self):
+        # 測試 SETTLE_WORKERS > 0 時各請求共用同一個行程池，且不以 fork 啟動工作行程
+        from batch_settlement import create_pool
+        pool = create_pool(2)
+        self.addCleanup(pool.shutdown)
+        self.assertNotEqual(pool._mp_context.get_start_method(), "fork")
+        with patch.object(app_module, "SETTLE_WORKERS", 2), patch.object(app_module, "settle_pool", pool), \
+                patch("batch_settlement.create_pool", side_effect=AssertionError("每個請求不應建立行程池")):
+            for _ in range(2):
+                res = self.client.post("/settle", json={"ledgers": [self.ledger, 5]})
+                results = sorted(res.get_data(as_text=True).splitlines())
+                self.assertEqual(len(results), 2)
+                self.assertIn('"transfers": ["Bob → Alice 50 元"]', "".join(results))
+
+    def test_token_required(self):
+        # 測試需帶正確的 token；未設定 SETTLE_API_TOKEN 時停用 /settle
+        self.assertEqual(self.client.post("/settle", json=self.ledger, headers={"Authorization": ""}).status_code, 401)
+        self.assertEqual(self.client.post("/settle", json=self.ledger).status_code, 200)
+        with patch.object(app_module, "SETTLE_API_TOKEN", None):
+            self.assertEqual(self.client.post("/settle", json=self.ledger).status_code, 404)
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app_module.app.test_client()
+
+    def test_exposes_stage_latency_and_cache_stats(self):
+        # 測試 /callback 的簽名驗證階段被記錄，且快取命中率以 Prometheus 格式輸出
+        self.client.post("/callback", data="{}", headers={"X-Line-Signature": "bad"})
+        res = self.client.get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain"))
+        text = res.get_data(as_text=True)
+        self.assertIn('linebuddysplit_stage_seconds_count{stage="signature"}', text)
+        self.assertIn('linebuddysplit_request_seconds_count{route="callback"}', text)
+        self.assertIn('linebuddysplit_cache_hit_ratio{cache="chart"}', text)
+
+    def test_token_required(self):
+        with patch.object(app_module, "METRICS_API_TOKEN", "secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            res = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+            self.assertEqual(res.status_code, 200)
+
+if __name__ == "__main__":
+    unittest.main()
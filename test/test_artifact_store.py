@@ -0,0 +1,134 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from artifact_store import LocalArtifactStore, S3ArtifactStore, collect_garbage, content_headers
+from chart_cache import variant_names
+from expense_chart_generator import ChartGenerator
+from message_processor import ExpenseManager
+
+class NotFound(Exception):
+    """模擬 botocore ClientError 的 404 錯誤"""
+    response = {"Error": {"Code": "404"}}
+
+class FakeS3Client:
+    """本機 S3 替身：以 dict 保存物件，介面與 boto3 S3 client 相同"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **headers):
+        self.objects[(Bucket, Key)] = (Body, headers)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound()
+        return self.objects[(Bucket, Key)][1]
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound()
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.local/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        manager = ExpenseManager()
+        manager.process_members("Alice、Bob")
+        manager.process_payments("Alice付了100元晚餐")
+        manager.process_splits("所有均分")
+        manager.calculate_and_format()
+        self.summary_data = manager.get_summary()
+
+    def test_content_headers(self):
+        self.assertEqual(content_headers("a.html"), ("text/html; charset=utf-8", None))
+        self.assertEqual(content_headers("a.html.gz"), ("text/html; charset=utf-8", "gzip"))
+        self.assertEqual(content_headers("a.html.br"), ("text/html; charset=utf-8", "br"))
+
+    def test_local_store_publish(self):
+        # 測試圖表與預先壓縮檔寫入本機資料夾，第二次直接沿用
+        with tempfile.TemporaryDirectory() as output_dir:
+            store = LocalArtifactStore(output_dir)
+            name = ChartGenerator(self.summary_data).publish(store)
+            self.assertTrue(store.exists(name))
+            self.assertTrue(store.exists(name + ".gz"))
+            self.assertIn(b"Alice", store.read(name))
+            self.assertIsNone(store.read("charts_missing.html"))
+            self.assertIsNone(store.url(name))
+            self.assertEqual(ChartGenerator(self.summary_data).publish(store), name)
+
+    def test_s3_store_publish(self):
+        # 測試上傳至 S3 替身：設定 Content-Type / Content-Encoding，並回傳指向 gzip 版本的預簽網址
+        client = FakeS3Client()
+        store = S3ArtifactStore("bucket", prefix="charts/", client=client, url_ttl=600)
+        name = ChartGenerator(self.summary_data).publish(store)
+        body, headers = client.objects[("bucket", f"charts/{name}.gz")]
+        self.assertEqual(headers["ContentEncoding"], "gzip")
+        self.assertEqual(headers["ContentType"], "text/html; charset=utf-8")
+        self.assertNotIn("ContentEncoding", client.objects[("bucket", f"charts/{name}")][1])
+        self.assertIn(b"Alice", store.read(name))
+        self.assertIsNone(store.read("charts_missing.html"))
+        self.assertFalse(store.exists("charts_missing.html"))
+        self.assertEqual(store.url(name), f"https://s3.local/bucket/charts/{name}.gz?expires=600")
+
+        # 已上傳的帳本不重新繪製、上傳
+        client.objects[("bucket", f"charts/{name}")] = (b"cached", {})
+        self.assertEqual(ChartGenerator(self.summary_data).publish(store), name)
+        self.assertEqual(store.read(name), b"cached")
+
+    def test_s3_presigned_url_with_boto3(self):
+        # 測試真實 boto3 client 產生的預簽網址（不需連線）
+        import boto3
+        client = boto3.client("s3", region_name="us-east-1", endpoint_url="http://localhost:9000",
+                              aws_access_key_id="test", aws_secret_access_key="test")
+        url = S3ArtifactStore("bucket", client=client, url_ttl=600).url("charts_a.html")
+        self.assertTrue(url.startswith("http://localhost:9000/bucket/charts/charts_a.html.gz?"))
+        self.assertIn("Signature", url)
+
+    def test_s3_store_pickles_without_client(self):
+        # 測試傳入工作行程時不複製 boto3 client，而是在對方行程重建
+        import pickle
+        from unittest.mock import patch
+        env = {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test"}
+        with patch.dict(os.environ, env):
+            store = S3ArtifactStore("bucket", endpoint_url="http://localhost:9000", url_ttl=600)
+            clone = pickle.loads(pickle.dumps(store))
+        self.assertIsNot(clone.client, store.client)
+        self.assertTrue(clone.url("charts_a.html").startswith("http://localhost:9000/bucket/charts/charts_a.html.gz?"))
+
+    def test_collect_garbage(self):
+        # 測試依保存期限與容量清理圖表
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = []
+            for i in range(3):
+                path = os.path.join(output_dir, f"charts_{i}.html")
+                with open(path, "w") as f:
+                    f.write("x" * 100)
+                os.utime(path, (time.time() - (3 - i) * 100,) * 2)
+                paths.append(path)
+            with open(os.path.join(output_dir, "other.txt"), "w") as f:
+                f.write("keep")
+
+            self.assertEqual(collect_garbage(output_dir, max_bytes=10000, max_age=250), 1)
+            self.assertFalse(os.path.exists(paths[0]))
+            self.assertEqual(collect_garbage(output_dir, max_bytes=150, max_age=1000), 1)
+            self.assertFalse(os.path.exists(paths[1]))
+            self.assertTrue(os.path.exists(paths[2]))
+            self.assertTrue(os.path.exists(os.path.join(output_dir, "other.txt")))
+
+    def test_collect_garbage_removes_compressed_variants(self):
+        # 測試圖表與其預先壓縮檔一起清理
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = [os.path.join(output_dir, name) for name in variant_names("charts_a.html")]
+            for path in paths[::2]:
+                with open(path, "w") as f:
+                    f.write("x" * 100)
+            self.assertEqual(collect_garbage(output_dir, max_bytes=10000, max_age=-1, keep=("charts_b.html",)), 2)
+            self.assertEqual(os.listdir(output_dir), [])
+
+if __name__ == "__main__":
+    unittest.main()
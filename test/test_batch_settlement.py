@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from batch_settlement import main, read_jsonl, settle_ledger, settle_stream
+
+class TestBatchSettlement(unittest.TestCase):
+
+    def setUp(self):
+        # 結構化與文字格式各一本帳
+        self.ledgers = [
+            {"id": "a", "members": ["Alice", "Bob", "Charlie"],
+             "payments": [{"payer": "Alice", "amount": 300, "item": "晚餐"}],
+             "exclusions": {"晚餐": ["Charlie"]}},
+            {"id": "b", "text": "成員有Alice、Bob\nBob付了100元電影"}
+        ]
+
+    def test_settle_ledger(self):
+        # 測試單一帳本結算
+        result = settle_ledger(self.ledgers[0])
+        self.assertEqual(result["balances"], {"Alice": 150.0, "Bob": -150.0, "Charlie": 0.0})
+        self.assertEqual(result["transfers"], ["Bob → Alice 150 元"])
+
+    def test_settle_ledger_error(self):
+        # 測試錯誤記錄於結果中而非拋出
+        result = settle_ledger({"id": "x", "members": ["Alice"], "payments": [{"payer": "Dave", "amount": 1, "item": "茶"}]})
+        self.assertIn("不在成員名單中", result["error"])
+
+    def test_settle_ledger_not_object(self):
+        # 測試非物件的帳本（例如 JSONL 中的陣列）回傳錯誤結果而非拋出
+        for ledger in ([1, 2], 5, "text", None):
+            self.assertEqual(settle_ledger(ledger), {"id": None, "error": "帳本必須是 JSON 物件。"})
+
+    def test_settle_ledger_three_sections(self):
+        # 測試 text 欄位接受三段式資料
+        text = "【一、成員名單】\nAlice、Bob\n【二、付款記錄】\nBob付了100元電影\n【三、分攤情況】\n所有均分"
+        result = settle_ledger({"id": "c", "text": text})
+        self.assertEqual(result["balances"], {"Alice": -50.0, "Bob": 50.0})
+        self.assertIn("無法解析帳本文字", settle_ledger({"id": "d", "text": "我們去吃飯"})["error"])
+        broken = settle_ledger({"id": "e", "text": text.replace("Bob付了", "Dave付了")})
+        self.assertIn("不在成員名單中", broken["error"])
+
+    def test_settle_stream_process_pool(self):
+        # 測試行程池結算結果與依序處理相同
+        serial = {r["id"]: r for r in settle_stream(iter(self.ledgers), workers=0)}
+        pooled = {r["id"]: r for r in settle_stream(iter(self.ledgers), workers=2)}
+        self.assertEqual(serial, pooled)
+
+    def test_read_jsonl(self):
+        # 測試 JSONL 讀取略過空行並標記格式錯誤的行
+        ledgers = list(read_jsonl(io.StringIO('{"id": 1}\n\nnot json\n')))
+        self.assertEqual(ledgers[0], {"id": 1})
+        self.assertEqual(ledgers[1]["id"], "line-3")
+        self.assertIn("invalid", ledgers[1])
+
+    def test_cli(self):
+        # 測試命令列讀寫 JSONL
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = os.path.join(tmp, "in.jsonl"), os.path.join(tmp, "out.jsonl")
+            with open(src, "w", encoding="utf-8") as f:
+                f.write("\n".join(json.dumps(l, ensure_ascii=False) for l in self.ledgers))
+            self.assertEqual(main([src, "-o", dst, "--workers", "0"]), 0)
+            with open(dst, encoding="utf-8") as f:
+                results = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r["id"] for r in results), ["a", "b"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+from benchmarks.ledgers import ledger_sections, ledger_text, make_ledger
+from benchmarks.suite import CASES, _ledger_balances, compare, main, run_suite
+from ledger_parser import parse_canonical_input
+from message_processor import ExpenseManager
+
+class TestSyntheticLedger(unittest.TestCase):
+
+    def test_reproducible_and_parsable(self):
+        # 測試相同種子產生相同帳本，且可由 ExpenseManager 與本地文法解析
+        ledger = make_ledger(10, 50, seed=1)
+        self.assertEqual(ledger, make_ledger(10, 50, seed=1))
+        self.assertEqual(len(ledger["members"]), 10)
+        self.assertEqual(len(ledger["payments"]), 50)
+        for item, names in ledger["exclusions"].items():
+            payer = next(p["payer"] for p in ledger["payments"] if p["item"] == item)
+            self.assertNotIn(payer, names)
+        sections = ledger_sections(ledger)
+        manager = ExpenseManager()
+        manager.process_members(sections[0])
+        manager.process_payments(sections[1])
+        manager.process_splits(sections[2])
+        manager.calculate_and_format()
+        self.assertAlmostEqual(sum(manager.balances.values()), 0, delta=1)  # 每人應付四捨五入至分
+        self.assertIsNotNone(parse_canonical_input(ledger_text(ledger)))
+
+class TestSuite(unittest.TestCase):
+
+    def test_runs_every_case(self):
+        # 測試最小規模下所有項目皆可執行（含使用假 LINE / OpenAI 的完整對話）
+        current = run_suite(sizes=("tiny",), repeat=1)
+        self.assertEqual(set(current["results"]), {f"{name}/tiny" for name in CASES})
+        for result in current["results"].values():
+            self.assertGreater(result["min"], 0)
+
+    def test_linear_cases_not_capped(self):
+        # 測試線性項目不受 MAX_CELLS 限制，huge 規模也會量測
+        for name in ("process_members", "process_payments", "process_splits", "calculate_transfers"):
+            self.assertIsNone(CASES[name][1])
+
+    def test_ledger_balances_match_manager(self):
+        # 測試直接由帳本計算的餘額與 ExpenseManager 相同
+        ledger = make_ledger(30, 300, seed=2)
+        sections = ledger_sections(ledger)
+        manager = ExpenseManager()
+        manager.process_members(sections[0])
+        manager.process_payments(sections[1])
+        manager.process_splits(sections[2])
+        manager.calculate()
+        balances = _ledger_balances(ledger)
+        for m in ledger["members"]:
+            self.assertAlmostEqual(balances[m], manager.balances[m], delta=0.011)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"results": {"a/tiny": {"min": 0.010}, "b/tiny": {"min": 0.010}, "c/tiny": {"min": 0.0001}}}
+        current = {"results": {"a/tiny": {"min": 0.011}, "b/tiny": {"min": 0.020},
+                               "c/tiny": {"min": 0.0002}, "d/tiny": {"skipped": True}}}
+        report = compare(current, baseline, threshold=0.25, min_delta=0.001)
+        self.assertFalse(report["a/tiny"]["regressed"])
+        self.assertTrue(report["b/tiny"]["regressed"])
+        self.assertFalse(report["c/tiny"]["regressed"])  # 變慢一倍但差距小於 min_delta
+        self.assertNotIn("d/tiny", report)
+
+    def test_save_and_fail_on_regression(self):
+        # 測試存成基準線後比較；基準線被調快後應以結束碼 1 結束
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "baseline.json")
+            args = ["--sizes", "tiny", "--cases", "process_members", "--repeat", "1", "--json"]
+            self.assertEqual(main(args + ["--save", path]), 0)
+            with open(path, encoding="utf-8") as f:
+                baseline = json.load(f)
+            baseline["results"]["process_members/tiny"]["min"] = 1e-9
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(baseline, f)
+            self.assertEqual(main(args + ["--baseline", path, "--min-delta", "0"]), 1)
+
+if __name__ == "__main__":
+    unittest.main()
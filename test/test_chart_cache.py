@@ -0,0 +1,55 @@
+import gzip
+import os
+import tempfile
+import unittest
+from artifact_store import LocalArtifactStore
+from chart_cache import ChartCache, compress_variants, variant_names
+
+class TestChartCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+        self.path = os.path.join(self.dir, "charts_a.html")
+        self.data = ("<html>" + "分帳" * 1000 + "</html>").encode("utf-8")
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_compress_variants(self):
+        # 測試壓縮結果可還原，且相同內容產生相同結果
+        variants = compress_variants(self.data)
+        self.assertEqual(gzip.decompress(variants["gzip"]), self.data)
+        self.assertEqual(compress_variants(self.data)["gzip"], variants["gzip"])
+        self.assertEqual(variant_names("a.html")[:3], ("a.html", "a.html.br", "a.html.gz"))
+
+    def test_get_and_stats(self):
+        # 測試第一次由磁碟載入，之後由記憶體回應（檔案刪除後仍可取得）
+        cache = ChartCache(LocalArtifactStore(self.dir))
+        entry = cache.get("charts_a.html")
+        self.assertEqual(entry.bodies["identity"], self.data)
+        self.assertEqual(gzip.decompress(entry.bodies["gzip"]), self.data)
+        os.remove(self.path)
+        self.assertIs(cache.get("charts_a.html"), entry)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_rejects_unsafe_or_missing_names(self):
+        cache = ChartCache(LocalArtifactStore(self.dir))
+        self.assertIsNone(cache.get("../charts_a.html"))
+        self.assertIsNone(cache.get("charts_missing.html"))
+
+    def test_evicts_by_bytes(self):
+        # 測試超出容量時淘汰最久未使用的項目
+        other = os.path.join(self.dir, "charts_b.html")
+        with open(other, "wb") as f:
+            f.write(self.data)
+        cache = ChartCache(LocalArtifactStore(self.dir), max_bytes=len(self.data) + 100)
+        cache.get("charts_a.html")
+        cache.get("charts_b.html")
+        self.assertEqual(cache.stats()["size"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from event_dispatcher import EventDispatcher, event_shard_key
+
+def make_event(user_id, seq):
+    return SimpleNamespace(source=SimpleNamespace(user_id=user_id), seq=seq)
+
+class TestEventDispatcher(unittest.TestCase):
+
+    def test_submit_processes_events(self):
+        # 測試事件會被背景工作執行緒處理
+        processed = []
+        dispatcher = EventDispatcher(processed.append, workers=2, queue_size=10)
+        dispatcher.start()
+        self.assertTrue(dispatcher.submit(["a", "b", "c"]))
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(sorted(processed), ["a", "b", "c"])
+
+    def test_submit_rejects_when_full(self):
+        # 測試佇列容量不足時整批拒收
+        release = threading.Event()
+        dispatcher = EventDispatcher(lambda e: release.wait(), workers=1, queue_size=2)
+        self.assertTrue(dispatcher.submit(["a", "b"]))
+        self.assertFalse(dispatcher.submit(["c"]))
+        self.assertEqual(dispatcher.qsize(), 2)
+        self.assertEqual(dispatcher.rejected, 1)
+        dispatcher.start()
+        release.set()
+        dispatcher.join()
+        dispatcher.stop()
+
+    def test_worker_survives_errors(self):
+        # 測試單筆事件失敗不影響後續事件
+        processed = []
+
+        def process(event):
+            if event == "bad":
+                raise RuntimeError("boom")
+            processed.append(event)
+
+        dispatcher = EventDispatcher(process, workers=1, queue_size=10)
+        dispatcher.start()
+        dispatcher.submit(["bad", "good"])
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(processed, ["good"])
+
+    def test_per_user_order_across_shards(self):
+        # 測試同一使用者的事件依序處理，不同使用者同時處理
+        processed = {}
+        lock = threading.Lock()
+        active, peak = 0, 0
+
+        def process(event):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.002)
+            with lock:
+                active -= 1
+                processed.setdefault(event.source.user_id, []).append(event.seq)
+
+        dispatcher = EventDispatcher(process, workers=4, queue_size=1000)
+        dispatcher.start()
+        users = [f"user{i}" for i in range(8)]
+        for seq in range(10):
+            self.assertTrue(dispatcher.submit([make_event(u, seq) for u in users]))
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(processed, {u: list(range(10)) for u in users})
+        self.assertGreater(peak, 1)
+
+    def test_shard_key(self):
+        # 測試相同使用者固定分片，沒有來源的事件仍可處理
+        dispatcher = EventDispatcher(lambda e: None, workers=4)
+        self.assertEqual(dispatcher.shard_of(make_event("u1", 0)), dispatcher.shard_of(make_event("u1", 1)))
+        group_event = SimpleNamespace(source=SimpleNamespace(user_id=None, group_id="g1"))
+        self.assertEqual(event_shard_key(group_event), "g1")
+        self.assertIsNone(event_shard_key("plain"))
+        self.assertIn(dispatcher.shard_of("plain"), range(4))
+
+if __name__ == "__main__":
+    unittest.main()
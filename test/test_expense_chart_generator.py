@@ -1,5 +1,7 @@
 import unittest
 import os
+import tempfile
+from chart_cache import variant_names
 from expense_chart_generator import ChartGenerator
 
 class TestChartGenerator(unittest.TestCase):
@@ -40,9 +42,65 @@ class TestChartGenerator(unittest.TestCase):
             content = f.read()
             self.assertIn("Alice", content)
 
+        # 同時產生預先壓縮的版本
+        self.assertTrue(os.path.exists(chart_path + ".gz"))
+
         # 清理測試文件
-        os.remove(chart_path)
+        for path in variant_names(chart_path):
+            if os.path.exists(path):
+                os.remove(path)
         os.rmdir(output_dir)
 
+    def test_render_charts_modes(self):
+        # 測試依序與執行緒池繪製的結果相同，並記錄每張圖表的耗時
+        serial = self.generator.render_charts(mode="serial")
+        threaded = self.generator.render_charts(mode="thread")
+        self.assertEqual(len(serial), len(ChartGenerator.CHART_METHODS))
+        self.assertEqual([len(h) for h in serial], [len(h) for h in threaded])
+        self.assertEqual(set(self.generator.timings), set(ChartGenerator.CHART_METHODS))
+
+    def test_render_mode_validated_and_pool_not_forked(self):
+        # 測試未知的繪製方式拋出 ValueError（不默默改為依序繪製），且行程池不以 fork 啟動
+        import expense_chart_generator
+        with self.assertRaises(ValueError):
+            self.generator.render_charts(mode="proccess")
+        pool = expense_chart_generator._get_process_pool()
+        self.assertNotEqual(pool._mp_context.get_start_method(), "fork")
+
+    def test_shared_aggregates(self):
+        # 測試共用的每人已付 / 應付金額
+        self.assertEqual(self.generator.total_paid, {"Alice": 300, "Bob": 150, "Charlie": 0})
+        self.assertEqual(self.generator.total_owed, {"Alice": 150, "Bob": 225, "Charlie": 75})
+        self.assertEqual(self.generator.owed_by_item, [[150, 150, 0], [0, 75, 75]])
+
+    def test_generate_charts_reuses_identical_ledger(self):
+        # 測試相同帳本沿用既有檔案，不同帳本產生不同檔案
+        with tempfile.TemporaryDirectory() as output_dir:
+            first = self.generator.generate_charts(output_dir)
+            again = ChartGenerator(self.summary_data).generate_charts(output_dir)
+            self.assertEqual(first, again)
+
+            other_data = dict(self.summary_data, balances={"Alice": 100, "Bob": -50, "Charlie": -50})
+            other = ChartGenerator(other_data).generate_charts(output_dir)
+            self.assertNotEqual(first, other)
+
+    def test_compact_output(self):
+        # 測試 compact 模式：plotly.js 只載入一次，圖表資料以 JSON 嵌入且不重複 template
+        with tempfile.TemporaryDirectory() as output_dir:
+            html_path = ChartGenerator(self.summary_data, output_mode="html").generate_charts(output_dir)
+            compact_path = ChartGenerator(self.summary_data, output_mode="compact").generate_charts(output_dir)
+            self.assertNotEqual(html_path, compact_path)
+            with open(compact_path, encoding="utf-8") as f:
+                content = f.read()
+            self.assertEqual(content.count("<script src="), 1)
+            self.assertEqual(content.count('"template"'), 0)
+            self.assertEqual(content.count('class="chart-container"'), len(ChartGenerator.CHART_METHODS))
+            self.assertIn("Alice", content)
+            self.assertLess(os.path.getsize(compact_path), os.path.getsize(html_path))
+
+    def test_unknown_output_mode(self):
+        with self.assertRaises(ValueError):
+            ChartGenerator(self.summary_data, output_mode="pdf")
+
 if __name__ == "__main__":
     unittest.main()
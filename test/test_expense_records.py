@@ -0,0 +1,66 @@
+import unittest
+from expense_records import Payment, Split
+
+class TestExpenseRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.members = ("Alice", "Bob", "Charlie")
+
+    def test_participants_share_member_roster(self):
+        # 測試沒有不參與者時直接共用成員名單，不逐筆複製
+        payment = Payment("Alice", 90.0, "晚餐", self.members)
+        self.assertIs(payment.participants, self.members)
+        self.assertEqual(payment.participant_count, 3)
+        self.assertFalse(hasattr(payment, "__dict__"))
+
+    def test_excluding_and_including(self):
+        # 測試加入 / 取消不參與者，不在成員名單中的名稱略過，原紀錄不變
+        payment = Payment("Alice", 90.0, "晚餐", self.members)
+        excluded = payment.excluding(["Charlie", "Dave"])
+        self.assertEqual(excluded.participants, ("Alice", "Bob"))
+        self.assertEqual(excluded.excluded, {"Charlie"})
+        self.assertEqual(payment.participant_count, 3)
+        self.assertEqual(excluded.including(["Charlie"]).participants, self.members)
+
+    def test_split_per_person(self):
+        # 測試每人應付金額以參與人數計算，沒有參與者時為 0
+        split = Split.of(Payment("Alice", 100.0, "晚餐", self.members))
+        self.assertEqual(split.per_person, 33.33)
+        nobody = Payment("Alice", 100.0, "晚餐", self.members).excluding(self.members)
+        self.assertEqual(Split.of(nobody).per_person, 0)
+
+    def test_split_excluding_keeps_type(self):
+        # 測試 Split 的 excluding / including 仍回傳 Split，並依新的參與人數重新計算每人應付金額
+        split = Split.of(Payment("Alice", 90.0, "晚餐", self.members))
+        excluded = split.excluding(["Bob"])
+        self.assertIs(type(excluded), Split)
+        self.assertEqual(excluded.excluded, {"Bob"})
+        self.assertEqual(excluded.per_person, 45.0)
+        restored = excluded.including(["Bob"])
+        self.assertIs(type(restored), Split)
+        self.assertEqual(restored.per_person, 30.0)
+        self.assertIs(type(Payment("Alice", 90.0, "晚餐", self.members).excluding(["Bob"])), Payment)
+
+    def test_dict_view(self):
+        # 測試相容檢視：與原本的 dict 相同的鍵與值（參與者為 list）
+        split = Split.of(Payment("Alice", 90.0, "晚餐", self.members).excluding(["Bob"]))
+        expected = {"item": "晚餐", "amount": 90.0, "participants": ["Alice", "Charlie"],
+                    "per_person": 45.0, "payer": "Alice"}
+        self.assertEqual(split, expected)
+        self.assertEqual(dict(split), expected)
+        self.assertEqual(split["participants"], ["Alice", "Charlie"])
+        self.assertIsNone(split.get("missing"))
+        with self.assertRaises(KeyError):
+            split["excluded"]
+
+    def test_to_dict_and_from_dict(self):
+        # 測試精簡格式只保存不參與者，並可讀取舊格式（逐筆保存 participants）
+        payment = Payment("Alice", 90.0, "晚餐", self.members).excluding(["Charlie", "Bob"])
+        data = payment.to_dict()
+        self.assertEqual(data, {"payer": "Alice", "amount": 90.0, "item": "晚餐", "excluded": ["Bob", "Charlie"]})
+        self.assertEqual(Payment.from_dict(data, self.members), payment)
+        legacy = {"payer": "Alice", "amount": 90.0, "item": "晚餐", "participants": ["Alice"]}
+        self.assertEqual(Payment.from_dict(legacy, self.members), payment)
+
+if __name__ == "__main__":
+    unittest.main()
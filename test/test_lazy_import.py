@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from lazy_import import lazy_import
+
+class TestLazyImport(unittest.TestCase):
+
+    def setUp(self):
+        # 建立載入需要一段時間的暫存模組
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        with open(os.path.join(self.tmp.name, "slow_module_for_test.py"), "w", encoding="utf-8") as f:
+            f.write("import time\ntime.sleep(0.2)\nREADY = True\n")
+        sys.path.insert(0, self.tmp.name)
+        self.addCleanup(sys.path.remove, self.tmp.name)
+        self.addCleanup(sys.modules.pop, "slow_module_for_test", None)
+
+    def test_returns_loaded_module(self):
+        self.assertIs(lazy_import("json"), sys.modules["json"])
+
+    def test_concurrent_first_import_sees_initialized_module(self):
+        # 測試多個執行緒同時第一次匯入時，都取得初始化完成的模組
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(lazy_import("slow_module_for_test").READY))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [True] * 8)
+
+if __name__ == "__main__":
+    unittest.main()
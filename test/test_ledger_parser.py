@@ -0,0 +1,141 @@
+import time
+import unittest
+from ledger_parser import (parse_canonical_input, parse_followup, format_sections, parse_amount,
+                           parse_ledger, parse_payment_lines, split_sections)
+from message_processor import ExpenseManager
+
+class TestLedgerParser(unittest.TestCase):
+
+    def test_parse_canonical_input(self):
+        # 測試歡迎訊息中的標準格式可直接解析為三段
+        text = ("成員有Alice、Bob、Charlie\n"
+                "Alice付了100元晚餐\n"
+                "Bob付了200元電影\n"
+                "晚餐沒Charlie\n"
+                "電影沒Alice")
+        sections = parse_canonical_input(text)
+        self.assertEqual(sections, [
+            "Alice、Bob、Charlie",
+            "Alice付了100元晚餐\nBob付了200元電影",
+            "晚餐沒Charlie\n電影沒Alice"
+        ])
+
+        # 解析結果可直接交給 ExpenseManager
+        manager = ExpenseManager()
+        manager.process_members(sections[0])
+        manager.process_payments(sections[1])
+        manager.process_splits(sections[2])
+        manager.calculate_and_format()
+        self.assertEqual(manager.balances, {"Alice": 50.0, "Bob": 50.0, "Charlie": -100.0})
+
+    def test_parse_without_exclusions(self):
+        # 測試沒有分攤例外時視為所有均分
+        sections = parse_canonical_input("成員：Alice, Bob\nAlice付了100元晚餐")
+        self.assertEqual(sections[0], "Alice、Bob")
+        self.assertEqual(sections[2], "所有均分")
+
+    def test_parse_rejects_free_text(self):
+        # 測試非標準格式回傳 None，交由 OpenAI 解析
+        self.assertIsNone(parse_canonical_input("Alice付了100元晚餐"))
+        self.assertIsNone(parse_canonical_input("成員有Alice、Bob\n我們昨天吃了晚餐"))
+        self.assertIsNone(parse_canonical_input("成員有Alice、Bob\nDave付了100元晚餐"))
+        self.assertIsNone(parse_canonical_input("成員有Alice、Bob\nAlice付了100元晚餐\n電影沒Bob"))
+
+    def test_format_sections(self):
+        # 測試加上標題後的格式
+        text = format_sections(["A、B", "A付了10元茶", "所有均分"])
+        self.assertTrue(text.startswith("【一、成員名單】\nA、B\n【二、付款記錄】"))
+
+    def test_parse_followup(self):
+        # 測試追加訊息的解析
+        self.assertEqual(parse_followup("Bob付了50元飲料\n飲料沒Alice、Bob"), [
+            ("payment", "Bob", 50.0, "飲料"),
+            ("exclusion", "飲料", ["Alice", "Bob"])
+        ])
+        self.assertIsNone(parse_followup("重新開始"))
+        self.assertIsNone(parse_followup(""))
+
+    def test_parse_amount(self):
+        # 測試千分位逗號與全形數字
+        self.assertEqual(parse_amount("1,234.5"), 1234.5)
+        self.assertEqual(parse_amount("１，２００"), 1200.0)
+        self.assertEqual(parse_amount(" 100 "), 100.0)
+        for text in ("1,23", "abc", "", "1.2.3"):
+            with self.assertRaises(ValueError):
+                parse_amount(text)
+
+    def test_parse_payment_lines(self):
+        # 測試整段解析與逐行解析的結果相同（含空白行、前後空白、千分位金額）
+        text = "Alice付了100元晚餐\n\n  Bob 付了 1,200 元 電影  \nCharlie付了３０元付了錢"
+        self.assertEqual(parse_payment_lines(text), [
+            ("Alice", 100.0, "晚餐"), ("Bob", 1200.0, "電影"), ("Charlie", 30.0, "付了錢")
+        ])
+        with self.assertRaises(ValueError) as cm:
+            parse_payment_lines("Alice付了100元晚餐\nBob請客")
+        self.assertIn("格式錯誤：Bob請客", str(cm.exception))
+        with self.assertRaises(ValueError):
+            parse_payment_lines("付了100元晚餐")
+        for text in ("", "\n  \n"):
+            with self.assertRaises(ValueError) as cm:
+                parse_payment_lines(text)
+            self.assertIn("付款記錄不得為空。", str(cm.exception))
+        with self.assertRaises(ValueError):
+            ExpenseManager(members=["Alice"]).process_payments("")
+
+    def test_split_sections(self):
+        # 測試標題後同一行的內容、缺少與重複的段落
+        self.assertEqual(split_sections("說明\n【一、成員名單】A、B\n【二、付款記錄】\nA付了1元茶\n【三、分攤情況】\n所有均分"),
+                         ["A、B", "A付了1元茶", "所有均分"])
+        # 標題前有 Markdown 標題或編號前綴（OpenAI 常見輸出）
+        self.assertEqual(split_sections("### 【一、成員名單】\nA、B\n1. 【二、付款記錄】\nA付了1元茶\n- 【三、分攤情況】所有均分"),
+                         ["A、B", "A付了1元茶", "所有均分"])
+        with self.assertRaises(ValueError) as cm:
+            split_sections("【一、成員名單】\nA\n【二、付款記錄】\nA付了1元茶")
+        self.assertIn("缺少段落", str(cm.exception))
+        with self.assertRaises(ValueError) as cm:
+            split_sections(format_sections(["A", "A付了1元茶", "所有均分"]) + "\n【一、成員名單】\nB")
+        self.assertIn("段落重複", str(cm.exception))
+
+    def test_parse_ledger(self):
+        # 測試成員分多行輸入，並以集合檢查付款人與分攤項目
+        ledger = parse_ledger(format_sections(["Alice、Bob\nCharlie", "Alice付了90元晚餐", "晚餐沒Charlie"]))
+        self.assertEqual(ledger.members, ["Alice", "Bob", "Charlie"])
+        self.assertEqual(ledger.payments, [("Alice", 90.0, "晚餐")])
+        self.assertEqual(ledger.exclusions, [("晚餐", ["Charlie"])])
+        cases = [
+            (["Alice、Bob", "Dave付了90元晚餐", "所有均分"], "付款人 'Dave' 不在成員名單中。"),
+            (["Alice、Bob", "Alice付了90元晚餐", "電影沒Bob"], "無此項目：電影"),
+            (["Alice、Alice", "Alice付了90元晚餐", "所有均分"], "重複成員"),
+            (["Alice", "", "所有均分"], "付款記錄不得為空。"),
+        ]
+        for sections, message in cases:
+            with self.assertRaises(ValueError) as cm:
+                parse_ledger(format_sections(sections))
+            self.assertIn(message, str(cm.exception))
+
+    def test_load_ledger_matches_process(self):
+        # 測試 load_ledger 與依序呼叫 process_* 的結果相同（兩種計算引擎）
+        sections = ["A、B、C、D", "A付了100元晚餐\nB付了1,000元住宿\nC付了30.5元咖啡", "晚餐沒C、D\n咖啡沒A"]
+        for engine in ("python", "numpy"):
+            expected = ExpenseManager(engine=engine)
+            expected.process_members(sections[0])
+            expected.process_payments(sections[1])
+            expected.process_splits(sections[2])
+            manager = ExpenseManager(engine=engine)
+            manager.load_ledger(parse_ledger(format_sections(sections)))
+            self.assertEqual(manager.calculate_and_format(), expected.calculate_and_format())
+
+    def test_parse_ledger_large_input(self):
+        # 測試大型帳本的解析為線性時間（50,000 筆付款）
+        members = [f"M{i}" for i in range(200)]
+        payments = "\n".join(f"M{j % 200}付了{j}元項目{j}" for j in range(50000))
+        exclusions = "\n".join(f"項目{j}沒M{(j + 1) % 200}" for j in range(0, 50000, 3))
+        text = format_sections(["、".join(members), payments, exclusions])
+        start = time.perf_counter()
+        ledger = parse_ledger(text)
+        self.assertLess(time.perf_counter() - start, 5.0)
+        self.assertEqual(len(ledger.payments), 50000)
+        self.assertEqual(ledger.payments[-1], ("M199", 49999.0, "項目49999"))
+
+if __name__ == "__main__":
+    unittest.main()
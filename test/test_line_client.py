@@ -0,0 +1,127 @@
+import threading
+import unittest
+from unittest.mock import Mock
+import requests
+from linebot.models import TextSendMessage
+from line_client import PooledHttpClient, create_line_bot_api
+
+def make_response(status, headers=None):
+    return Mock(status_code=status, headers=headers or {})
+
+class TestPooledHttpClient(unittest.TestCase):
+
+    def setUp(self):
+        self.session = Mock()
+        self.sleeps = []
+        self.now = 0.0
+        self.client = PooledHttpClient(session=self.session, max_retries=3, backoff_base=0.1,
+                                       backoff_max=0.5, deadline=10, sleep=self.sleep, clock=lambda: self.now)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_retries_transient_status(self):
+        # 測試帶 retry key 的 push 遇到 503 後重試成功，並沿用同一個 session
+        self.session.request.side_effect = [make_response(503), make_response(200)]
+        response = self.client.post("https://api.line.me/v2/bot/message/push", data="{}",
+                                    headers={"X-Line-Retry-Key": "key"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session.request.call_count, 2)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertEqual(self.client.retries, 1)
+
+    def test_retries_connection_error_then_raises(self):
+        # 測試連線失敗重試至上限後拋出例外，等待時間不超過上限
+        self.session.request.side_effect = requests.ConnectionError("down")
+        with self.assertRaises(requests.ConnectionError):
+            self.client.get("https://api.line.me/v2/bot/info")
+        self.assertEqual(self.session.request.call_count, 4)
+        self.assertTrue(all(0 <= s <= 0.5 for s in self.sleeps))
+
+    def test_does_not_retry_server_error(self):
+        # 測試 500 不重試（請求可能已被處理）
+        self.session.request.return_value = make_response(500)
+        self.assertEqual(self.client.post("https://api.line.me/x").status_code, 500)
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_does_not_retry_reply_on_bad_gateway(self):
+        # 測試 reply（不帶 retry key 的 POST）遇到 502 / 504 不重試：LINE 可能已送出訊息
+        for status in (502, 504):
+            self.session.request.reset_mock()
+            self.session.request.return_value = make_response(status)
+            self.assertEqual(self.client.post("https://api.line.me/v2/bot/message/reply").status_code, status)
+            self.assertEqual(self.session.request.call_count, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_reply_with_leftover_retry_key_is_not_retried(self):
+        # 測試 push 留在共用 headers 的 retry key 不會讓 reply 被當成可重送的請求
+        self.session.request.return_value = make_response(502)
+        self.client.post("https://api.line.me/v2/bot/message/reply", headers={"X-Line-Retry-Key": "stale"})
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_does_not_retry_reply_after_connection_dropped(self):
+        # 測試 reply 送出後連線中斷不重試，連線階段即失敗則重試
+        self.session.request.side_effect = requests.ConnectionError("connection aborted")
+        with self.assertRaises(requests.ConnectionError):
+            self.client.post("https://api.line.me/v2/bot/message/reply")
+        self.assertEqual(self.session.request.call_count, 1)
+
+        self.session.request.reset_mock()
+        self.session.request.side_effect = [requests.ConnectTimeout("connect"), make_response(200)]
+        self.assertEqual(self.client.post("https://api.line.me/v2/bot/message/reply").status_code, 200)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_honors_retry_after_within_deadline(self):
+        # 測試 429 依 Retry-After 等待（不受 backoff_max 限制），reply 也可重試
+        self.session.request.side_effect = [make_response(429, {"Retry-After": "3"}), make_response(200)]
+        self.assertEqual(self.client.post("https://api.line.me/v2/bot/message/reply").status_code, 200)
+        self.assertEqual(self.sleeps, [3.0])
+
+    def test_retry_after_beyond_deadline_returns_response(self):
+        # 測試 Retry-After 超過請求期限時不等待，直接回傳 429
+        self.session.request.return_value = make_response(429, {"Retry-After": "30"})
+        self.assertEqual(self.client.post("https://api.line.me/v2/bot/message/reply").status_code, 429)
+        self.assertEqual(self.session.request.call_count, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_backoff_is_bounded(self):
+        self.assertLessEqual(self.client.backoff(10), 0.5)
+
+    def test_create_line_bot_api(self):
+        api = create_line_bot_api("token", max_retries=1)
+        self.assertIsInstance(api.http_client, PooledHttpClient)
+        self.assertEqual(api.http_client.max_retries, 1)
+
+class TestPooledLineBotApi(unittest.TestCase):
+
+    def test_concurrent_pushes_carry_distinct_retry_keys(self):
+        # 測試兩個執行緒同時 push 時各自帶著自己的 retry key，且不殘留在共用 headers（之後的 reply 不帶 retry key）
+        barrier = threading.Barrier(2, timeout=5)
+        sent = []
+
+        def request(method, url, headers=None, **kwargs):
+            sent.append((url, dict(headers)))
+            if url.endswith("/push"):
+                barrier.wait()  # 兩個 push 同時進行中
+            return make_response(200)
+
+        session = Mock()
+        session.request.side_effect = request
+        api = create_line_bot_api("token", session=session)
+        threads = [threading.Thread(target=api.push_message, args=(f"U{i}", TextSendMessage(text="hi")),
+                                    kwargs={"retry_key": f"key-{i}"}) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        api.reply_message("token", TextSendMessage(text="hi"))
+
+        keys = sorted(headers.get("X-Line-Retry-Key") for url, headers in sent if url.endswith("/push"))
+        self.assertEqual(keys, ["key-0", "key-1"])
+        self.assertNotIn("X-Line-Retry-Key", api.headers)
+        self.assertNotIn("X-Line-Retry-Key", sent[-1][1])
+        self.assertTrue(sent[-1][0].endswith("/reply"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import threading
+import unittest
+import requests
+from benchmarks.loadgen import (ROOT, conversation_scripts, fake_line_server, fake_openai_server, percentile,
+                                run_load, sign, summarize)
+
+class TestFakeServers(unittest.TestCase):
+
+    def test_openai_returns_sections(self):
+        # 測試假 OpenAI 略過說明文字，回傳三段式解析結果與 token 用量
+        with fake_openai_server() as server:
+            res = requests.post(f"{server.url}/v1/chat/completions", json={
+                "model": "m", "messages": [{"role": "user", "content": "幫我分帳：\n成員有A、B\nA付了100元晚餐"}]
+            }).json()
+        content = res["choices"][0]["message"]["content"]
+        self.assertTrue(content.startswith("【一、成員名單】\nA、B"))
+        self.assertIn("usage", res)
+        self.assertEqual(server.requests["/v1/chat/completions"], 1)
+
+    def test_line_unknown_path(self):
+        with fake_line_server() as server:
+            self.assertEqual(requests.post(f"{server.url}/v2/bot/message/reply", json={}).status_code, 200)
+            self.assertEqual(requests.post(f"{server.url}/v2/bot/unknown", json={}).status_code, 404)
+
+class TestLoad(unittest.TestCase):
+
+    def test_signature_matches_line(self):
+        expected = base64.b64encode(hmac.new(b"s", b"body", hashlib.sha256).digest()).decode()
+        self.assertEqual(sign("s", "body"), expected)
+
+    def test_percentile(self):
+        values = sorted(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_per_user_order_and_report(self):
+        # 測試同一使用者的訊息依序送出，並統計錯誤率
+        received = {}
+        lock = threading.Lock()
+
+        def send(body, signature):
+            self.assertEqual(signature, sign("secret", body))
+            event = json.loads(body)["events"][0]
+            with lock:
+                received.setdefault(event["source"]["userId"], []).append(event["message"]["text"])
+            return 503 if event["message"]["text"] == "是" and len(received) == 1 else 200
+
+        scripts = conversation_scripts(3, members=3, payments=2)
+        report = summarize(run_load(send, "secret", scripts, rate=1000, concurrency=4))
+        self.assertEqual({user: messages for user, messages in scripts}, received)
+        self.assertEqual(report["requests"], 9)
+        self.assertLess(report["error_rate"], 0.2)
+        self.assertIn("p99", report["latency_ms"])
+
+    def test_end_to_end_lambda(self):
+        # 測試在新行程中以假伺服器跑完所有對話（app 需在導向假伺服器後才載入）
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        out = subprocess.run(
+            [sys.executable, os.path.join(ROOT, "benchmarks", "loadgen.py"), "--target", "lambda",
+             "--users", "2", "--rate", "50", "--line-latency", "0", "--openai-latency", "0", "--json"],
+            env=env, capture_output=True, text=True, timeout=120
+        )
+        self.assertEqual(out.returncode, 0, out.stderr)
+        report = json.loads(out.stdout)
+        self.assertEqual(report["completed_conversations"], 2)
+        self.assertEqual(report["openai_requests"], 1)
+        self.assertEqual(report["line_requests"], 6)
+
+if __name__ == "__main__":
+    unittest.main()
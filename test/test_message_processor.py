@@ -1,5 +1,5 @@
 import unittest
-from message_processor import ExpenseManager
+from message_processor import ExpenseManager, chunk_text
 
 class TestExpenseManager(unittest.TestCase):
 
@@ -83,5 +83,168 @@ class TestExpenseManager(unittest.TestCase):
         self.assertGreater(len(transfers), 0)
         self.assertIn("→", transfers[0])
 
+    def test_calculate_transfers_rule_example(self):
+        # 測試 rule/split_rule.txt 範例 1：每次配對多付最多與少付最多的人
+        balances = {"我": 383.33, "卓": -116.67, "夢": -450, "呂": 183.34}
+        transfers = self.manager.calculate_transfers(balances)
+        self.assertEqual(transfers, ["夢 → 我 383.33 元", "卓 → 呂 116.67 元", "夢 → 呂 66.67 元"])
+
+    def test_calculate_transfers_large_group(self):
+        # 測試大量成員時轉帳次數不超過 n-1 且全部結清
+        balances = {f"m{i}": (i % 7) - 3 for i in range(7000)}
+        transfers = self.manager.calculate_transfers(balances)
+        self.assertLessEqual(len(transfers), len(balances) - 1)
+        total = sum(float(t.split()[-2]) for t in transfers)
+        self.assertAlmostEqual(total, sum(b for b in balances.values() if b > 0))
+
+    def test_calculate_optimal_transfers(self):
+        # 測試 optimal 模式找出比 greedy 更少的轉帳次數
+        balances = {"A": -50, "B": 30, "C": -80, "D": -70, "E": 80, "F": 90}
+        manager = ExpenseManager(transfer_mode="optimal")
+        self.assertEqual(len(manager.calculate_transfers(balances)), 5)
+        transfers = manager.calculate_optimal_transfers(balances)
+        self.assertEqual(len(transfers), 4)
+        self.assertIn("C → E 80 元", transfers)
+
+    def test_calculate_optimal_transfers_fallback(self):
+        # 測試超出人數上限時退回 greedy 結果
+        balances = {"A": -50, "B": 30, "C": -80, "D": -70, "E": 80, "F": 90}
+        manager = ExpenseManager(transfer_mode="optimal", exact_max_members=3)
+        self.assertEqual(manager.calculate_optimal_transfers(balances), manager.calculate_transfers(balances))
+
+    def test_exact_max_members_bounded(self):
+        # 測試 optimal 模式的人數上限超過硬上限（2^n 表格）時拋出 ValueError，包含由 session 還原
+        ExpenseManager(transfer_mode="optimal", exact_max_members=20)
+        for value in (21, 30, -1):
+            with self.assertRaises(ValueError):
+                ExpenseManager(transfer_mode="optimal", exact_max_members=value)
+        with self.assertRaises(ValueError):
+            ExpenseManager.from_dict({"members": ["A"], "exact_max_members": 30})
+
+    def test_incremental_updates_match_full_recompute(self):
+        # 測試增量新增 / 修改 / 刪除付款與分攤例外後，結果與重新完整計算相同
+        self.manager.process_members("Alice、Bob、Charlie")
+        self.manager.process_payments("Alice付了300元晚餐\nBob付了150元電影")
+        self.manager.process_splits("晚餐沒Charlie")
+        self.manager.calculate_and_format()
+
+        self.manager.add_payment("Charlie", 90, "飲料")
+        self.manager.exclude("飲料", ["Alice"])
+        self.manager.edit_payment(0, amount=360)
+        self.manager.remove_payment(1)
+        result = self.manager.settle_and_format()
+
+        full = ExpenseManager()
+        full.process_members("Alice、Bob、Charlie")
+        full.process_payments("Alice付了360元晚餐\nCharlie付了90元飲料")
+        full.process_splits("晚餐沒Charlie\n飲料沒Alice")
+        self.assertEqual(result, full.calculate_and_format())
+        self.assertEqual(self.manager.get_summary(), full.get_summary())
+
+    def test_incremental_invalid_payer(self):
+        # 測試增量新增時付款人不在成員名單
+        self.manager.process_members("Alice、Bob")
+        with self.assertRaises(ValueError):
+            self.manager.add_payment("Dave", 10, "飲料")
+
+    def test_numpy_engine_matches_python(self):
+        # 測試 numpy 引擎與 python 引擎的結果完全相同
+        members = "Alice、Bob、Charlie、Dave"
+        payments = "Alice付了300元晚餐\nBob付了150.5元電影\nDave付了99.99元飲料\nAlice付了10元晚餐"
+        splits = "晚餐沒Charlie\n電影沒Alice、Dave\n飲料沒Bob"
+        results = []
+        for engine in ("python", "numpy"):
+            manager = ExpenseManager(engine=engine)
+            manager.process_members(members)
+            manager.process_payments(payments)
+            manager.process_splits(splits)
+            output = manager.calculate_and_format()
+            results.append((output, manager.get_summary()))
+        self.assertEqual(results[0], results[1])
+
+    def test_numpy_engine_totals_match_bitwise(self):
+        # 測試大量非整除的分攤，numpy 引擎逐列累加的 total_owed 與 python 引擎逐位相同
+        members = [f"M{i}" for i in range(7)]
+        payments = "\n".join(f"M{j % 7}付了{j * 13.37 + 0.01:.2f}元項目{j}" for j in range(300))
+        splits = "\n".join(f"項目{j}沒M{j % 5}、M{(j * 3) % 7}" for j in range(0, 300, 2))
+        totals = []
+        for engine in ("python", "numpy"):
+            manager = ExpenseManager(engine=engine)
+            manager.process_members("、".join(members))
+            manager.process_payments(payments)
+            manager.process_splits(splits)
+            manager.calculate()
+            totals.append((manager.total_paid, manager.total_owed))
+        self.assertEqual(totals[0], totals[1])
+
+    def test_unknown_engine(self):
+        # 測試未知的計算引擎
+        with self.assertRaises(ValueError):
+            ExpenseManager(engine="gpu")
+
+    def test_records_share_member_roster(self):
+        # 測試付款與分攤資料共用成員名單，不參與者以集合保存
+        self.manager.process_members("Alice、Bob、Charlie")
+        self.manager.process_payments("Alice付了300元晚餐\nBob付了150元電影")
+        self.manager.process_splits("晚餐沒Charlie、Dave")
+        dinner, movie = self.manager.detailed_split
+        self.assertIs(dinner.members, movie.members)
+        self.assertEqual(dinner.excluded, {"Charlie"})
+        self.assertEqual(dinner["participants"], ["Alice", "Bob"])
+        self.assertIs(movie.participants, movie.members)
+        self.manager.include("晚餐", ["Charlie"])
+        self.assertEqual(self.manager.payments[0]["participants"], ["Alice", "Bob", "Charlie"])
+
+    def test_roster_follows_in_place_member_changes(self):
+        # 測試成員名單就地修改（append、指定索引）後，新紀錄使用更新後的名單
+        self.manager.process_members("Alice、Bob")
+        self.manager.process_payments("Alice付了100元晚餐")
+        self.manager.members.append("Charlie")
+        self.manager.process_payments("Alice付了100元晚餐\nCharlie付了30元咖啡")
+        self.assertEqual(self.manager.payments[1]["participants"], ["Alice", "Bob", "Charlie"])
+        self.manager.members[0] = "Dave"
+        self.manager.process_payments("Dave付了90元電影")
+        self.assertEqual(self.manager.payments[0].members, ("Dave", "Bob", "Charlie"))
+
+    def test_chunk_text(self):
+        # 測試依片段邊界合併，超過上限的片段依行、再依字數切開
+        self.assertEqual(list(chunk_text(["ab\n", "cd\n", "ef\n"], 6)), ["ab\ncd", "ef"])
+        self.assertEqual(list(chunk_text(["a" * 5 + "\n" + "b" * 12], 5)), ["aaaaa", "bbbbb", "bbbbb", "bb"])
+        self.assertEqual(list(chunk_text(["\n", ""], 5)), [])
+
+    def test_iter_output_matches_format_output(self):
+        # 測試逐段產生的結果串接後與 calculate_and_format 相同
+        self.manager.process_members("Alice、Bob、Charlie")
+        self.manager.process_payments("Alice付了300元晚餐\nBob付了150元電影")
+        self.manager.process_splits("晚餐沒Charlie")
+        result = self.manager.calculate_and_format()
+        self.assertEqual("".join(self.manager.iter_output()), result)
+        self.assertIn("  詳細計算：(300 - 150 - 50)", result)
+        self.assertIn("  詳細計算：(0 - 0 - 50)", result)
+
+    def test_output_messages(self):
+        # 測試依字數上限分則；超過則數上限時改送摘要，摘要仍過長時註明省略
+        members = [f"m{i}" for i in range(30)]
+        self.manager.process_members("、".join(members))
+        self.manager.process_payments("\n".join(f"m{i}付了{i + 1}元項目{i}" for i in range(30)))
+        self.manager.process_splits("")
+        self.manager.calculate()
+        full = "".join(self.manager.iter_output())
+
+        messages = self.manager.output_messages(500, header="結果：\n")
+        self.assertTrue(all(len(m) <= 500 for m in messages))
+        self.assertTrue(messages[0].startswith("結果：\n【一、成員名單】"))
+        self.assertEqual("".join(messages).replace("\n", ""), ("結果：\n" + full).replace("\n", ""))
+
+        summary = self.manager.output_messages(2000, max_messages=2)
+        self.assertLessEqual(len(summary), 2)
+        self.assertIn("【結算摘要】\n成員 30 位、付款 30 筆，總金額 465 元", summary[0])
+        self.assertNotIn("詳細計算", "".join(summary))
+        self.assertIn("【五、轉帳方案】", "".join(summary))
+
+        truncated = self.manager.output_messages(100, max_messages=2)
+        self.assertEqual(len(truncated), 2)
+        self.assertIn("則訊息已省略", truncated[-1])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from metrics import Counter, Gauge, Histogram, Registry, annotate, finish_trace, stage, start_trace, STAGE_ERRORS, STAGE_SECONDS
+
+class TestMetricTypes(unittest.TestCase):
+
+    def test_counter_with_labels(self):
+        counter = Counter("c_total", "說明", ("kind",))
+        counter.inc(kind="a")
+        counter.inc(3, kind="a")
+        self.assertEqual(counter.value(kind="a"), 4)
+        self.assertIn('c_total{kind="a"} 4', counter.render())
+        with self.assertRaises(ValueError):
+            counter.inc(other="x")  # 標籤不符
+
+    def test_histogram_is_cumulative(self):
+        # 測試區間計數為累積值，並輸出 _sum 與 _count
+        hist = Histogram("h_seconds", "說明", buckets=(0.1, 1.0))
+        hist.observe(0.05)
+        hist.observe(0.5)
+        hist.observe(5)
+        text = hist.render()
+        self.assertIn('h_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('h_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('h_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("h_seconds_sum 5.55", text)
+        self.assertIn("h_seconds_count 3", text)
+
+    def test_gauge_callback_and_failure(self):
+        gauge = Gauge("g", "說明", lambda: {("x",): 2}, ("cache",))
+        self.assertIn('g{cache="x"} 2', gauge.render())
+        broken = Gauge("b", "說明", lambda: 1 / 0)
+        self.assertEqual(broken.render().splitlines()[-1], "# TYPE b gauge")  # 讀取失敗時不輸出數值
+
+    def test_registry_deduplicates(self):
+        registry = Registry()
+        first = registry.register(Counter("x_total", "說明"))
+        self.assertIs(registry.register(Counter("x_total", "說明")), first)
+        self.assertTrue(registry.render().endswith("\n"))
+
+class TestTrace(unittest.TestCase):
+
+    def test_stages_accumulate_into_trace(self):
+        # 測試同一請求中的階段耗時累加，並寫入直方圖
+        before = STAGE_SECONDS.count(stage="test_stage")
+        start_trace("route")
+        with stage("test_stage"):
+            pass
+        with stage("test_stage"):
+            pass
+        annotate(user="U1")
+        with self.assertLogs("metrics", level="INFO"):
+            trace = finish_trace(status=200)
+        self.assertEqual(STAGE_SECONDS.count(stage="test_stage"), before + 2)
+        self.assertEqual(list(trace["stages"]), ["test_stage"])
+        self.assertEqual(trace["user"], "U1")
+        self.assertEqual(trace["status"], 200)
+        self.assertIsNone(finish_trace())  # 已結束
+
+    def test_stage_error_counted(self):
+        before = STAGE_ERRORS.value(stage="failing")
+        with self.assertRaises(RuntimeError):
+            with stage("failing"):
+                raise RuntimeError("boom")
+        self.assertEqual(STAGE_ERRORS.value(stage="failing"), before + 1)
+
+if __name__ == "__main__":
+    unittest.main()
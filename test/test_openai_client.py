@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+from metrics import OPENAI_TOKENS, STAGE_SECONDS
+from openai_client import OpenAIBusyError, OpenAIClient
+
+def make_response(content):
+    return Mock(choices=[{"message": {"content": content}}])
+
+class TestOpenAIClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = OpenAIClient(model="test-model", timeout=5, max_concurrency=1, rate_per_minute=0)
+        self.messages = [{"role": "user", "content": "hi"}]
+
+    @patch("openai.ChatCompletion.create")
+    def test_chat_passes_deadline(self, create_mock):
+        # 測試呼叫帶有不超過期限的 request_timeout，並使用共用連線池
+        import openai
+        create_mock.return_value = make_response("ok")
+        self.assertEqual(self.client.chat(self.messages, max_tokens=10), "ok")
+        kwargs = create_mock.call_args.kwargs
+        self.assertEqual(kwargs["model"], "test-model")
+        self.assertEqual(kwargs["max_tokens"], 10)
+        self.assertTrue(0 < kwargs["request_timeout"] <= 5)
+        self.assertIsNotNone(openai.requestssession)
+
+    @patch("openai.ChatCompletion.create")
+    def test_expired_deadline_raises_busy(self, create_mock):
+        # 測試取得額度時期限已過 => OpenAIBusyError，不以 request_timeout=0 呼叫 API，並釋放並行額度
+        now = [0.0]
+
+        def acquire(timeout=None):
+            now[0] = 10.0  # 等待速率額度時超過期限
+            return True
+
+        client = OpenAIClient(timeout=5, max_concurrency=1, rate_per_minute=0, clock=lambda: now[0])
+        client.bucket.acquire = acquire
+        with self.assertRaises(OpenAIBusyError):
+            client.chat(self.messages)
+        create_mock.assert_not_called()
+        self.assertTrue(client._semaphore.acquire(blocking=False))
+
+    @patch("openai.ChatCompletion.create")
+    def test_records_latency_and_token_usage(self, create_mock):
+        # 測試呼叫耗時記入 openai 階段，token 用量分別累計
+        from openai.openai_object import OpenAIObject
+        response = OpenAIObject.construct_from({
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 12, "completion_tokens": 3}
+        })
+        create_mock.return_value = response
+        calls = STAGE_SECONDS.count(stage="openai")
+        prompt = OPENAI_TOKENS.value(kind="prompt")
+        self.assertEqual(self.client.chat(self.messages), "ok")
+        self.assertEqual(STAGE_SECONDS.count(stage="openai"), calls + 1)
+        self.assertEqual(OPENAI_TOKENS.value(kind="prompt"), prompt + 12)
+
+    @patch("openai.ChatCompletion.create")
+    def test_concurrency_limit(self, create_mock):
+        # 測試同時呼叫數已滿且期限內無法取得時拋出 OpenAIBusyError
+        started, release = threading.Event(), threading.Event()
+
+        def slow_create(**kwargs):
+            started.set()
+            release.wait(5)
+            return make_response("slow")
+
+        create_mock.side_effect = slow_create
+        worker = threading.Thread(target=self.client.chat, args=(self.messages,))
+        worker.start()
+        started.wait(5)
+        with self.assertRaises(OpenAIBusyError):
+            self.client.chat(self.messages, timeout=0.05)
+        release.set()
+        worker.join()
+
+    @patch("openai.ChatCompletion.create")
+    def test_rate_limit(self, create_mock):
+        # 測試速率額度用完且期限內無法補充時拋出 OpenAIBusyError，不送出呼叫
+        create_mock.return_value = make_response("ok")
+        client = OpenAIClient(timeout=0.05, rate_per_minute=1, burst=1)
+        client.chat(self.messages)
+        with self.assertRaises(OpenAIBusyError):
+            client.chat(self.messages)
+        self.assertEqual(create_mock.call_count, 1)
+
+    @patch("openai.ChatCompletion.acreate", new_callable=AsyncMock)
+    def test_achat_runs_concurrently(self, acreate_mock):
+        # 測試非同步呼叫可同時進行，並受並行數限制
+        active, peak = 0, 0
+
+        async def fake_acreate(**kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return make_response(kwargs["messages"][0]["content"])
+
+        acreate_mock.side_effect = fake_acreate
+        client = OpenAIClient(timeout=5, max_concurrency=3, rate_per_minute=0)
+
+        async def run():
+            try:
+                return await asyncio.gather(*(
+                    client.achat([{"role": "user", "content": str(i)}]) for i in range(6)
+                ))
+            finally:
+                await client.aclose()
+
+        self.assertEqual(asyncio.run(run()), [str(i) for i in range(6)])
+        self.assertEqual(peak, 3)
+
+if __name__ == "__main__":
+    unittest.main()
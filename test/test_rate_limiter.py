@@ -0,0 +1,43 @@
+import unittest
+from rate_limiter import TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_wait(self):
+        # 測試可突發 capacity 次，之後依速率等待
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)  # 已預約的令牌會累加等待時間
+
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=1, clock=clock)
+        bucket.reserve()
+        clock.now = 10
+        self.assertEqual(bucket.reserve(), 0)
+
+    def test_max_wait(self):
+        # 測試等待超過上限時不預約
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=1, clock=clock)
+        bucket.reserve()
+        self.assertIsNone(bucket.reserve(max_wait=0.5))
+        self.assertFalse(bucket.acquire(timeout=0.5))
+        self.assertAlmostEqual(bucket.reserve(max_wait=1), 1.0)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(rate=0)
+        self.assertEqual([bucket.reserve() for _ in range(100)], [0.0] * 100)
+
+if __name__ == "__main__":
+    unittest.main()
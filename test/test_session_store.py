@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from message_processor import ExpenseManager
+from session_store import MemorySessionStore, SQLiteSessionStore, dump_session, load_session
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        # 建立已完成計算的上下文
+        manager = ExpenseManager()
+        manager.process_members("Alice、Bob")
+        manager.process_payments("Alice付了100元晚餐")
+        manager.process_splits("")
+        manager.calculate_and_format()
+        self.context = {"processor": manager, "step": 3, "retry_count": 0, "chart_path": None, "data": None}
+
+    def test_dump_and_load(self):
+        # 測試序列化後可還原 ExpenseManager
+        restored = load_session(dump_session(self.context))
+        self.assertEqual(restored["step"], 3)
+        self.assertEqual(restored["processor"].get_summary(), self.context["processor"].get_summary())
+
+    def test_dump_keeps_exact_limits(self):
+        # 測試 optimal 模式的求解上限隨上下文保存
+        self.context["processor"] = ExpenseManager(transfer_mode="optimal", exact_time_budget=0.5, exact_max_members=8)
+        restored = load_session(dump_session(self.context))["processor"]
+        self.assertEqual((restored.exact_time_budget, restored.exact_max_members), (0.5, 8))
+
+    def test_load_legacy_session(self):
+        # 測試舊格式（付款與分攤資料逐筆保存 participants）可還原
+        legacy = {
+            "members": ["Alice", "Bob"],
+            "payments": [{"payer": "Alice", "amount": 100.0, "item": "晚餐", "participants": ["Alice", "Bob"]}],
+            "detailed_split": [{"item": "晚餐", "amount": 100.0, "participants": ["Alice", "Bob"],
+                                "per_person": 50.0, "payer": "Alice"}],
+            "balances": {"Alice": 50.0, "Bob": -50.0},
+            "transfers": ["Bob → Alice 50 元"],
+        }
+        restored = ExpenseManager.from_dict(legacy)
+        self.assertEqual(restored.get_summary(), self.context["processor"].get_summary())
+        self.assertEqual(restored.to_dict()["payments"], [{"payer": "Alice", "amount": 100.0, "item": "晚餐", "excluded": []}])
+
+    def test_memory_store(self):
+        # 測試記憶體後端的 dict 介面
+        store = MemorySessionStore(max_users=10, ttl=60)
+        store["u1"] = self.context
+        self.assertIn("u1", store)
+        self.assertEqual(store["u1"]["step"], 3)
+        del store["u1"]
+        self.assertNotIn("u1", store)
+        with self.assertRaises(KeyError):
+            store["u1"]
+
+    def test_sqlite_store_shared_and_expiry(self):
+        # 測試 SQLite 後端可由多個實例共用，且閒置過期後會被清除
+        clock = FakeClock()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sessions.db")
+            writer = SQLiteSessionStore(path, ttl=60, clock=clock)
+            reader = SQLiteSessionStore(path, ttl=60, clock=clock)
+            writer["u1"] = self.context
+            self.assertEqual(reader["u1"]["processor"].balances, {"Alice": 50.0, "Bob": -50.0})
+            clock.now += 61
+            self.assertNotIn("u1", reader)
+            self.assertEqual(writer.purge_expired(), 1)
+
+    def test_add_only_if_absent(self):
+        # 測試 add 在記憶體與 SQLite 後端皆只在不存在或已過期時寫入
+        clock = FakeClock()
+        with tempfile.TemporaryDirectory() as tmp:
+            sqlite_store = SQLiteSessionStore(os.path.join(tmp, "sessions.db"), ttl=60, clock=clock)
+            for store in (MemorySessionStore(max_users=10, ttl=60), sqlite_store):
+                self.assertTrue(store.add("u1", {"step": 1}))
+                self.assertFalse(store.add("u1", {"step": 2}))
+                self.assertEqual(store["u1"]["step"], 1)
+            clock.now += 61
+            self.assertTrue(sqlite_store.add("u1", {"step": 3}))
+            self.assertEqual(sqlite_store["u1"]["step"], 3)
+
+if __name__ == "__main__":
+    unittest.main()
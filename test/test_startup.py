@@ -0,0 +1,15 @@
+import tempfile
+import unittest
+from benchmarks.startup import run_once
+
+class TestStartup(unittest.TestCase):
+
+    def test_cold_start_skips_heavy_modules(self):
+        # 測試冷啟動只載入必要模組，且第一次 webhook 請求可正常回應
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_once(workdir)
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(result["heavy_loaded"], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from ttl_cache import TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_stats(self):
+        # 測試命中與未命中統計
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_lru_eviction(self):
+        # 測試超過容量時淘汰最久未使用的項目
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+
+    def test_ttl_expiry(self):
+        # 測試過期項目不會被取得
+        self.cache.set("a", 1)
+        self.clock.now = 11
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("b", 2)
+        self.clock.now = 25
+        self.assertEqual(self.cache.expire(), 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_add_only_if_absent(self):
+        # 測試 add 只在不存在或已過期時寫入
+        self.assertTrue(self.cache.add("a", 1))
+        self.assertFalse(self.cache.add("a", 2))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.clock.now = 11
+        self.assertTrue(self.cache.add("a", 3))
+        self.assertEqual(self.cache.get("a"), 3)
+
+if __name__ == "__main__":
+    unittest.main()
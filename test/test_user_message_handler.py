@@ -1,7 +1,13 @@
+import asyncio
+import tempfile
+import os
 import unittest
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock, patch
+from artifact_store import LocalArtifactStore
+from ledger_parser import format_sections
 from user_message_handler import MessageHandler
-from linebot.models import TextSendMessage
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error, TextSendMessage
 
 class TestMessageHandler(unittest.TestCase):
 
@@ -79,16 +85,34 @@ class TestMessageHandler(unittest.TestCase):
         event = self.create_text_event(user_id, "是")
 
         # 模擬處理方法
-        self.handler.clean_data = Mock(return_value="Cleaned data")
-        self.handler.split_into_three_sections = Mock(return_value=["members", "payments", "splits"])
         self.handler.generate_and_send_chart = Mock()
 
-        self.handler.handle_message(event)
+        with patch("user_message_handler.parse_ledger", return_value=Mock()) as parse_mock:
+            self.handler.handle_message(event)
+        parse_mock.assert_called_once_with("Mocked data")
         
         # 驗證步驟是否更新為 3
         self.assertEqual(self.handler.user_context[user_id]["step"], 3)
         self.handler.generate_and_send_chart.assert_called_once()
 
+    def test_confirmation_yes_records_parse_stage(self):
+        # 測試解析與載入帳本計入 parse 階段延遲
+        from metrics import STAGE_SECONDS
+        user_id = 'test_user'
+        self.handler.user_context[user_id] = self.handler.new_context()
+        self.handler.user_context[user_id].update({
+            "step": 1,
+            "data": format_sections(["Alice、Bob", "Alice付了100元晚餐", "所有均分"]),
+        })
+        self.handler.generate_and_send_chart = Mock()
+        before = STAGE_SECONDS.count(stage="parse")
+
+        self.handler.handle_message(self.create_text_event(user_id, "是"))
+
+        self.assertEqual(self.handler.user_context[user_id]["step"], 3)
+        self.assertEqual(STAGE_SECONDS.count(stage="parse"), before + 1)
+        self.assertEqual(self.handler.user_context[user_id]["processor"].members, ["Alice", "Bob"])
+
     def test_handle_step_1_confirmation_no(self):
         # 測試在 step=1 時，用戶確認「否」是否能正確進入手動輸入模式
         user_id = 'test_user'
@@ -104,5 +128,257 @@ class TestMessageHandler(unittest.TestCase):
         self.line_bot_api_mock.reply_message.assert_called()
         self.assertEqual(self.handler.user_context[user_id]["step"], "manual_input")
 
+    @patch("openai.ChatCompletion.create")
+    def test_handle_step_0_local_parse(self, create_mock):
+        # 測試標準格式輸入走本地解析，不呼叫 OpenAI
+        user_id = 'test_user'
+        event = self.create_text_event(user_id, "成員有Alice、Bob\nAlice付了100元晚餐\n晚餐沒Bob")
+
+        self.handler.handle_message(event)
+        context = self.handler.user_context[user_id]
+        self.assertEqual(context["step"], 1)
+        self.assertIn("【二、付款記錄】\nAlice付了100元晚餐", context["data"])
+        create_mock.assert_not_called()
+
+    def test_handle_step_3_followup(self):
+        # 測試流程完成後追加付款，帳本增量更新並維持 step=3
+        user_id = 'test_user'
+        context = self.handler.new_context()
+        processor = context["processor"]
+        processor.process_members("Alice、Bob")
+        processor.process_payments("Alice付了100元晚餐")
+        processor.process_splits("")
+        processor.calculate_and_format()
+        context["step"] = 3
+        self.handler.user_context[user_id] = context
+        self.handler.generate_and_send_chart = Mock()
+
+        self.handler.handle_message(self.create_text_event(user_id, "Bob付了50元飲料"))
+
+        self.assertEqual(self.handler.user_context[user_id]["step"], 3)
+        self.assertEqual(self.handler.user_context[user_id]["processor"].balances, {"Alice": 25.0, "Bob": -25.0})
+        self.assertEqual(processor.balances, {"Alice": 50.0, "Bob": -50.0})  # 原帳本未被修改
+        self.handler.generate_and_send_chart.assert_called_once()
+
+    def test_handle_step_3_followup_chart_failure_keeps_ledger(self):
+        # 測試出圖失敗時帳本維持原狀，使用者依提示重新輸入同一筆付款不會重複計入
+        user_id = 'test_user'
+        with tempfile.TemporaryDirectory() as tmp:
+            context = self.settled_context(tmp)
+            self.handler.user_context[user_id] = context
+            with patch.object(LocalArtifactStore, "write_many", side_effect=OSError("disk full")):
+                self.handler.handle_message(self.create_text_event(user_id, "Bob付了50元飲料"))
+            reply = self.line_bot_api_mock.reply_message.call_args[0][1]
+            self.assertTrue(reply.text.startswith("追加資料處理失敗：disk full"))
+            processor = self.handler.user_context[user_id]["processor"]
+            self.assertEqual(processor.balances, {"Alice": 50.0, "Bob": -50.0})
+            self.assertEqual(len(processor.payments), 1)
+
+            self.handler.handle_message(self.create_text_event(user_id, "Bob付了50元飲料"))
+        processor = self.handler.user_context[user_id]["processor"]
+        self.assertEqual(processor.balances, {"Alice": 25.0, "Bob": -25.0})
+        self.assertEqual(len(processor.payments), 2)
+
+    def test_handle_step_3_followup_invalid_payer(self):
+        # 測試追加付款的付款人不在成員名單時不修改帳本
+        user_id = 'test_user'
+        context = self.handler.new_context()
+        context["processor"].process_members("Alice、Bob")
+        context["step"] = 3
+        self.handler.user_context[user_id] = context
+
+        self.handler.handle_message(self.create_text_event(user_id, "Dave付了50元飲料"))
+
+        self.assertEqual(context["processor"].payments, [])
+        self.assertEqual(self.handler.user_context[user_id]["step"], 3)
+
+    def test_handle_step_3_followup_invalid_exclusion(self):
+        # 測試分攤例外的成員不在成員名單時回覆錯誤，且不套用同一則訊息中的任何資料
+        user_id = 'test_user'
+        with tempfile.TemporaryDirectory() as tmp:
+            context = self.settled_context(tmp)
+            self.handler.user_context[user_id] = context
+            event = self.create_text_event(user_id, "Bob付了50元飲料\n晚餐沒Dave")
+
+            self.handler.handle_message(event)
+
+        self.assertEqual(len(context["processor"].payments), 1)
+        self.assertEqual(context["processor"].payments[0].excluded, frozenset())
+        self.line_bot_api_mock.reply_message.assert_called_once_with(
+            event.reply_token, TextSendMessage(text="成員 Dave 不在成員名單中，請重新輸入。")
+        )
+
+    def test_handle_step_3_chit_chat_not_exclusion(self):
+        # 測試「我沒問題」等聊天內容（項目不在帳本中）不當成分攤例外，回到原本的完成提示並重置 step
+        user_id = 'test_user'
+        with tempfile.TemporaryDirectory() as tmp:
+            context = self.settled_context(tmp)
+            self.handler.user_context[user_id] = context
+            for text in ("我沒問題", "今天沒空"):
+                context["step"] = 3
+                event = self.create_text_event(user_id, text)
+                self.handler.handle_message(event)
+                self.assertEqual(self.handler.user_context[user_id]["step"], 0)
+                reply = self.line_bot_api_mock.reply_message.call_args[0][1]
+                self.assertTrue(reply.text.startswith("流程已完成！"))
+
+        self.assertEqual(context["processor"].payments[0].excluded, frozenset())
+
+    def test_handle_step_3_exclusion_on_existing_item(self):
+        # 測試既有項目的分攤例外仍走增量更新
+        user_id = 'test_user'
+        with tempfile.TemporaryDirectory() as tmp:
+            context = self.settled_context(tmp)
+            self.handler.user_context[user_id] = context
+            self.handler.handle_message(self.create_text_event(user_id, "晚餐沒Bob"))
+
+        self.assertEqual(self.handler.user_context[user_id]["step"], 3)
+        self.assertEqual(context["processor"].payments[0].excluded, frozenset({"Bob"}))
+
+    def settled_context(self, output_dir):
+        # 建立已完成結算（step=3）的上下文，圖表輸出至暫存資料夾
+        self.handler.artifact_store = LocalArtifactStore(output_dir)
+        context = self.handler.new_context()
+        processor = context["processor"]
+        processor.process_members("Alice、Bob")
+        processor.process_payments("Alice付了100元晚餐")
+        processor.process_splits("")
+        processor.calculate_and_format()
+        context["step"] = 3
+        return context
+
+    def test_followup_sends_single_reply(self):
+        # 測試計算結果、圖表連結與回覆合併為單一 reply，不使用 push
+        user_id = 'test_user'
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.handler.user_context[user_id] = self.settled_context(output_dir)
+            self.handler.handle_message(self.create_text_event(user_id, "Bob付了50元飲料"))
+
+        self.line_bot_api_mock.reply_message.assert_called_once()
+        self.line_bot_api_mock.push_message.assert_not_called()
+        token, messages = self.line_bot_api_mock.reply_message.call_args[0]
+        self.assertEqual(token, 'dummy_token')
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[0].text.startswith("計算結果如下："))
+        self.assertIn("/chart/charts_", messages[1].text)
+        self.assertTrue(messages[2].text.startswith("帳本已更新！"))
+
+    def test_expired_reply_token_falls_back_to_push(self):
+        # 測試 reply token 失效時，同樣的訊息改以單次 push（帶 retry key）送出
+        user_id = 'test_user'
+        self.line_bot_api_mock.reply_message.side_effect = LineBotApiError(400, {}, error=Error(message="Invalid reply token"))
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.handler.user_context[user_id] = self.settled_context(output_dir)
+            self.handler.handle_message(self.create_text_event(user_id, "Bob付了50元飲料"))
+
+        self.line_bot_api_mock.push_message.assert_called_once()
+        args, kwargs = self.line_bot_api_mock.push_message.call_args
+        self.assertEqual(args[0], user_id)
+        self.assertEqual(len(args[1]), 3)
+        self.assertTrue(kwargs["retry_key"])
+
+    def test_reply_server_error_falls_back_to_push_once(self):
+        # 測試 reply 回應 502（未重試）時只改用 push 送出一次
+        event = self.create_text_event('test_user', "")
+        self.line_bot_api_mock.reply_message.side_effect = LineBotApiError(502, {}, error=Error(message="Bad Gateway"))
+        self.handler.send_messages(event, ["a"])
+        self.line_bot_api_mock.reply_message.assert_called_once()
+        self.line_bot_api_mock.push_message.assert_called_once()
+
+    def test_reply_connection_error_does_not_push(self):
+        # 測試 reply 連線中斷（無法確定是否已送出）時不改用 push
+        import requests
+        event = self.create_text_event('test_user', "")
+        self.line_bot_api_mock.reply_message.side_effect = requests.ConnectionError("connection aborted")
+        with self.assertRaises(requests.ConnectionError):
+            self.handler.send_messages(event, ["a"])
+        self.line_bot_api_mock.push_message.assert_not_called()
+
+    def test_long_text_split_into_messages(self):
+        # 測試超過 LINE 字數上限的訊息切成多則送出
+        event = self.create_text_event('test_user', "")
+        self.handler.send_messages(event, ["a" * 6000, "b"])
+        token, messages = self.line_bot_api_mock.reply_message.call_args[0]
+        self.assertEqual([len(m.text) for m in messages], [5000, 1000, 1])
+
+    def test_large_ledger_result_sent_as_summary(self):
+        # 測試完整結果超過則數上限時只送摘要，計算結果、圖表連結與回覆仍為單次 reply
+        user_id = 'test_user'
+        with tempfile.TemporaryDirectory() as output_dir:
+            context = self.settled_context(output_dir)
+            processor = context["processor"]
+            processor.process_members("、".join(f"m{i}" for i in range(300)))
+            processor.process_payments("\n".join(f"m{i}付了{i + 1}元項目{i}" for i in range(300)))
+            processor.process_splits("")
+            self.handler.user_context[user_id] = context
+            self.handler.handle_message(self.create_text_event(user_id, "m1付了50元飲料"))
+
+        self.line_bot_api_mock.push_message.assert_not_called()
+        token, messages = self.line_bot_api_mock.reply_message.call_args[0]
+        self.assertLessEqual(len(messages), 5)
+        self.assertTrue(messages[0].text.startswith("計算結果如下：\n【結算摘要】"))
+        self.assertTrue(all(len(m.text) <= 5000 for m in messages))
+        self.assertTrue(messages[-1].text.startswith("帳本已更新！"))
+
+    def test_exact_limits_from_env(self):
+        # 測試 optimal 模式的求解上限由環境變數設定，並套用到新的上下文
+        with patch.dict(os.environ, {"EXACT_MAX_MEMBERS": "10", "EXACT_TIME_BUDGET": "0.05"}):
+            handler = MessageHandler(self.line_bot_api_mock, {})
+        processor = handler.new_context()["processor"]
+        self.assertEqual(processor.exact_max_members, 10)
+        self.assertEqual(processor.exact_time_budget, 0.05)
+        with patch.dict(os.environ, {"EXACT_MAX_MEMBERS": "30"}), self.assertRaises(ValueError):
+            MessageHandler(self.line_bot_api_mock, {})
+
+    def test_queue_message_outside_event_pushes(self):
+        # 測試不在事件處理流程中時，排入的訊息直接 push
+        event = self.create_text_event('test_user', "")
+        self.handler.queue_message(event, "hello")
+        self.line_bot_api_mock.push_message.assert_called_once()
+        self.line_bot_api_mock.reply_message.assert_not_called()
+
+    @patch("openai.ChatCompletion.create")
+    def test_call_openai_api_cache(self, create_mock):
+        # 測試相同（正規化後）輸入只呼叫一次 OpenAI
+        create_mock.return_value = Mock(choices=[{"message": {"content": "parsed"}}])
+        self.assertEqual(self.handler.call_openai_api("Alice付了100元晚餐"), "parsed")
+        self.assertEqual(self.handler.call_openai_api("  Alice付了１００元晚餐 \n\n"), "parsed")
+        self.assertEqual(create_mock.call_count, 1)
+        stats = self.handler.response_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    @patch("openai.ChatCompletion.create")
+    def test_call_openai_api_bypass_cache(self, create_mock):
+        # 測試「否」重新解析時略過快取
+        create_mock.return_value = Mock(choices=[{"message": {"content": "parsed"}}])
+        self.handler.call_openai_api("Alice付了100元晚餐")
+        self.handler.call_openai_api("Alice付了100元晚餐", use_cache=False)
+        self.assertEqual(create_mock.call_count, 2)
+
+    @patch("openai.ChatCompletion.create")
+    def test_confirmation_no_replaces_cached_parse(self, create_mock):
+        # 測試「否」移除被否定的快取結果，並以重新解析的結果取代
+        user_id = 'test_user'
+        message = "我們三個人去吃飯，小明付了300元"
+        create_mock.side_effect = [Mock(choices=[{"message": {"content": content}}]) for content in ("wrong", "right")]
+        self.handler.handle_message(self.create_text_event(user_id, message))
+        self.handler.handle_message(self.create_text_event(user_id, "否"))
+        self.assertEqual(self.handler.user_context[user_id]["data"], "right")
+        self.assertEqual(create_mock.call_count, 2)
+
+        # 重新傳送同一份帳本：取得重新解析的結果，不再呼叫 OpenAI
+        self.handler.reset_workflow(user_id)
+        self.handler.handle_message(self.create_text_event(user_id, message))
+        self.assertEqual(self.handler.user_context[user_id]["data"], "right")
+        self.assertEqual(create_mock.call_count, 2)
+
+    @patch("openai.ChatCompletion.acreate", new_callable=AsyncMock)
+    def test_acall_openai_api_cache(self, acreate_mock):
+        # 測試非同步版本與同步版本共用快取
+        acreate_mock.return_value = Mock(choices=[{"message": {"content": "parsed"}}])
+        self.assertEqual(asyncio.run(self.handler.acall_openai_api("Alice付了100元晚餐")), "parsed")
+        self.assertEqual(self.handler.call_openai_api("Alice付了100元晚餐"), "parsed")
+        self.assertEqual(acreate_mock.await_count, 1)
+
 if __name__ == "__main__":
     unittest.main()
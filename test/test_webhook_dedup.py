@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import unittest
+from linebot import WebhookParser
+from linebot.exceptions import InvalidSignatureError
+from session_store import MemorySessionStore, SQLiteSessionStore
+from webhook_dedup import WebhookDeduplicator
+
+SECRET = "test-secret"
+
+def sign(body):
+    return base64.b64encode(hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).digest()).decode()
+
+def message_event(event_id, text="hi"):
+    return {
+        "type": "message", "webhookEventId": event_id, "mode": "active", "timestamp": 0,
+        "replyToken": f"token-{event_id}", "source": {"type": "user", "userId": "U1"},
+        "message": {"type": "text", "id": event_id, "text": text},
+        "deliveryContext": {"isRedelivery": False}
+    }
+
+class TestWebhookDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = WebhookParser(SECRET)
+        self.dedup = WebhookDeduplicator(MemorySessionStore(max_users=100, ttl=60))
+
+    def parse(self, events):
+        body = json.dumps({"destination": "bot", "events": events})
+        return self.dedup.parse(self.parser, body, sign(body))
+
+    def test_redelivery_is_skipped(self):
+        # 測試重送的事件只處理一次
+        first = self.parse([message_event("e1"), message_event("e2")])
+        self.assertEqual([event_id for event_id, _ in first], ["e1", "e2"])
+        self.assertEqual(first[0][1].message.text, "hi")
+        self.assertEqual(self.parse([message_event("e1")]), [])
+        self.assertEqual(self.dedup.duplicates, 1)
+
+    def test_release_allows_reprocessing(self):
+        self.parse([message_event("e1")])
+        self.dedup.release("e1")
+        self.assertEqual(len(self.parse([message_event("e1")])), 1)
+
+    def test_keeps_id_mapping_with_unknown_events(self):
+        # 測試 SDK 略過的未知事件不影響事件與 ID 的對應
+        events = self.parse([{"type": "unknown", "webhookEventId": "x"}, message_event("e2")])
+        self.assertEqual([(event_id, event.message.id) for event_id, event in events], [("e2", "e2")])
+
+    def test_invalid_signature(self):
+        with self.assertRaises(InvalidSignatureError):
+            self.dedup.parse(self.parser, json.dumps({"events": [message_event("e1")]}), "bad")
+        self.assertTrue(self.dedup.claim("e1"))  # 簽名錯誤的請求不佔用事件 ID
+
+    def test_shared_sqlite_store(self):
+        # 測試多個行程（各自的去重器）共用 SQLite 時同一事件只會被受理一次
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dedup.db")
+            a = WebhookDeduplicator(SQLiteSessionStore(path, ttl=60, table="webhook_events"))
+            b = WebhookDeduplicator(SQLiteSessionStore(path, ttl=60, table="webhook_events"))
+            self.assertTrue(a.claim("e1"))
+            self.assertFalse(b.claim("e1"))
+            self.assertTrue(b.claim(None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    執行緒安全的 LRU + TTL 快取：
+    - 超過 maxsize 時淘汰最久未使用的項目
+    - 寫入超過 ttl 秒的項目視為過期（每次寫入都會重新計時）
+    - 記錄命中 / 未命中次數，供監控使用
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, clock=time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize 至少需為 1。")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """取得快取值；不存在或已過期則回傳 default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """寫入快取值，必要時淘汰最久未使用的項目"""
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value):
+        """
+        只在 key 不存在（或已過期）時寫入，回傳是否寫入。
+        檢查與寫入在同一把鎖內完成，可用於「只處理一次」的判斷。
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > self._clock():
+                return False
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def pop(self, key, default=None):
+        """移除並回傳快取值"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= self._clock():
+            return default
+        return entry[1]
+
+    def expire(self):
+        """清除所有已過期的項目，回傳清除數量"""
+        now = self._clock()
+        with self._lock:
+            expired = [k for k, (expires_at, _) in self._data.items() if expires_at <= now]
+            for k in expired:
+                del self._data[k]
+        return len(expired)
+
+    def clear(self):
+        """清空快取（不重設統計數字）"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """回傳快取統計資料"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > self._clock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
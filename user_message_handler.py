@@ -1,9 +1,39 @@
+from linebot.exceptions import LineBotApiError
 from linebot.models import TextSendMessage
-from message_processor import ExpenseManager
-from expense_chart_generator import ChartGenerator
-import openai
+from message_processor import ExpenseManager, chunk_text, validate_exact_max_members
+from ttl_cache import TTLCache
+from artifact_store import LocalArtifactStore
+from metrics import stage
+from openai_client import OpenAIClient
+from lazy_import import lazy_import
+from ledger_parser import parse_canonical_input, parse_followup, parse_ledger, format_sections
+import hashlib
+import logging
 import os
-import re
+import threading
+import unicodedata
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# LINE 單次 reply / push 最多可帶的訊息數，與每則文字訊息的字數上限
+MAX_MESSAGES_PER_REQUEST = 5
+MAX_TEXT_LENGTH = 5000
+
+# 計算結果最多分成幾則訊息；完整結果超過時改送摘要（預設 3 則：與圖表連結、回覆合併後仍為單次 reply）
+RESULT_MAX_MESSAGES = int(os.getenv("RESULT_MAX_MESSAGES", "3"))
+
+# OpenAI 解析用的系統提示詞（其雜湊值作為快取鍵的一部分，修改提示詞即自動失效）
+OPENAI_SYSTEM_PROMPT = (
+    "你是記帳助手，請根據以下格式解析訊息：\n"
+    "【一、成員名單】\n用頓號區隔的成員名單\n"
+    "【二、付款記錄】\n每行格式為：[成員]付了[金額]元[項目]\n"
+    "【三、分攤情況】\n每行格式為：[項目]沒[成員]\n\n"
+    "特別規則：\n"
+    "1. 如果用戶在【分攤狀況】打'無'，則【分攤情況】應顯示為'所有均分'。\n"
+    "2. 嚴格按照上述格式輸出，並確保解析結果準確。"
+)
+OPENAI_PROMPT_HASH = hashlib.sha256(OPENAI_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
 
 
 class MessageHandler:
@@ -14,46 +44,134 @@ class MessageHandler:
         - 是：計算、出圖 => step=3
         - 否：若拒絕2次 => 進入手動模式 manual_input
     3. step=manual_input：使用者手動貼上完整格式，人工解析 => step=3
-    4. step=3：流程已完成，可重置或再次輸入。
+    4. step=3：流程已完成，可追加付款 / 分攤例外（增量更新），或重置、再次輸入。
     """
 
-    def __init__(self, line_bot_api, user_context):
+    def __init__(self, line_bot_api, user_context, artifact_store=None):
         """初始化訊息處理類別"""
         self.line_bot_api = line_bot_api
         self.user_context = user_context
+        # 圖表儲存：預設為本機 static/charts（由 /chart 路由提供）
+        self.artifact_store = artifact_store or LocalArtifactStore(os.path.join("static", "charts"))
         self.base_url = os.getenv("BASE_URL", "http://localhost:5000")
         self.max_retry = 3
         self.openai_model = "gpt-3.5-turbo"
+        self.openai_client = OpenAIClient(model=self.openai_model)  # 連線池、逾時、限流
+        self.settlement_engine = os.getenv("SETTLEMENT_ENGINE", "python")  # 大型帳本可設為 numpy
+        self.transfer_mode = os.getenv("TRANSFER_MODE", "greedy")  # optimal => 最少轉帳次數
+        # optimal 模式的求解上限：超過人數或時間上限時退回 greedy
+        self.exact_max_members = validate_exact_max_members(int(os.getenv("EXACT_MAX_MEMBERS", "14")))
+        self.exact_time_budget = float(os.getenv("EXACT_TIME_BUDGET", "0.2"))
+        # OpenAI 解析結果快取：相同（正規化後）輸入直接回傳，不再重新呼叫
+        self._local = threading.local()  # 每個工作執行緒各自的待送訊息
+        self.response_cache = TTLCache(
+            maxsize=int(os.getenv("OPENAI_CACHE_SIZE", "512")),
+            ttl=int(os.getenv("OPENAI_CACHE_TTL", "3600"))
+        )
 
     # -------------------------------------------------------------------------
     # 基本工具 / 共用方法
     # -------------------------------------------------------------------------
     def reply_user(self, event, text):
-        """統一回覆使用者訊息"""
-        self.line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=text)
-        )
+        """
+        統一回覆使用者訊息。
+        處理過程中排入的訊息（計算結果、圖表連結）會與回覆合併為單一 reply 送出。
+        """
+        self.send_messages(event, self._take_outbox() + [text])
 
-    def update_context(self, user_id, context):
-        """更新使用者上下文資料"""
-        self.user_context[user_id] = context
+    def queue_message(self, event, text):
+        """
+        排入一則訊息，於本次事件回覆時一併送出；
+        不在 handle_message 流程中（沒有待回覆的事件）時直接 push。
+        """
+        outbox = getattr(self._local, "outbox", None)
+        if outbox is None:
+            self.push_messages(event.source.user_id, [TextSendMessage(text=text)])
+        else:
+            outbox.append(text)
 
-    def reset_workflow(self, user_id):
-        """重置使用者的分帳流程狀態"""
-        self.user_context[user_id] = {
-            "processor": ExpenseManager(),
+    def _take_outbox(self):
+        outbox = getattr(self._local, "outbox", None)
+        if not outbox:
+            return []
+        self._local.outbox = []
+        return outbox
+
+    def send_messages(self, event, texts):
+        """
+        以單一 reply 送出多則訊息（reply 不計入每月推播額度）。
+        超過字數上限的訊息先切成多則；超過單次上限的訊息改用 push。
+        reply 回應錯誤狀態（例如 reply token 已失效）時改用 push：reply 遇到 5xx 不會重試，
+        錯誤即代表訊息未送出。連線中斷或逾時則無法確定 LINE 是否已送出，不改用 push，以免重複訊息。
+        """
+        messages = [TextSendMessage(text=t) for text in texts for t in chunk_text([text], MAX_TEXT_LENGTH)]
+        first, rest = messages[:MAX_MESSAGES_PER_REQUEST], messages[MAX_MESSAGES_PER_REQUEST:]
+        try:
+            with stage("line_reply"):
+                self.line_bot_api.reply_message(event.reply_token, first if len(first) > 1 else first[0])
+        except LineBotApiError as e:
+            logger.warning("reply 失敗（%s），改用 push 送出", e.status_code)
+            rest = messages
+        if rest:
+            self.push_messages(event.source.user_id, rest)
+
+    def push_messages(self, user_id, messages):
+        """
+        分批 push（每批最多 5 則）。
+        每批帶有 retry key：HTTP 層重試時 LINE 不會重複送出（重複請求回應 409）。
+        """
+        for i in range(0, len(messages), MAX_MESSAGES_PER_REQUEST):
+            try:
+                with stage("line_push"):
+                    self.line_bot_api.push_message(
+                        user_id, messages[i:i + MAX_MESSAGES_PER_REQUEST], retry_key=str(uuid.uuid4())
+                    )
+            except LineBotApiError as e:
+                if e.status_code != 409:
+                    raise
+
+    def new_context(self):
+        """建立新的使用者上下文"""
+        return {
+            "processor": ExpenseManager(engine=self.settlement_engine, transfer_mode=self.transfer_mode,
+                                        exact_time_budget=self.exact_time_budget,
+                                        exact_max_members=self.exact_max_members),
             "step": 0,
             "retry_count": 0,
             "chart_path": None,
-            "data": None
+            "data": None,
+            "source": None  # 送交 OpenAI 解析的原始輸入（本地解析時為 None）
         }
 
+    def get_context(self, user_id):
+        """取得使用者上下文，不存在（或已過期）則建立新的"""
+        context = self.user_context.get(user_id)
+        return context if context is not None else self.new_context()
+
+    def update_context(self, user_id, context):
+        """
+        更新使用者上下文資料。
+        user_context 可為一般 dict 或 SessionStore，
+        使用外部儲存時上下文必須在此寫回才會保存。
+        """
+        self.user_context[user_id] = context
+
+    def reset_workflow(self, user_id):
+        """重置使用者的分帳流程狀態"""
+        self.user_context[user_id] = self.new_context()
+
     # -------------------------------------------------------------------------
     # 入口：收到使用者訊息時，程式從這裡開始
     # -------------------------------------------------------------------------
     def handle_message(self, event):
         """處理 LINE Bot 收到的訊息事件"""
+        self._local.outbox = []  # 本次事件待合併送出的訊息
+        try:
+            self._handle_message(event)
+        finally:
+            self._local.outbox = None
+
+    def _handle_message(self, event):
         user_id = event.source.user_id
 
         # 確保為文字訊息
@@ -70,19 +188,13 @@ class MessageHandler:
             return
 
         # 取得/初始化使用者上下文
-        context = self.user_context.get(user_id, {
-            "processor": ExpenseManager(),
-            "step": 0,
-            "retry_count": 0,
-            "data": None,
-            "chart_path": None
-        })
+        context = self.get_context(user_id)
         step = context["step"]
 
         # 依 step 不同，進入對應處理
         if step == 3:
-            # 流程完成，引導重置或再次輸入
-            resp = self.handle_step_3(context)
+            # 流程完成：追加付款 / 分攤例外，或引導重置、再次輸入
+            resp = self.handle_step_3(context, user_message, event)
             self.update_context(user_id, context)
             self.reply_user(event, resp)
             return
@@ -144,11 +256,18 @@ class MessageHandler:
     # -------------------------------------------------------------------------
     # step=3、manual_input 狀態處理
     # -------------------------------------------------------------------------
-    def handle_step_3(self, context):
+    def handle_step_3(self, context, user_message=None, event=None):
         """
-        step=3：流程已完成，若使用者想輸入新記帳資料 => 重置 or step=0
-        這裡簡單提示即可。
+        step=3：流程已完成。
+        - 追加付款或分攤例外（例如「Bob付了50元飲料」）=> 增量更新帳本，維持 step=3
+        - 其他輸入 => 引導重置 or step=0
+        分攤例外的項目須已在帳本中（或由同一則訊息的付款新增），
+        否則「我沒問題」、「今天沒空」等聊天內容會被當成分攤例外。
         """
+        updates = parse_followup(user_message) if user_message else None
+        if updates and self.is_followup(context["processor"], updates):
+            return self.handle_followup(context, updates, event)
+
         # 顯示完成後，引導輸入或重置
         context["step"] = 0  # 重置到0，讓使用者再次輸入就能重新開始
         return (
@@ -157,6 +276,58 @@ class MessageHandler:
             "如需重新開始流程，請輸入「重置」。"
         )
 
+    @staticmethod
+    def is_followup(processor, updates):
+        """每行皆為付款，或為已存在項目（含同一則訊息新增的付款項目）的分攤例外"""
+        items = {p.item for p in processor.payments}
+        for update in updates:
+            if update[0] == "payment":
+                items.add(update[3])
+            elif update[1] not in items:
+                return False
+        return True
+
+    def handle_followup(self, context, updates, event):
+        """
+        對已完成的帳本套用追加資料，只更新受影響成員，再重新出圖。
+        套用前先檢查全部資料，避免只套用一半；任何步驟失敗時帳本維持原狀。
+        """
+        processor = context["processor"]
+        members = set(processor.members)
+        items = {p.item for p in processor.payments}
+        for update in updates:
+            if update[0] == "payment":
+                if update[1] not in members:
+                    return f"付款人 '{update[1]}' 不在成員名單中，請重新輸入。"
+                items.add(update[3])
+            elif update[1] not in items:
+                return f"無此項目：{update[1]}，請重新輸入。"
+            else:
+                unknown = [name for name in update[2] if name not in members]
+                if unknown:
+                    return f"成員 {'、'.join(unknown)} 不在成員名單中，請重新輸入。"
+
+        # 套用至帳本副本，結算與出圖都成功後才取代原帳本：
+        # 中途失敗時原帳本不變，使用者依提示重新輸入也不會重複計入
+        updated = type(processor).from_dict(processor.to_dict())
+        try:
+            for update in updates:
+                if update[0] == "payment":
+                    updated.add_payment(update[1], update[2], update[3])
+                else:
+                    updated.exclude(update[1], update[2])
+            with stage("settlement"):
+                updated.settle()
+            self.generate_and_send_chart(context, updated, event, settled=True)
+        except Exception as e:
+            return f"追加資料處理失敗：{str(e)}，請重新輸入。"
+        context["processor"] = updated
+        return (
+            "帳本已更新！\n"
+            "可繼續追加（例如：Bob付了50元飲料、飲料沒Alice），\n"
+            "或輸入「重置」重新開始。"
+        )
+
     def handle_manual_input(self, context, user_message, event):
         """
         step=manual_input：
@@ -200,13 +371,20 @@ class MessageHandler:
 
     def handle_input(self, context, user_message):
         """
-        呼叫 OpenAI API 做自動解析。
+        自動解析使用者輸入：標準格式先以本地文法解析，失敗才呼叫 OpenAI API。
         成功 => 回傳「解析結果」，等待是/否確認 => step=1
         失敗 => 累積retry_count，若達 max_retry => 提示手動輸入
         """
         try:
-            openai_response = self.call_openai_api(user_message)
-            context["data"] = openai_response.strip()
+            sections = parse_canonical_input(user_message)
+            if sections is not None:
+                # 標準格式：本地解析即可，不需呼叫 OpenAI
+                context["data"] = format_sections(sections)
+                context["source"] = None
+            else:
+                openai_response = self.call_openai_api(user_message)
+                context["data"] = openai_response.strip()
+                context["source"] = user_message
             return f"解析結果如下：\n{context['data']}\n請確認是否正確？（是/否）"
         except Exception as e:
             context["retry_count"] += 1
@@ -239,27 +417,20 @@ class MessageHandler:
         """
         try:
             processor = context["processor"]
-            data = self.clean_data(context["data"])
 
-            # 以標題進行分割
-            parsed_text = self.split_into_three_sections(data)
-            if len(parsed_text) != 3:
-                return (
-                    f"解析失敗，以下段落可能缺失或格式錯誤：\n{parsed_text}。\n請檢查輸入內容並重試。",
-                    1
-                )
-
-            # 處理三段資料
-            processor.process_members(parsed_text[0])
-            processor.process_payments(parsed_text[1])
-            processor.process_splits(parsed_text[2])
+            # 單次掃描解析三段資料（成員、付款、分攤）並載入
+            try:
+                with stage("parse"):
+                    processor.load_ledger(parse_ledger(context["data"]))
+            except ValueError as e:
+                return (f"解析失敗，段落可能缺失或格式錯誤：{e}\n請檢查輸入內容並重試。", 1)
 
             # 計算結果 & 生成圖表
             self.generate_and_send_chart(context, processor, event)
 
             # 完成
             context["data"] = None
-            return ("流程已完成！如需重新開始，請直接輸入任意文字或「重置」。", 3)
+            return ("流程已完成！如需追加付款，請直接輸入（例如：Bob付了50元飲料）；如需重新開始，請輸入「重置」。", 3)
 
         except Exception as e:
             return (f"處理解析時發生錯誤：{str(e)}，請檢查您的輸入格式。", 1)
@@ -268,7 +439,12 @@ class MessageHandler:
         """
         使用者否定結果，retry_count++，若2次後 => step=manual_input
         否則 => 重呼叫 openai_api 重新解析
+        被否定的解析結果自快取移除，重新解析的結果存入原始輸入的快取位置，
+        使用者再次傳送同一份帳本時不會拿回被否定的結果。
         """
+        source = context.get("source")
+        if source is not None:
+            self.response_cache.pop(self.openai_cache_key(source))
         context["retry_count"] += 1
         if context["retry_count"] >= 2:
             # 進入手動輸入模式
@@ -284,8 +460,10 @@ class MessageHandler:
                 "manual_input"
             )
         try:
-            # 再次呼叫 openai_api 解析 data
-            openai_response = self.call_openai_api(context["data"])
+            # 再次呼叫 openai_api 解析 data（略過快取，否則只會拿回同一個結果）
+            openai_response = self.call_openai_api(context["data"], use_cache=False)
+            if source is not None:
+                self.store_openai_response(self.openai_cache_key(source), openai_response)
             context["data"] = openai_response.strip()
             return (f"解析結果如下（重新解析）：\n{context['data']}\n請確認是否正確？（是/否）", 1)
         except Exception as e:
@@ -294,71 +472,84 @@ class MessageHandler:
     # -------------------------------------------------------------------------
     # OpenAI / 人工解析 共用工具
     # -------------------------------------------------------------------------
-    def call_openai_api(self, user_message):
-        """調用 OpenAI API 分析使用者輸入"""
-        try:
-            response = openai.ChatCompletion.create(
-                model=self.openai_model,
-                messages=[
-                    {"role": "system", "content": (
-                        "你是記帳助手，請根據以下格式解析訊息：\n"
-                        "【一、成員名單】\n用頓號區隔的成員名單\n"
-                        "【二、付款記錄】\n每行格式為：[成員]付了[金額]元[項目]\n"
-                        "【三、分攤情況】\n每行格式為：[項目]沒[成員]\n\n"
-                        "特別規則：\n"
-                        "1. 如果用戶在【分攤狀況】打'無'，則【分攤情況】應顯示為'所有均分'。\n"
-                        "2. 嚴格按照上述格式輸出，並確保解析結果準確。"
-                    )},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            return response.choices[0]["message"]["content"]
-        except Exception as e:
-            raise RuntimeError(f"OpenAI API 呼叫失敗：{str(e)}")
-
-    def clean_data(self, raw_data):
+    def normalize_message(self, user_message):
         """
-        清理解析後的資料，把空白行移除
-        回傳純淨的文字
+        正規化使用者輸入作為快取鍵：
+        全形轉半形、每行空白收斂為單一空白、移除空行
         """
-        lines = [line.strip() for line in raw_data.splitlines() if line.strip()]
-        return "\n".join(lines)
+        text = unicodedata.normalize("NFKC", user_message)
+        lines = (" ".join(line.split()) for line in text.splitlines())
+        return "\n".join(line for line in lines if line)
+
+    def openai_cache_key(self, user_message):
+        """快取鍵：正規化輸入 + 模型名稱 + 提示詞雜湊"""
+        return (self.normalize_message(user_message), self.openai_model, OPENAI_PROMPT_HASH)
+
+    def openai_messages(self, user_message):
+        return [
+            {"role": "system", "content": OPENAI_SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ]
+
+    def cached_openai_response(self, user_message):
+        """回傳 (快取鍵, 快取的解析結果)；未命中時結果為 None"""
+        key = self.openai_cache_key(user_message)
+        return key, self.response_cache.get(key)
+
+    def store_openai_response(self, key, content):
+        """將解析結果存入快取（key 為 None 表示略過快取），回傳 content"""
+        if key is not None:
+            self.response_cache.set(key, content)
+        return content
 
-    def split_into_three_sections(self, data):
+    def call_openai_api(self, user_message, use_cache=True):
         """
-        以標題進行分割，並移除標題本身
+        調用 OpenAI API 分析使用者輸入。
+        use_cache=False 時略過快取（用於使用者否定結果後的重新解析）。
         """
-        parts = re.split(r"(【一、成員名單】|【二、付款記錄】|【三、分攤情況】)", data)
-        # 重新拼成三段：['成員內容', '付款內容', '分攤內容']
-        merged = [
-            f"{parts[i+1]}".strip()
-            for i in range(1, len(parts)-1, 2)
-        ]
-        return merged
+        key, cached = self.cached_openai_response(user_message) if use_cache else (None, None)
+        if cached is not None:
+            return cached
+        try:
+            content = self.openai_client.chat(self.openai_messages(user_message), max_tokens=500, temperature=0.7)
+        except Exception as e:
+            raise RuntimeError(f"OpenAI API 呼叫失敗：{str(e)}")
+        return self.store_openai_response(key, content)
 
-    def generate_and_send_chart(self, context, processor, event):
+    async def acall_openai_api(self, user_message, use_cache=True):
+        """call_openai_api 的非同步版本：大量解析請求可同時進行而不佔用執行緒"""
+        key, cached = self.cached_openai_response(user_message) if use_cache else (None, None)
+        if cached is not None:
+            return cached
+        try:
+            content = await self.openai_client.achat(
+                self.openai_messages(user_message), max_tokens=500, temperature=0.7
+            )
+        except Exception as e:
+            raise RuntimeError(f"OpenAI API 呼叫失敗：{str(e)}")
+        return self.store_openai_response(key, content)
+
+    def generate_and_send_chart(self, context, processor, event, settled=False):
         """
         計算完後生成圖表，回傳使用者
+        settled：已結算（增量更新後已呼叫 settle()，避免重新計算整本帳）
         """
-        result = processor.calculate_and_format()
+        if not settled:
+            with stage("settlement"):
+                processor.calculate()
+        ChartGenerator = lazy_import("expense_chart_generator").ChartGenerator  # 延遲載入 plotly，縮短冷啟動時間
         summary_data = processor.get_summary()
         chart_generator = ChartGenerator(summary_data)
-        chart_path = chart_generator.generate_charts(output_dir="static/charts")
+        with stage("chart"):
+            chart_name = chart_generator.publish(self.artifact_store)
 
-        context["chart_path"] = f"{self.base_url}/chart/{os.path.basename(chart_path)}"
+        # 物件儲存提供有時效的直接下載網址；本機儲存則經由 /chart 路由
+        context["chart_path"] = self.artifact_store.url(chart_name) or f"{self.base_url}/chart/{chart_name}"
 
-        # 回傳計算結果
-        self.line_bot_api.push_message(
-            event.source.user_id,
-            TextSendMessage(text=f"計算結果如下：\n{result}")
-        )
-        # 推送圖表連結
-        self.line_bot_api.push_message(
-            event.source.user_id,
-            TextSendMessage(text=f"圖表生成完畢！您可以從以下連結查看圖表：\n{context['chart_path']}")
-        )
+        # 計算結果（依字數上限分則，過長時改送摘要）與圖表連結：與本次回覆合併送出
+        for text in processor.output_messages(MAX_TEXT_LENGTH, RESULT_MAX_MESSAGES, header="計算結果如下：\n"):
+            self.queue_message(event, text)
+        self.queue_message(event, f"圖表生成完畢！您可以從以下連結查看圖表：\n{context['chart_path']}")
 
     # -------------------------------------------------------------------------
     # 手動解析 (manual_input) 處理
@@ -371,32 +562,18 @@ class MessageHandler:
         """
         try:
             processor = context["processor"]
-            data = self.clean_data(context["data"])
-
-            # 分段
-            parsed_text = re.split(r"(【一、成員名單】|【二、付款記錄】|【三、分攤情況】)", data)
-            # 重新拼三段
-            merged = [
-                f"{parsed_text[i+1]}".strip()
-                for i in range(1, len(parsed_text)-1, 2)
-            ]
-            if len(merged) != 3:
-                return (
-                    "解析失敗，以下段落可能缺失或格式錯誤：\n"
-                    f"{merged}\n"
-                    "請檢查輸入內容並重新輸入。",
-                    "manual_input"
-                )
 
-            # 分別處理三段
-            processor.process_members(merged[0])
-            processor.process_payments(merged[1])
-            processor.process_splits(merged[2])
+            # 單次掃描解析三段資料並載入
+            try:
+                with stage("parse"):
+                    processor.load_ledger(parse_ledger(context["data"]))
+            except ValueError as e:
+                return (f"解析失敗，段落可能缺失或格式錯誤：{e}\n請檢查輸入內容並重新輸入。", "manual_input")
 
             # 出圖
             self.generate_and_send_chart(context, processor, event)
             context["data"] = None
-            return ("流程已完成！如需重新開始，請直接輸入任意文字或「重置」。", 3)
+            return ("流程已完成！如需追加付款，請直接輸入（例如：Bob付了50元飲料）；如需重新開始，請輸入「重置」。", 3)
 
         except Exception as e:
             return (f"手動輸入解析時發生錯誤：{str(e)}", "manual_input")
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+from linebot.exceptions import InvalidSignatureError
+from linebot.webhook import WebhookParser
+from session_store import DEFAULT_SESSION_DB_PATH, MemorySessionStore, SQLiteSessionStore
+
+logger = logging.getLogger(__name__)
+
+
+class _VerifiedSignature:
+    """簽名已在外層驗證過，解析單一事件時不再重複計算"""
+
+    def validate(self, body, signature):
+        return True
+
+
+class WebhookDeduplicator:
+    """
+    Webhook 重送去重：
+    LINE 在回應太慢或失敗時會重送事件（webhookEventId 不變），
+    以有 TTL 的儲存記錄已受理的事件 ID，重送的事件直接略過，不重複呼叫 OpenAI、出圖或推播。
+    store 為 SessionStore（記憶體或與 session 共用的 SQLite），需支援原子的 add()。
+    """
+
+    KEY_PREFIX = "webhook:"
+
+    def __init__(self, store):
+        self.store = store
+        self._parser = WebhookParser("")
+        self._parser.signature_validator = _VerifiedSignature()
+        self.duplicates = 0  # 被略過的重送事件數
+
+    def claim(self, event_id):
+        """第一次看到此事件 ID => 回傳 True；已受理過 => False。沒有 ID 的事件一律處理"""
+        if not event_id:
+            return True
+        return self.store.add(self.KEY_PREFIX + event_id, {"claimed": True})
+
+    def release(self, event_id):
+        """處理失敗時釋放事件 ID，讓 LINE 重送時可再次處理"""
+        if event_id:
+            self.store.delete(self.KEY_PREFIX + event_id)
+
+    def parse(self, parser, body, signature):
+        """
+        驗證簽名並解析事件，略過已受理的重送事件。
+        回傳 [(webhookEventId, event)]；簽名錯誤時拋出 InvalidSignatureError。
+        """
+        if not parser.signature_validator.validate(body, signature):
+            raise InvalidSignatureError("Invalid signature. signature=" + signature)
+        fresh = []
+        for raw in json.loads(body).get("events", []):
+            event_id = raw.get("webhookEventId")
+            if not self.claim(event_id):
+                self.duplicates += 1
+                logger.info("略過重送的事件 %s", event_id)
+                continue
+            # 逐筆解析：SDK 會略過未知類型的事件，逐筆才能保留事件與 ID 的對應
+            for event in self._parser.parse(json.dumps({"events": [raw]}), ""):
+                fresh.append((event_id, event))
+        return fresh
+
+
+def create_webhook_deduplicator():
+    """
+    依環境變數建立去重器：
+    WEBHOOK_DEDUP_BACKEND：memory 或 sqlite（預設與 SESSION_BACKEND 相同，多行程共用時使用 session 的 SQLite 資料庫）
+    WEBHOOK_DEDUP_TTL：事件 ID 保留時間（秒）
+    WEBHOOK_DEDUP_SIZE：memory 後端最多保留的事件 ID 數
+    """
+    backend = os.getenv("WEBHOOK_DEDUP_BACKEND", os.getenv("SESSION_BACKEND", "memory")).lower()
+    ttl = int(os.getenv("WEBHOOK_DEDUP_TTL", "3600"))
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", DEFAULT_SESSION_DB_PATH)
+        return WebhookDeduplicator(SQLiteSessionStore(path, ttl=ttl, table="webhook_events"))
+    if backend == "memory":
+        return WebhookDeduplicator(MemorySessionStore(max_users=int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000")), ttl=ttl))
+    raise ValueError(f"未知的 WEBHOOK_DEDUP_BACKEND：{backend}")